@@ -0,0 +1,85 @@
+"""
+Benchmarks upstream fan-outs (service info, data types, workflows) against local fake services, with caching disabled,
+to measure per-fan-out overhead in the registry itself (logging, validation, merging, etc.)
+
+Usage: python -m benchmarks.bench_fanout [n_services] [iterations] > /dev/null
+  (log output goes to stdout; results go to stderr.)
+"""
+
+import asyncio
+import sys
+
+from .common import build_config, fake_services, report, time_async
+
+
+async def bench_fanout(n_services: int, iterations: int, log_upstream_success_sample_rate: float):
+    from bento_service_registry.bento_services_json import BentoServicesByKind
+    from bento_service_registry.data_types import DataTypeManager
+    from bento_service_registry.http_session import create_http_session
+    from bento_service_registry.logger import get_logger
+    from bento_service_registry.services import ServiceManager
+    from bento_service_registry.types import BentoService
+    from bento_service_registry.workflows import WorkflowManager
+
+    config = build_config(
+        cache_ttl=0,
+        data_type_cache_ttl=0,
+        workflow_cache_ttl=0,
+        log_upstream_success_sample_rate=log_upstream_success_sample_rate,
+    )
+    logger = get_logger(config)
+
+    service_manager = ServiceManager(config, logger)
+    data_type_manager = DataTypeManager(config, logger)
+    workflow_manager = WorkflowManager(config, logger)
+
+    label = f"[{n_services} services, log sample rate={log_upstream_success_sample_rate}]"
+
+    async with fake_services(n_services) as services:
+        bento_services_by_kind: BentoServicesByKind = {
+            s["bento"]["serviceKind"]: BentoService(
+                service_kind=s["bento"]["serviceKind"], url_template=s["url"], repository="", url=s["url"]
+            )
+            for s in services
+        }
+        self_service_info = {**services[0], "bento": {"serviceKind": "service-registry"}}
+
+        http_session = create_http_session(config)
+        try:
+            report(
+                f"services {label}",
+                await time_async(
+                    lambda: service_manager.get_services(None, bento_services_by_kind, http_session, self_service_info),
+                    iterations,
+                ),
+            )
+            report(
+                f"data types {label}",
+                await time_async(
+                    lambda: data_type_manager.get_data_types(
+                        None, http_session, services, bento_services_by_kind, None, None
+                    ),
+                    iterations,
+                ),
+            )
+            report(
+                f"workflows {label}",
+                await time_async(
+                    lambda: workflow_manager.get_workflows(None, http_session, services, bento_services_by_kind),
+                    iterations,
+                ),
+            )
+        finally:
+            await http_session.close()
+
+
+async def main():
+    n_services = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    for sample_rate in (1.0, 0.0):
+        await bench_fanout(n_services, iterations, sample_rate)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
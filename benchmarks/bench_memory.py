@@ -0,0 +1,107 @@
+"""
+Benchmarks the memory held by the registry's upstream response caches (service info, data types, workflows) once they
+have been filled with responses for many scopes (projects) and authorization headers, from local fake services.
+
+Usage: python -m benchmarks.bench_memory [n_services] [n_projects] [n_tokens] > /dev/null
+  (log output goes to stdout; results go to stderr.)
+"""
+
+import asyncio
+import gc
+import sys
+import tracemalloc
+from collections.abc import Awaitable, Callable
+
+from .common import build_config, fake_services
+
+
+async def _retained(build: Callable[[], Awaitable[object]]) -> int:
+    """
+    Bytes still allocated by a manager (and everything it holds on to) after build() fills its caches, measured as the
+    memory freed once the manager is dropped.
+    """
+    tracemalloc.start()
+    try:
+        manager = await build()
+        gc.collect()
+        filled = tracemalloc.get_traced_memory()[0]
+        del manager
+        gc.collect()
+        return filled - tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def _report(name: str, n_bytes: int, n_entries: int):
+    print(
+        f"{name:<48} total={n_bytes / 1024:10.1f}KiB  per entry={n_bytes / n_entries:10.1f}B  n={n_entries}",
+        file=sys.stderr,
+    )
+
+
+async def bench_memory(n_services: int, n_projects: int, n_tokens: int):
+    from bento_service_registry.bento_services_json import BentoServicesByKind
+    from bento_service_registry.data_types import DataTypeManager
+    from bento_service_registry.http_session import create_http_session
+    from bento_service_registry.logger import get_logger
+    from bento_service_registry.services import ServiceManager
+    from bento_service_registry.types import BentoService
+    from bento_service_registry.workflows import WorkflowManager
+
+    config = build_config(log_upstream_success_sample_rate=0.0)
+    logger = get_logger(config)
+
+    label = f"[{n_services} services, {n_projects} projects, {n_tokens} tokens]"
+    tokens = [{"Authorization": f"Bearer token-{t}"} for t in range(n_tokens)]
+
+    async with fake_services(n_services) as services:
+        bento_services_by_kind: BentoServicesByKind = {
+            s["bento"]["serviceKind"]: BentoService(
+                service_kind=s["bento"]["serviceKind"], url_template=s["url"], repository="", url=s["url"]
+            )
+            for s in services
+        }
+        self_service_info = {**services[0], "bento": {"serviceKind": "service-registry"}}
+
+        http_session = create_http_session(config)
+        try:
+
+            async def _services():
+                service_manager = ServiceManager(config, logger)
+                await service_manager.get_services(None, bento_services_by_kind, http_session, self_service_info)
+                return service_manager
+
+            async def _data_types():
+                data_type_manager = DataTypeManager(config, logger)
+                for token in tokens:
+                    for p in range(n_projects):
+                        await data_type_manager.get_data_types(
+                            token, http_session, services, bento_services_by_kind, f"project-{p}", None
+                        )
+                return data_type_manager
+
+            async def _workflows():
+                workflow_manager = WorkflowManager(config, logger)
+                for token in tokens:
+                    await workflow_manager.get_workflows(token, http_session, services, bento_services_by_kind)
+                return workflow_manager
+
+            # Service info is cached once per service, regardless of the authorization header; data types are cached
+            # per service, scope, and authorization header; workflows per service and authorization header.
+            _report(f"services {label}", await _retained(_services), n_services)
+            _report(f"data types {label}", await _retained(_data_types), n_services * n_projects * n_tokens)
+            _report(f"workflows {label}", await _retained(_workflows), n_services * n_tokens)
+        finally:
+            await http_session.close()
+
+
+async def main():
+    n_services = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n_projects = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    n_tokens = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    await bench_memory(n_services, n_projects, n_tokens)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
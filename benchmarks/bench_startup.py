@@ -0,0 +1,59 @@
+"""
+Benchmarks worker start-up: importing the app module, building the app with the app factory, and serving a first
+request, each in a fresh Python process (so that nothing is already imported or cached.)
+
+Usage: python -m benchmarks.bench_startup [iterations] > /dev/null
+  (log output goes to stdout; results go to stderr.)
+"""
+
+import subprocess
+import sys
+
+import orjson
+
+from .common import report
+
+# Run in each fresh process; prints the time taken by each phase as JSON on the last line of stdout.
+_STARTUP_SCRIPT = """
+import time
+
+t0 = time.perf_counter()
+import bento_service_registry.app
+t1 = time.perf_counter()
+
+from fastapi.testclient import TestClient
+from benchmarks.common import build_config
+
+config = build_config()
+app = bento_service_registry.app.create_app(lambda: config)
+t2 = time.perf_counter()
+
+with TestClient(app) as client:
+    t3 = time.perf_counter()
+    assert client.get("/service-info").status_code == 200
+    t4 = time.perf_counter()
+
+import orjson
+print(orjson.dumps({"import": t1 - t0, "create app": t2 - t1, "first request": t4 - t3}).decode())
+"""
+
+
+def _run_once() -> dict[str, float]:
+    res = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT], capture_output=True, check=True)
+    return orjson.loads(res.stdout.strip().splitlines()[-1])
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    times: dict[str, list[float]] = {}
+    for _ in range(iterations):
+        for phase, t in _run_once().items():
+            times.setdefault(phase, []).append(t)
+
+    for phase, phase_times in times.items():
+        report(f"startup: {phase}", phase_times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import orjson
+from aiohttp import web
+
+__all__ = [
+    "BENCHMARK_BENTO_SERVICES",
+    "build_config",
+    "fake_services",
+    "time_async",
+    "report",
+]
+
+BENCHMARK_BENTO_SERVICES = Path(__file__).parent.parent / "tests" / "bento_services.json"
+
+
+def build_config(**kwargs):
+    from bento_service_registry.config import Config
+
+    return Config(
+        bento_services=BENCHMARK_BENTO_SERVICES,
+        bento_public_url="http://127.0.0.1:5000/",
+        bento_admin_public_url="http://127.0.0.1:5000/",
+        bento_authz_service_url="http://bento-auth.local",
+        bento_json_logs=True,
+        **kwargs,
+    )
+
+
+def _data_type(i: int, count: int) -> dict:
+    return {
+        "label": f"Data Type {i}",
+        "queryable": True,
+        "schema": {"type": "object", "properties": {f"prop_{j}": {"type": "string"} for j in range(50)}},
+        "metadata_schema": {"type": "object"},
+        "id": f"data-type-{i}",
+        "count": count,
+    }
+
+
+def _workflow(i: int) -> dict:
+    return {
+        "name": f"Workflow {i}",
+        "type": "ingestion",
+        "description": "A benchmark workflow",
+        "file": f"workflow_{i}.wdl",
+        "tags": ["a", "b"],
+        "inputs": [{"id": "project_dataset", "type": "project:dataset"}, {"id": "json_document", "type": "file"}],
+    }
+
+
+@asynccontextmanager
+async def fake_services(n_services: int, n_data_types: int = 3, n_workflows: int = 10):
+    """
+    Runs a local HTTP server pretending to be n_services Bento data services (at /<n>/...), and yields a tuple of
+    service info dicts for them.
+    """
+
+    # data type counts differ between projects (as they would in a real instance), but not between callers
+    data_types_by_project: dict[str | None, bytes] = {}
+    workflows = orjson.dumps({"ingestion": {f"wf-{i}": _workflow(i) for i in range(n_workflows)}})
+
+    def _service_info(n: str) -> dict:
+        return {
+            "id": f"ca.c3g.bento:fake-{n}",
+            "name": f"Fake {n}",
+            "type": {"group": "ca.c3g.bento", "artifact": f"fake-{n}", "version": "1.0.0"},
+            "organization": {"name": "C3G", "url": "https://c3g.ca"},
+            "version": "1.0.0",
+            "bento": {"serviceKind": f"fake-{n}", "dataService": True},
+        }
+
+    async def service_info_handler(request: web.Request):
+        return web.json_response(_service_info(request.match_info["n"]))
+
+    async def data_types_handler(request: web.Request):
+        project = request.query.get("project")
+        if (data_types := data_types_by_project.get(project)) is None:
+            offset = len(data_types_by_project)
+            data_types = data_types_by_project[project] = orjson.dumps(
+                [_data_type(i, offset + i) for i in range(n_data_types)]
+            )
+        return web.Response(body=data_types, content_type="application/json")
+
+    async def workflows_handler(_request: web.Request):
+        return web.Response(body=workflows, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/{n}/service-info", service_info_handler)
+    app.router.add_get("/{n}/data-types", data_types_handler)
+    app.router.add_get("/{n}/workflows", workflows_handler)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        yield tuple({**_service_info(str(n)), "url": f"{base_url}/{n}"} for n in range(n_services))
+    finally:
+        await runner.cleanup()
+
+
+async def time_async(fn: Callable[[], Awaitable], iterations: int) -> list[float]:
+    times: list[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list[float]):
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    p95 = times[int(len(times) * 0.95) - 1]
+    # Benchmark results go to stderr, so that they can be separated from log output (stdout)
+    print(f"{name:<48} mean={mean * 1000:8.3f}ms  p95={p95 * 1000:8.3f}ms  n={len(times)}", file=sys.stderr)
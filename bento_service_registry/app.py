@@ -1,17 +1,34 @@
-from collections.abc import Callable
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 
+from bento_lib.auth.exceptions import BentoAuthException
 from bento_lib.logging.structured.fastapi import build_structlog_fastapi_middleware
-from bento_lib.responses.fastapi_errors import http_exception_handler_factory, validation_exception_handler_factory
+from bento_lib.responses.fastapi_errors import (
+    bento_auth_exception_handler_factory,
+    http_exception_handler_factory,
+    validation_exception_handler_factory,
+)
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from .authz import authz_middleware
+from .authz import build_authz_middleware
 from .config import Config, get_config
 from .constants import BENTO_SERVICE_KIND
+from .data_types import get_data_type_manager
+from .federation import get_peer_registry_manager
+from .health import get_health_prober
+from .inflight import ClientDisconnected, DisconnectMiddleware, client_disconnected_handler
 from .logger import get_logger
+from .loop_lag import get_loop_lag_monitor
+from .profiling import build_profiling_middleware
 from .routes import service_registry
+from .services import get_service_manager
+from .snapshot import CacheSnapshotter
+from .tracing import build_tracing_middleware, get_tracer
+from .transport import close_unix_socket_sessions
+from .workflows import get_workflow_manager
 
 __all__ = [
     "create_app",
@@ -19,9 +36,36 @@ __all__ = [
 
 
 def create_app(config_override: Callable[[], Config] | None = None) -> FastAPI:
-    app = FastAPI()
-
     config_for_setup: Config = (config_override or get_config)()
+    logger = get_logger(config_for_setup)
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+        snapshotter = CacheSnapshotter(
+            config_for_setup,
+            logger,
+            get_service_manager(config_for_setup, logger),
+            get_data_type_manager(config_for_setup, logger),
+            get_workflow_manager(config_for_setup, logger),
+        )
+
+        peer_registry_manager = get_peer_registry_manager(config_for_setup, logger)
+        health_prober = get_health_prober(config_for_setup, logger)
+        loop_lag_monitor = get_loop_lag_monitor(config_for_setup)
+
+        await loop_lag_monitor.start()
+        await snapshotter.start()
+        await peer_registry_manager.start()
+        await health_prober.start()
+        yield
+        await health_prober.stop()
+        await peer_registry_manager.stop()
+        await snapshotter.stop()
+        await loop_lag_monitor.stop()
+        await close_unix_socket_sessions()
+
+    app = FastAPI(lifespan=lifespan)
+
     if config_override:
         # noinspection PyUnresolvedReferences
         app.dependency_overrides[get_config] = config_override
@@ -36,15 +80,30 @@ def create_app(config_override: Callable[[], Config] | None = None) -> FastAPI:
         allow_methods=["*"],
     )
 
+    # Record traces of requests which contact upstream services, for the admin traces endpoint
+    if (tracer := get_tracer(config_for_setup)).enabled:
+        app.middleware("http")(build_tracing_middleware(tracer))
+
+    # Non-standard middleware setup so that we can use the instance for dependencies too (see authz.py)
+    authz_middleware = build_authz_middleware(config_for_setup, logger)
+    app.state.authz_middleware = authz_middleware
+
+    # In debug mode, requests can be profiled individually (by admins) by sending them with an X-Profile header
+    if config_for_setup.bento_debug:
+        app.middleware("http")(build_profiling_middleware(authz_middleware))
+
     # Add structlog FastAPI access log middleware
     app.middleware("http")(build_structlog_fastapi_middleware(BENTO_SERVICE_KIND))
 
-    # Non-standard middleware setup so that we can import the instance and use it for dependencies too
     authz_middleware.attach(app)
 
-    app.exception_handler(StarletteHTTPException)(
-        http_exception_handler_factory(get_logger(config_for_setup), authz_middleware)
-    )
+    # Outermost, so that it sees the client disconnecting no matter what the other middleware are doing; work done for
+    # requests whose clients have gone away is abandoned (see inflight.py.)
+    app.add_middleware(DisconnectMiddleware)
+
+    app.exception_handler(StarletteHTTPException)(http_exception_handler_factory(logger, authz_middleware))
+    app.exception_handler(BentoAuthException)(bento_auth_exception_handler_factory(logger, authz_middleware))
     app.exception_handler(RequestValidationError)(validation_exception_handler_factory(authz_middleware))
+    app.exception_handler(ClientDisconnected)(client_disconnected_handler)
 
     return app
@@ -1,16 +1,61 @@
+from typing import Annotated
+
 from bento_lib.auth.middleware.fastapi import FastApiAuthMiddleware
+from bento_lib.auth.permissions import P_EDIT_PERMISSIONS
+from bento_lib.auth.resources import RESOURCE_EVERYTHING
+from fastapi import Depends, Request
+from structlog.stdlib import BoundLogger
 
-from .config import get_config
-from .logger import get_logger
+from .config import Config
 
 __all__ = [
-    "authz_middleware",
+    "build_authz_middleware",
+    "get_authz_middleware",
+    "AuthzMiddlewareDependency",
+    "dep_public_endpoint",
+    "dep_admin_endpoint",
+    "require_admin",
 ]
 
-# TODO: Find a way to DI these
-config = get_config()
-logger = get_logger(config)
+
+def build_authz_middleware(config: Config, logger: BoundLogger) -> FastApiAuthMiddleware:
+    return FastApiAuthMiddleware.build_from_pydantic_config(config, logger)
+
+
+def get_authz_middleware(request: Request) -> FastApiAuthMiddleware:
+    # The middleware instance is built by the app factory (rather than at import time, so that importing this package
+    # doesn't require configuration) and stored in the app state, so that endpoint dependencies can use it too.
+    return request.app.state.authz_middleware
+
+
+AuthzMiddlewareDependency = Annotated[FastApiAuthMiddleware, Depends(get_authz_middleware)]
+
+
+def _public_endpoint(request: Request, authz_middleware: AuthzMiddlewareDependency):
+    # Equivalent to FastApiAuthMiddleware.dep_public_endpoint(), but for the app's middleware instance
+    if authz_middleware.enabled:
+        authz_middleware.mark_authz_done(request)
+
+
+# Debugging/admin endpoints expose internals (e.g., upstream URLs and timings) of the whole instance, so they're limited
+# to those who can edit permissions for everything; i.e., instance administrators.
+async def require_admin(request: Request, authz_middleware: FastApiAuthMiddleware, set_authz_flag: bool = False):
+    # Raises a BentoAuthException (turned into an error response by the authz middleware) unless the request is from an
+    # instance administrator.
+    if authz_middleware.enabled:
+        await authz_middleware.async_check_authz_evaluate(
+            request,
+            frozenset({P_EDIT_PERMISSIONS}),
+            RESOURCE_EVERYTHING,
+            require_token=True,
+            set_authz_flag=set_authz_flag,
+        )
+
+
+async def _admin_endpoint(request: Request, authz_middleware: AuthzMiddlewareDependency):
+    # Equivalent to FastApiAuthMiddleware.dep_require_permissions_on_resource(...), but for the app's middleware instance
+    await require_admin(request, authz_middleware, set_authz_flag=True)
 
 
-# Non-standard middleware setup so that we can import the instance and use it for dependencies too
-authz_middleware = FastApiAuthMiddleware.build_from_pydantic_config(config, logger)
+dep_public_endpoint = Depends(_public_endpoint)
+dep_admin_endpoint = Depends(_admin_endpoint)
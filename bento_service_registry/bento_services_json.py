@@ -22,23 +22,31 @@ BentoServicesByComposeID = dict[str, BentoService]
 BentoServicesByKind = dict[str, BentoService]
 
 
+def _format_url_template(config: Config, url_template: str, sv: dict) -> str:
+    return url_template.format(
+        BENTO_URL=config.bento_admin_public_url,  # Deprecated; for back-compat
+        BENTO_PUBLIC_URL=config.bento_public_url,
+        BENTO_ADMIN_PUBLIC_URL=config.bento_admin_public_url,
+        BENTO_PORTAL_PUBLIC_URL=config.bento_admin_public_url,  # Deprecated; for back-compat
+        **sv,
+    )
+
+
+def _build_bento_service(config: Config, sv: dict) -> BentoService:
+    service: dict = {**sv, "url": _format_url_template(config, sv["url_template"], sv)}
+    if internal_url_template := sv.get("internal_url_template"):
+        service["internal_url"] = _format_url_template(config, internal_url_template, sv)
+    return BentoService(**service)  # type: ignore
+
+
 # cache bento_services.json contents for the lifetime of the service:
 @alru_cache()
 async def _get_bento_services_by_compose_id(config: Config) -> BentoServicesByComposeID:
     async with aiofiles.open(config.bento_services, "rb") as fh:
-        bento_services_data: BentoServicesByComposeID = orjson.loads(await fh.read())
+        bento_services_data: dict[str, dict] = orjson.loads(await fh.read())
 
     return {
-        sk: BentoService(
-            **sv,
-            url=sv["url_template"].format(
-                BENTO_URL=config.bento_admin_public_url,  # Deprecated; for back-compat
-                BENTO_PUBLIC_URL=config.bento_public_url,
-                BENTO_ADMIN_PUBLIC_URL=config.bento_admin_public_url,
-                BENTO_PORTAL_PUBLIC_URL=config.bento_admin_public_url,  # Deprecated; for back-compat
-                **sv,
-            ),
-        )  # type: ignore
+        sk: _build_bento_service(config, sv)
         for sk, sv in bento_services_data.items()
         # Filter out disabled entries and entries without service_kind, which may be external/'transparent'
         # - e.g., the gateway.
@@ -0,0 +1,73 @@
+import time
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from hashlib import blake2b
+from typing import Any, Generic, TypeVar
+
+import orjson
+
+__all__ = [
+    "CacheEntry",
+    "Interner",
+]
+
+
+T = TypeVar("T")
+
+
+class CacheEntry(Generic[T]):
+    """
+    A cached value and when it was fetched. Fetch times are monotonic clock readings (time.monotonic()), which are cheap
+    to take and compare, and aren't affected by changes to the system clock; they're only converted to wall clock times
+    for snapshots. Slotted, since there can be a lot of these (one per service x scope x authorization header.)
+    """
+
+    __slots__ = ("fetched", "value")
+
+    def __init__(self, value: T, fetched: float | None = None):
+        self.value: T = value
+        self.fetched: float = time.monotonic() if fetched is None else fetched
+
+    def age(self, now: float | None = None) -> float:
+        """
+        Age of the entry, in seconds, relative to now (a time.monotonic() reading; taken if not given.)
+        """
+        return (time.monotonic() if now is None else now) - self.fetched
+
+    def fetched_iso(self) -> str:
+        """
+        Wall clock fetch time of the entry, as an ISO 8601 string (for snapshots.)
+        """
+        return datetime.fromtimestamp(time.time() - self.age(), UTC).isoformat()
+
+    @classmethod
+    def from_fetched_iso(cls, value: T, fetched: str) -> "CacheEntry[T]":
+        """
+        Re-creates an entry from a snapshot, given its wall clock fetch time as an ISO 8601 string.
+        """
+        return cls(value, time.monotonic() - (time.time() - datetime.fromisoformat(fetched).timestamp()))
+
+
+class Interner:
+    """
+    Shares one copy of each distinct JSON-like value (e.g., a data type schema) between cache entries, rather than
+    keeping a copy per entry. Values are keyed by a digest of their canonical JSON serialization, so that the keys
+    themselves stay small. Interned values must not be mutated.
+    """
+
+    def __init__(self):
+        self._values: dict[bytes, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def intern(self, value: Any) -> Any:
+        key = blake2b(orjson.dumps(value, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+        return self._values.setdefault(key, value)
+
+    def retain(self, live: Iterable[Any]):
+        """
+        Forgets interned values which aren't in live (by identity), e.g., once the cache entries using them are gone.
+        """
+        live_ids = {id(v) for v in live}
+        self._values = {k: v for k, v in self._values.items() if id(v) in live_ids}
@@ -0,0 +1,116 @@
+import gzip
+from collections.abc import Callable
+from typing import Any
+
+from fastapi import Request, Response
+
+from .utils import IdentityCache
+
+try:  # Python 3.14+
+    from compression import zstd  # type: ignore
+except ImportError:  # pragma: no cover
+    try:  # backport (also used by aiohttp[speedups])
+        from backports import zstd  # type: ignore
+    except ImportError:
+        zstd = None
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+
+__all__ = [
+    "AVAILABLE_ENCODINGS",
+    "PrecompressedBody",
+    "PrecompressedBodyCache",
+    "negotiate_encoding",
+    "precompressed_json_response",
+]
+
+
+# In order of preference (when a client accepts several with equal quality values):
+_COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    **({"zstd": lambda b: zstd.compress(b, level=10)} if zstd is not None else {}),
+    **({"br": lambda b: brotli.compress(b, quality=9)} if brotli is not None else {}),
+    "gzip": lambda b: gzip.compress(b, compresslevel=6, mtime=0),
+}
+
+AVAILABLE_ENCODINGS: tuple[str, ...] = tuple(_COMPRESSORS.keys())
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+class PrecompressedBody:
+    """
+    A response body, along with compressed variants of it in each available encoding, built once up-front.
+    """
+
+    __slots__ = ("encoded", "identity")
+
+    def __init__(self, identity: bytes):
+        self.identity: bytes = identity
+        self.encoded: dict[str, bytes] = (
+            {enc: compress(identity) for enc, compress in _COMPRESSORS.items()}
+            if len(identity) >= MIN_COMPRESS_SIZE
+            else {}
+        )
+
+
+class PrecompressedBodyCache(IdentityCache[PrecompressedBody]):
+    """
+    Bounded LRU cache of pre-compressed response bodies, keyed by the identity of the object they were serialized from,
+    so that each body is only serialized and compressed once per change to the object.
+    """
+
+    def get_body(self, obj: Any, serialize: Callable[[Any], bytes]) -> PrecompressedBody:
+        return self.get(obj, lambda: PrecompressedBody(serialize(obj)))
+
+
+def negotiate_encoding(accept_encoding: str | None, available: tuple[str, ...] | list[str]) -> str | None:
+    """
+    Picks a content encoding from those available, based on an Accept-Encoding header value. Returns None if the body
+    should be sent as-is (identity encoding).
+    """
+
+    if not accept_encoding or not available:
+        return None
+
+    q_values: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, *params = (p.strip() for p in part.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            q_values[coding.lower()] = q
+
+    wildcard_q = q_values.get("*", 0.0)
+    best: str | None = None
+    best_q: float = 0.0
+    for enc in available:  # in order of preference, so only replace the best on a strictly-higher quality value
+        if (q := q_values.get(enc, wildcard_q)) > best_q:
+            best, best_q = enc, q
+
+    return best
+
+
+def precompressed_json_response(
+    request: Request,
+    cache: PrecompressedBodyCache,
+    obj: Any,
+    serialize: Callable[[Any], bytes],
+    headers: dict[str, str] | None = None,
+) -> Response:
+    body = cache.get_body(obj, serialize)
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+
+    if (enc := negotiate_encoding(request.headers.get("Accept-Encoding"), list(body.encoded.keys()))) is not None:
+        headers["Content-Encoding"] = enc
+        return Response(body.encoded[enc], media_type="application/json", headers=headers)
+
+    return Response(body.identity, media_type="application/json", headers=headers)
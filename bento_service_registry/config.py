@@ -24,8 +24,55 @@ class Config(BentoBaseConfig):
 
     bento_services: Path
     contact_timeout: int = 5  # service-info contact timeout for other services
+    # limits on concurrent requests to other services, across all incoming requests and background work:
+    upstream_max_concurrency: int = 64
+    upstream_max_concurrency_per_service: int = 8
+    # retries for failed requests to other services (connection errors, timeouts, 502/503/504 responses), with jittered
+    # exponential backoff (base delay, in seconds.) Retries are only made if there is time left before the contact
+    # timeout for one to succeed.
+    upstream_retries: int = 2
+    upstream_retry_backoff: float = 0.05
+    # if enabled, when a request to another service is taking longer than that service's recent 95th percentile response
+    # time, a second (hedged) request is made, and whichever responds first is used.
+    upstream_hedging: bool = False
+    # Failed requests to other services are remembered (per URL and authorization header) for a few seconds, so that
+    # clients retrying doomed requests (e.g., with an expired token) don't trigger a new request to the service each
+    # time. TTLs (in seconds; 0: don't cache) for 401/403 responses, for 5xx responses and connection errors, and for
+    # timeouts:
+    negative_cache_ttl_auth: int = 10
+    negative_cache_ttl_server_error: int = 2
+    negative_cache_ttl_timeout: int = 5
     cache_ttl: int = 30  # service-info cache TTL for other services (in seconds)
+    #  - workflow/data type caches for a service are also invalidated whenever that service's version changes, so these
+    #    TTLs can be set very high if workflows and data type schemas are the main concern (rather than data counts).
     workflow_cache_ttl: int = 3600  # workflow cache TTL from workflow providers (in seconds)
+    data_type_cache_ttl: int = 3600  # data type cache TTL from data services (in seconds)
+    # limit on concurrent requests to any one data service on behalf of a single /data-types/batch request
+    data_types_batch_concurrency_per_service: int = 4
+
+    # If set, non-user-specific cache contents are periodically saved here and restored (as stale entries) on startup:
+    cache_snapshot_path: Path | None = None
+    cache_snapshot_interval: int = 60  # (in seconds)
+
+    # Base URLs of other Bento nodes' service registries ("peers"), whose public services, data types, and workflows
+    # are merged with this node's own under /federation/...
+    peer_registries: tuple[str, ...] = ()
+    peer_cache_ttl: int = 60  # peer response cache TTL (in seconds); stale responses are served while re-fetching
+    peer_refresh_interval: int = 30  # how often peer responses are re-fetched in the background (in seconds; 0: never)
+
+    # Each service's /service-info is probed about every health_probe_interval seconds (0: never), and the results of the
+    # last health_history_size probes of each service are summarized at /services/health.
+    health_probe_interval: int = 60
+    health_history_size: int = 60
+
+    # Event loop lag is measured every loop_lag_check_interval seconds (0: never.) When it goes above
+    # loop_lag_degraded_threshold seconds, the registry switches into degraded mode (serving from caches regardless of
+    # age, postponing background work, and parsing upstream responses of at least degraded_parse_min_bytes bytes in a
+    # worker thread) until its moving average drops below loop_lag_recovered_threshold seconds.
+    loop_lag_check_interval: float = 0.1
+    loop_lag_degraded_threshold: float = 0.25
+    loop_lag_recovered_threshold: float = 0.05
+    degraded_parse_min_bytes: int = 65536
 
     bento_public_url: str
     bento_admin_public_url: str = Field(
@@ -38,6 +85,14 @@ class Config(BentoBaseConfig):
 
     authz_enabled: bool = True
 
+    # Fraction of routine per-service upstream request log events (e.g., successful fetches, cache hits) to log. One
+    # summary event (at debug level) is logged for every fan-out to all services regardless; errors are always logged.
+    log_upstream_success_sample_rate: float = 0.1
+
+    # Number of recent traces (of requests which contacted upstream services) to keep in memory, for the admin traces
+    # endpoint. Set to 0 to disable tracing.
+    trace_buffer_size: int = 64
+
 
 @lru_cache
 def get_config():
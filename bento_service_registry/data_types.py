@@ -1,9 +1,10 @@
 import asyncio
 import itertools
-from datetime import UTC, datetime
+import time
+from collections.abc import Sequence
 from functools import cache
 from typing import Annotated
-from urllib.parse import urlencode, urljoin
+from urllib.parse import urlencode
 
 import aiohttp
 import structlog.stdlib
@@ -11,32 +12,137 @@ from fastapi import Depends, status
 from pydantic import ValidationError
 
 from .authz_header import OptionalAuthzHeaderDependency, OptionalHeaders
-from .http_session import HTTPSessionDependency
+from .bento_services_json import BentoServicesByKind, BentoServicesByKindDependency
+from .cache_entry import CacheEntry, Interner
+from .config import Config, ConfigDependency
+from .http_session import HTTPSessionDependency, http_session_lease
+from .inflight import InFlight, until_disconnected
 from .logger import LoggerDependency
-from .models import DataTypeWithServiceURL
+from .loop_lag import get_loop_lag_monitor
+from .models import DataTypeWithServiceURL, SkippedItems, data_types_adapter
+from .scheduler import Priority
+from .service_versions import ServiceVersionTracker
 from .services import ServicesDependency
-from .utils import authz_header_digest, right_slash_normalize_url
+from .tracing import mark_error, span
+from .transport import bento_service_for, bento_services_by_url, get_upstream_target
+from .types import BentoService
+from .upstream import get_upstream_fetcher
+from .utils import ANONYMOUS_AUTHZ_DIGEST, authz_header_digest, right_slash_normalize_url, same_objects
 
 __all__ = [
     "DataTypesTuple",
+    "DataTypesScope",
+    "DataTypeManagerDependency",
     "get_data_types",
     "DataTypesDependency",
 ]
 
 
 DataTypesTuple = tuple[DataTypeWithServiceURL, ...]
+DataTypesCacheKey = tuple[str, str | None, str | None, str]
+DataTypesScopeKey = tuple[str, str | None, str | None]
+DataTypesScope = tuple[str | None, str | None]
 
 
 class DataTypeManager:
-    def __init__(self, logger: structlog.stdlib.BoundLogger):
+    def __init__(self, config: Config, logger: structlog.stdlib.BoundLogger):
+        self._config: Config = config
         self.logger = logger
+        self._fetcher = get_upstream_fetcher(config)
+        self._loop_lag = get_loop_lag_monitor(config)
 
         # cache
-        #  - expiry in seconds
-        self._cache_expiry: float = 3600.0
-        self._data_services: int | None = None
-        #  - dict of (project, dataset, hash of auth header): (fetch time, data types)
-        self._data_types: dict[tuple[str | None, str | None, str], tuple[datetime, DataTypesTuple]] = {}
+        #  - per-service versions; when a service's version changes, its cached data types are thrown out.
+        self._service_versions = ServiceVersionTracker()
+        #  - dict of (service URL, project, dataset, hash of auth header): data types (+ fetch time)
+        self._data_types: dict[DataTypesCacheKey, CacheEntry[DataTypesTuple]] = {}
+        #  - entries restored from a snapshot, which are served regardless of age until they have been revalidated
+        self._stale: set[DataTypesCacheKey] = set()
+        #  - dict of (project, dataset, hash of auth header): (per-service data types, merged data types). The merged
+        #    tuple is re-used as long as it would be built from the same per-service tuples, so that it keeps the same
+        #    identity (and things like pre-compressed response bodies keyed on it stay valid.)
+        self._merged: dict[tuple[str | None, str | None, str], tuple[tuple[DataTypesTuple, ...], DataTypesTuple]] = {}
+
+        # To keep the size of cache entries down when many scopes and authorization headers are cached:
+        #  - one copy of each distinct data type schema is shared between cache entries
+        self._schemas = Interner()
+        #  - the most recently fetched data types for each (service URL, project, dataset); if the data types fetched
+        #    with a different authorization header are equal (i.e., same counts), this tuple is re-used.
+        self._latest: dict[DataTypesScopeKey, DataTypesTuple] = {}
+
+        # in-progress fetches by cache key, shared by concurrent requests for the same data types
+        self._in_flight: InFlight[tuple[DataTypesTuple, bool]] = InFlight()
+
+    def _entry_valid(self, now: float, key: DataTypesCacheKey, entry: CacheEntry[DataTypesTuple]) -> bool:
+        # in degraded mode, entries are served regardless of age (see LoopLagMonitor)
+        return entry.age(now) < self._config.data_type_cache_ttl or key in self._stale or self._loop_lag.degraded
+
+    def _clean_cache(self):
+        now = time.monotonic()
+        self._data_types = {k: v for k, v in self._data_types.items() if self._entry_valid(now, k, v)}
+        live_scopes = {k[1:] for k in self._data_types}
+        self._merged = {k: v for k, v in self._merged.items() if k in live_scopes}
+        live_service_scopes = {k[:3] for k in self._data_types}
+        self._latest = {k: v for k, v in self._latest.items() if k in live_service_scopes}
+        self._schemas.retain(
+            s for e in self._data_types.values() for dt in e.value for s in (dt.item_schema, dt.metadata_schema)
+        )
+
+    def _invalidate_service(self, service_url: str):
+        self._data_types = {k: v for k, v in self._data_types.items() if k[0] != service_url}
+        self._latest = {k: v for k, v in self._latest.items() if k[0] != service_url}
+
+    def _dedupe(self, scope_key: DataTypesScopeKey, dts: DataTypesTuple) -> DataTypesTuple:
+        if (latest := self._latest.get(scope_key)) is not None and latest == dts:
+            return latest
+        self._latest[scope_key] = dts
+        return dts
+
+    def snapshot(self) -> dict:
+        # Only data types fetched without an authorization header are included, since others may contain counts which
+        # should only be visible to specific users.
+        return {
+            "versions": self._service_versions.snapshot(),
+            "entries": [
+                [k[0], k[1], k[2], v.fetched_iso(), v.value]
+                for k, v in self._data_types.items()
+                if k[3] == ANONYMOUS_AUTHZ_DIGEST
+            ],
+        }
+
+    def restore(self, snapshot: dict):
+        self._service_versions.restore(snapshot["versions"])
+        for service_url, project, dataset, fetched, dts in snapshot["entries"]:
+            cache_key = (service_url, project, dataset, ANONYMOUS_AUTHZ_DIGEST)
+            data = data_types_adapter.validate_python(dts, context={"interner": self._schemas})
+            self._data_types[cache_key] = CacheEntry.from_fetched_iso(
+                self._dedupe(cache_key[:3], tuple(dt for dt in data if dt is not None)), fetched
+            )
+            self._stale.add(cache_key)
+
+    def clear_stale(self):
+        # Stop serving entries restored from a snapshot regardless of age, whether or not they were revalidated.
+        self._stale.clear()
+
+    async def revalidate(self, bento_services_by_kind: BentoServicesByKind, http_session: aiohttp.ClientSession):
+        # Stop serving stale entries regardless of age, and re-fetch any which have expired.
+        now = time.monotonic()
+        stale, self._stale = self._stale, set()
+        to_fetch = [k for k in stale if (e := self._data_types.get(k)) is not None and not self._entry_valid(now, k, e)]
+
+        by_url = bento_services_by_url(bento_services_by_kind)
+        results = await asyncio.gather(
+            *(
+                self.get_data_types_from_service(
+                    None, http_session, {"url": k[0]}, by_url.get(k[0]), k[1], k[2], Priority.BACKGROUND
+                )
+                for k in to_fetch
+            )
+        )
+
+        for k, (dts, dts_valid) in zip(to_fetch, results):
+            if dts_valid:
+                self._data_types[k] = CacheEntry(dts)
 
     @staticmethod
     def build_scope_query_params(project: str | None, dataset: str | None) -> str:
@@ -52,110 +158,256 @@ class DataTypeManager:
         authz_header: OptionalHeaders,
         http_session: aiohttp.ClientSession,
         service: dict,
+        bento_service: BentoService | None,
         project: str | None,
         dataset: str | None,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> tuple[DataTypesTuple, bool]:
         service_url: str | None = service.get("url")
 
         if service_url is None:
-            await self.logger.aerror("encountered service with missing URL", service=service)
+            self.logger.error("encountered service with missing URL", service=service)
             return (), False
 
         service_url_norm: str = right_slash_normalize_url(service_url)
-        data_types_url = urljoin(service_url_norm, "data-types") + self.build_scope_query_params(project, dataset)
-
-        logger = self.logger.bind(data_types_url=data_types_url)
-
-        try:
-            async with http_session.get(data_types_url, headers=authz_header) as res:
-                data = await res.json()
-                if res.status != status.HTTP_200_OK:
-                    await logger.aerror("got non-200 response from data type service", status=res.status, body=data)
-                    return (), False
-        except asyncio.TimeoutError:
-            await logger.aerror("service data type fetch timeout error")
-            return (), False
-        except aiohttp.ClientConnectionError as e:
-            await logger.aexception("service data type fetch connection error", exc_info=e)
-            return (), False
 
-        dts: list[DataTypeWithServiceURL] = []
+        # We may contact the service via an internal URL or Unix socket, rather than via its public URL:
+        target = get_upstream_target(self._config, http_session, service_url, bento_service)
+        data_types_url = target.url("data-types") + self.build_scope_query_params(project, dataset)
+
+        # Rather than binding a new logger for every service on every fan-out, pass context to the (rarer) log calls.
+        log_ctx = {"data_types_url": data_types_url}
+
+        flow = ("data-types", project, dataset, authz_header_digest(authz_header))
 
-        for dt in data:
+        with span("fetch data types", service_url=service_url_norm):
             try:
-                dts.append(DataTypeWithServiceURL.model_validate({**dt, "service_base_url": service_url_norm}))
+                res = await self._fetcher.get(target, data_types_url, authz_header, flow, priority)
+            except asyncio.TimeoutError:
+                self.logger.error("service data type fetch timeout error", **log_ctx)
+                mark_error("timeout")
+                return (), False
+            except aiohttp.ClientConnectionError as e:
+                self.logger.exception("service data type fetch connection error", exc_info=e, **log_ctx)
+                mark_error(type(e).__name__)
+                return (), False
+
+            if res.status != status.HTTP_200_OK:
+                self.logger.error(
+                    "got non-200 response from data type service", status=res.status, body=res.text(), **log_ctx
+                )
+                mark_error(f"status {res.status}")
+                return (), False
+
+            # Validate the whole list of data types in one go, straight from the response bytes. Malformed data types
+            # are collected into skipped and left out, rather than failing the whole response.
+            skipped: SkippedItems = []
+
+            try:
+                with span("validate data types", n_bytes=len(res.body)):
+                    data = await self._loop_lag.parse(
+                        len(res.body),
+                        lambda: data_types_adapter.validate_json(
+                            res.body,
+                            context={
+                                "service_base_url": service_url_norm,
+                                "skipped": skipped,
+                                "interner": self._schemas,
+                            },
+                        ),
+                    )
             except ValidationError as err:
-                await logger.aerror("skipping recieved malformatted data type", data_type=dt, exc_info=err)
-                continue
+                self.logger.error("received malformatted data type list", exc_info=err, **log_ctx)
+                mark_error("invalid response")
+                return (), False
 
-        return tuple(dts), True
+        for dt, dt_err in skipped:
+            self.logger.error("skipping recieved malformatted data type", data_type=dt, exc_info=dt_err, **log_ctx)
+
+        dts = self._dedupe((service_url_norm, project, dataset), tuple(dt for dt in data if dt is not None))
+
+        return dts, True
+
+    async def _fetch_and_cache(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: aiohttp.ClientSession,
+        service: dict,
+        bento_service: BentoService | None,
+        cache_key: DataTypesCacheKey,
+    ) -> tuple[DataTypesTuple, bool]:
+        # The fetch is shared (see InFlight), and may finish after the request which started it is gone, so it caches
+        # its own result (and holds on to the HTTP session) rather than leaving that to its caller.
+        async with http_session_lease(http_session):
+            dts, dts_valid = await self.get_data_types_from_service(
+                authz_header, http_session, service, bento_service, cache_key[1], cache_key[2]
+            )
+        # if the service returned something invalid, we can't store its cached results.
+        if dts_valid:
+            self._data_types[cache_key] = CacheEntry(dts)
+        return dts, dts_valid
+
+    async def _get_uncached(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: aiohttp.ClientSession,
+        service: dict,
+        bento_service: BentoService | None,
+        project: str | None,
+        dataset: str | None,
+        cache_key: DataTypesCacheKey | None,
+    ) -> tuple[DataTypesTuple, bool]:
+        if cache_key is None:
+            return await self.get_data_types_from_service(
+                authz_header, http_session, service, bento_service, project, dataset
+            )
+        return await self._in_flight.run(
+            cache_key, lambda: self._fetch_and_cache(authz_header, http_session, service, bento_service, cache_key)
+        )
 
     async def get_data_types(
         self,
         authz_header: OptionalHeaders,
         http_session: aiohttp.ClientSession,
         services_tuple: tuple[dict, ...],
+        bento_services_by_kind: BentoServicesByKind,
         project: str | None,
         dataset: str | None,
     ) -> DataTypesTuple:
-        now = datetime.now(UTC)
         scope = (project, dataset)
+        res = await self.get_data_types_for_scopes(
+            authz_header, http_session, services_tuple, bento_services_by_kind, (scope,)
+        )
+        return res[scope]
+
+    async def get_data_types_for_scopes(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: aiohttp.ClientSession,
+        services_tuple: tuple[dict, ...],
+        bento_services_by_kind: BentoServicesByKind,
+        scopes: Sequence[DataTypesScope],
+        max_concurrency_per_service: int | None = None,
+    ) -> dict[DataTypesScope, DataTypesTuple]:
+        """
+        Collects data types for one or more (project, dataset) scopes. Scopes which are cached are answered from memory;
+        missing (service, scope) pairs are fetched, with at most max_concurrency_per_service of them (if set) in flight
+        to any one data service at a time, so that a large batch of scopes doesn't crowd out other requests.
+        """
+
+        now = time.monotonic()
+        scopes = tuple(dict.fromkeys(scopes))
 
         data_services = [s for s in services_tuple if s.get("bento", {}).get("dataService", False)]
         n_data_services = len(data_services)
 
-        logger = self.logger.bind(n_data_services=n_data_services, scope=scope)
-
-        if self._data_services is not None and n_data_services != self._data_services:
-            self._data_types.clear()
-            self._data_services = n_data_services
+        # Rather than binding a new logger on every call, pass context to the (rarer, or debug-level) log calls.
+        log_ctx = {
+            "n_data_services": n_data_services,
+            **({"scope": scopes[0]} if len(scopes) == 1 else {"n_scopes": len(scopes)}),
+        }
 
         # If we have the data for the specified scope in cache, return it instead of doing a lot of fetching effort
         #  - we need to use a SECURE hash for the auth header, to avoid hash collision attacks getting counts where the
         #    accessor shouldn't have permission to!
         #  - we need to cache based on auth header in the first place because data types include entity counts
-        cache_key = (scope[0], scope[1], authz_header_digest(authz_header))
-
-        if (dts := self._data_types.get(cache_key)) is not None and (now - dts[0]).total_seconds() < self._cache_expiry:
-            await logger.adebug(
-                "returning data types from cache",
-                time_taken=(datetime.now(UTC) - now).total_seconds(),
-                n_data_types=len(dts[1]),
-            )
-            return dts[1]
-
-        # Otherwise, contact data services to fetch data types. If all return a successful response, cache it.
-
-        data_type_results: list[tuple[DataTypesTuple, bool]] = await asyncio.gather(
-            *(self.get_data_types_from_service(authz_header, http_session, s, project, dataset) for s in data_services)
-        )
-
-        # if at least one service returned something invalid, we can't store the cached results.
-        at_least_one_invalid = any(not dtr[1] for dtr in data_type_results)
-
-        # flattened tuple of data types:
-        data_types_from_services: DataTypesTuple = tuple(itertools.chain(*(dtr[0] for dtr in data_type_results)))
-
-        new_now = datetime.now(UTC)
+        #  - data types are cached per service, so that a service being upgraded (or a single service failing) only
+        #    causes us to re-fetch data types from that service.
+        authz_digest = authz_header_digest(authz_header)
+
+        service_urls: list[str | None] = []
+        for s in data_services:
+            if (s_url := s.get("url")) is None:
+                # no URL - can't cache; get_data_types_from_service(...) will log an error for us.
+                service_urls.append(None)
+                continue
 
-        await logger.adebug(
-            "collected data types from data services",
-            time_taken=(new_now - now).total_seconds(),
-            n_data_types=len(data_types_from_services),
+            s_url_norm = right_slash_normalize_url(s_url)
+            service_urls.append(s_url_norm)
+
+            if self._service_versions.update(s_url_norm, s):
+                self.logger.info(
+                    "data service version changed; invalidating its data types", service_url=s_url_norm, **log_ctx
+                )
+                self._invalidate_service(s_url_norm)
+
+        # (scope index, service index): data types
+        service_results: dict[tuple[int, int], DataTypesTuple] = {}
+        # (scope index, service index, cache key) of data types which need to be fetched
+        to_fetch: list[tuple[int, int, DataTypesCacheKey | None]] = []
+
+        for si, (project, dataset) in enumerate(scopes):
+            for i, service_url in enumerate(service_urls):
+                if service_url is None:
+                    to_fetch.append((si, i, None))
+                    continue
+
+                cache_key = (service_url, project, dataset, authz_digest)
+
+                if (dts := self._data_types.get(cache_key)) is not None and self._entry_valid(now, cache_key, dts):
+                    service_results[(si, i)] = dts.value
+                else:
+                    to_fetch.append((si, i, cache_key))
+
+        if to_fetch:
+            # Contact data services for which we don't have valid cached data types to fetch data types.
+            # Cache the data types from each service which returns a successful response.
+
+            limits: dict[int, asyncio.Semaphore] = {}
+
+            async def _fetch(si: int, i: int, cache_key: DataTypesCacheKey | None) -> tuple[DataTypesTuple, bool]:
+                args = (
+                    authz_header,
+                    http_session,
+                    data_services[i],
+                    bento_service_for(bento_services_by_kind, data_services[i]),
+                    *scopes[si],
+                    cache_key,
+                )
+                if max_concurrency_per_service is None:
+                    return await self._get_uncached(*args)
+                async with limits.setdefault(i, asyncio.Semaphore(max_concurrency_per_service)):
+                    return await self._get_uncached(*args)
+
+            with span("data types fan-out", n_data_services_fetched=len(to_fetch)):
+                data_type_results: list[tuple[DataTypesTuple, bool]] = await until_disconnected(
+                    asyncio.gather(*(_fetch(*f) for f in to_fetch))
+                )
+
+            for (si, i, _), (dts_res, _) in zip(to_fetch, data_type_results):
+                service_results[(si, i)] = dts_res
+
+            # Clean up old cache entries
+            self._clean_cache()
+
+        res: dict[DataTypesScope, DataTypesTuple] = {}
+        for si, (project, dataset) in enumerate(scopes):
+            # flattened tuple of data types, in service order:
+            parts = tuple(service_results[(si, i)] for i in range(n_data_services))
+            merge_key = (project, dataset, authz_digest)
+            if (merged := self._merged.get(merge_key)) is not None and same_objects(merged[0], parts):
+                res[(project, dataset)] = merged[1]
+            else:
+                res[(project, dataset)] = tuple(itertools.chain.from_iterable(parts))
+                self._merged[merge_key] = (parts, res[(project, dataset)])
+
+        self.logger.debug(
+            "collected data types from data services" if to_fetch else "returning data types from cache",
+            time_taken=time.monotonic() - now,
+            n_data_types=sum(len(dts) for dts in res.values()),
+            n_data_services_fetched=len(to_fetch),
+            **log_ctx,
         )
 
-        if not at_least_one_invalid:
-            self._data_types[cache_key] = (new_now, data_types_from_services)
-
-        return data_types_from_services
+        return res
 
 
 @cache
-def get_data_type_manager(logger: LoggerDependency) -> DataTypeManager:
+def get_data_type_manager(config: ConfigDependency, logger: LoggerDependency) -> DataTypeManager:
     """
     Gets a *singleton* instance of DataTypeManager
     """
-    return DataTypeManager(logger)
+    return DataTypeManager(config, logger)
 
 
 DataTypeManagerDependency = Annotated[DataTypeManager, Depends(get_data_type_manager)]
@@ -164,6 +416,7 @@ DataTypeManagerDependency = Annotated[DataTypeManager, Depends(get_data_type_man
 async def get_data_types(
     # dependencies:
     authz_header: OptionalAuthzHeaderDependency,
+    bento_services_by_kind: BentoServicesByKindDependency,
     data_type_manager: DataTypeManagerDependency,
     http_session: HTTPSessionDependency,
     services_tuple: ServicesDependency,
@@ -171,7 +424,9 @@ async def get_data_types(
     project: str | None = None,
     dataset: str | None = None,
 ) -> DataTypesTuple:
-    return await data_type_manager.get_data_types(authz_header, http_session, services_tuple, project, dataset)
+    return await data_type_manager.get_data_types(
+        authz_header, http_session, services_tuple, bento_services_by_kind, project, dataset
+    )
 
 
 DataTypesDependency = Annotated[DataTypesTuple, Depends(get_data_types)]
@@ -0,0 +1,278 @@
+import asyncio
+from functools import cache
+from json import JSONDecodeError
+from typing import Annotated, Any, Literal
+
+import aiohttp
+from fastapi import Depends, status
+from pydantic_core import to_jsonable_python
+from structlog.stdlib import BoundLogger
+
+from .cache_entry import CacheEntry
+from .config import Config, ConfigDependency
+from .http_session import create_http_session
+from .inflight import InFlight, until_disconnected
+from .logger import LoggerDependency, sample_upstream_success
+from .loop_lag import get_loop_lag_monitor
+from .scheduler import Priority
+from .tracing import get_tracer, mark_error, span
+from .transport import get_upstream_target
+from .upstream import UpstreamContentTypeError, get_upstream_fetcher
+from .utils import IdentityCache, right_slash_normalize_url
+
+__all__ = [
+    "FederatedResource",
+    "FEDERATED_RESOURCES",
+    "PeerRegistryManager",
+    "get_peer_registry_manager",
+    "PeerRegistryManagerDependency",
+]
+
+
+FederatedResource = Literal["services", "data-types", "workflows"]
+FEDERATED_RESOURCES: tuple[FederatedResource, ...] = ("services", "data-types", "workflows")
+
+# What each resource's response from a registry should look like (at the top level), to be merged with the others.
+_RESOURCE_TYPES: dict[FederatedResource, type] = {"services": list, "data-types": list, "workflows": dict}
+
+PeerCacheKey = tuple[str, FederatedResource]
+
+
+def _merge_lists(parts: list[tuple[str, Any]]) -> list[dict]:
+    return [{**item, "node": node} for node, items in parts for item in items if isinstance(item, dict)]
+
+
+def _merge_workflows(parts: list[tuple[str, Any]]) -> dict[str, list[dict]]:
+    # Workflow IDs are only unique within a node, so workflows are listed (with their ID and node) rather than keyed.
+    merged: dict[str, list[dict]] = {}
+    for node, wfs_by_purpose in parts:
+        for purpose, purpose_wfs in wfs_by_purpose.items():
+            if not isinstance(purpose_wfs, dict):
+                continue
+            merged.setdefault(purpose, []).extend(
+                {**wf, "id": wf_id, "node": node} for wf_id, wf in purpose_wfs.items() if isinstance(wf, dict)
+            )
+    return merged
+
+
+_MERGERS = {"services": _merge_lists, "data-types": _merge_lists, "workflows": _merge_workflows}
+
+
+class PeerRegistryManager:
+    """
+    Fetches and caches the public (i.e., fetched without an authorization header) services, data types, and workflows
+    of other Bento nodes' service registries ("peers"), and merges them with this node's own, tagging each item with
+    the base URL of the registry it came from.
+
+    Peer responses are cached for peer_cache_ttl seconds, refreshed in the background every peer_refresh_interval
+    seconds, and concurrent fetches of the same peer resource are coalesced into one. If a peer is slow or down,
+    its last successful response (if any) keeps being served, and re-fetched in the background, rather than holding up
+    the whole merged response.
+    """
+
+    def __init__(self, config: Config, logger: BoundLogger):
+        self._config: Config = config
+        self._logger: BoundLogger = logger
+        self._fetcher = get_upstream_fetcher(config)
+        self._loop_lag = get_loop_lag_monitor(config)
+
+        self._peers: tuple[str, ...] = tuple(
+            dict.fromkeys(right_slash_normalize_url(p) for p in config.peer_registries)
+        )
+
+        # Peers aren't contacted on behalf of any particular user, so they get their own long-lived session (one per
+        # event loop), which background fetches can keep using after the request which started them has finished.
+        self._http_session: aiohttp.ClientSession | None = None
+        self._http_session_loop: asyncio.AbstractEventLoop | None = None
+
+        # cache
+        #  - dict of (peer URL, resource): last successful response from the peer (+ fetch time); kept past the TTL, so
+        #    that it can be served (marked stale) while the peer is unavailable.
+        self._cache: dict[PeerCacheKey, CacheEntry[Any]] = {}
+        #  - error from the last attempt to fetch each peer resource, if it failed
+        self._errors: dict[PeerCacheKey, str] = {}
+        #  - in-progress fetches, which other requests for the same peer resource wait on rather than starting their own
+        self._in_flight: InFlight[None] = InFlight()
+        #  - background re-fetches which nobody is waiting on (kept here so that they aren't garbage-collected)
+        self._background_fetches: set[asyncio.Task] = set()
+        #  - number of times each resource's cached peer responses have changed, so that merged responses can be re-used
+        #    for as long as neither this node's response (by identity) nor any peer's has changed.
+        self._generations: dict[FederatedResource, int] = dict.fromkeys(FEDERATED_RESOURCES, 0)
+        #  - merged responses, keyed by this node's response (whose identity already differs per authorization header)
+        self._merged: IdentityCache[Any] = IdentityCache()
+
+        self._task: asyncio.Task | None = None
+
+    @property
+    def peers(self) -> tuple[str, ...]:
+        return self._peers
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._http_session is None or self._http_session.closed or self._http_session_loop is not loop:
+            self._http_session = create_http_session(self._config)
+            self._http_session_loop = loop
+        return self._http_session
+
+    async def _fetch(self, peer: str, resource: FederatedResource, priority: Priority):
+        key = (peer, resource)
+        target = get_upstream_target(self._config, self._get_http_session(), peer, None)
+        url = target.url(resource)
+        log_ctx = {"peer": peer, "url": url}
+
+        error: str | None = None
+
+        with span("fetch peer registry", peer=peer, resource=resource):
+            try:
+                res = await self._fetcher.get(target, url, None, ("federation", resource), priority)
+                if res.status != status.HTTP_200_OK:
+                    error = f"status {res.status}"
+                    self._logger.error("peer registry fetch non-200 status code", status=res.status, **log_ctx)
+                elif not isinstance(
+                    data := await self._loop_lag.parse(len(res.body), res.json), _RESOURCE_TYPES[resource]
+                ):
+                    error = "invalid response"
+                    self._logger.error("peer registry fetch invalid response", **log_ctx)
+            except TimeoutError:
+                error = "timeout"
+                self._logger.error("peer registry fetch timeout", **log_ctx)
+            # Peers being down is expected from time to time, so errors are logged without tracebacks.
+            except aiohttp.ClientConnectionError as e:
+                error = type(e).__name__
+                self._logger.error("peer registry fetch connection error", error=str(e), **log_ctx)
+            except (JSONDecodeError, UpstreamContentTypeError) as e:
+                error = "invalid response"
+                self._logger.error("peer registry fetch invalid response", error=str(e), **log_ctx)
+
+            if error is not None:
+                mark_error(error)
+                self._errors[key] = error
+                return
+
+        self._cache[key] = CacheEntry(data)
+        self._generations[resource] += 1
+        self._errors.pop(key, None)
+
+        if sample_upstream_success(self._config):
+            self._logger.debug("peer registry fetch complete", **log_ctx)
+
+    async def _fetch_shared(self, peer: str, resource: FederatedResource, priority: Priority):
+        await self._in_flight.run((peer, resource), lambda: self._fetch(peer, resource, priority))
+
+    def _fetch_in_background(self, peer: str, resource: FederatedResource):
+        task = asyncio.create_task(self._fetch_shared(peer, resource, Priority.BACKGROUND))
+        self._background_fetches.add(task)
+        task.add_done_callback(self._background_fetches.discard)
+
+    async def _get_from_peer(self, peer: str, resource: FederatedResource) -> CacheEntry[Any] | None:
+        key = (peer, resource)
+
+        if (entry := self._cache.get(key)) is not None:
+            if entry.age() >= self._config.peer_cache_ttl and not self._loop_lag.degraded:
+                # serve what we have, and re-fetch it in the background (unless the event loop is lagging; see
+                # LoopLagMonitor)
+                self._fetch_in_background(peer, resource)
+            return entry
+
+        # Nothing to serve yet; wait for the peer (for up to the contact timeout.) Other requests may be waiting on the
+        # same fetch; see InFlight.
+        await self._fetch_shared(peer, resource, Priority.INTERACTIVE)
+        return self._cache.get(key)
+
+    def _merge(self, resource: FederatedResource, local_node: str, local: Any) -> Any:
+        # Taken from the cache (rather than from what each peer fetch returned), so that the parts always match the
+        # current generation.
+        peer_parts = ((p, self._cache.get((p, resource))) for p in self._peers)
+
+        # by_alias=True to match FastAPI's own response model serialization
+        node_parts = [(right_slash_normalize_url(local_node), to_jsonable_python(local, by_alias=True))]
+        node_parts.extend((p, e.value) for p, e in peer_parts if e is not None)
+
+        return _MERGERS[resource](node_parts)
+
+    async def get_merged(self, resource: FederatedResource, local_node: str, local: Any) -> Any:
+        """
+        Merges this node's own response for a resource (local) with the cached responses of peers, tagging each item
+        with the node (registry base URL) it came from.
+        """
+
+        with span("peer registries fan-out", resource=resource, n_peers=len(self._peers)):
+            await until_disconnected(asyncio.gather(*(self._get_from_peer(p, resource) for p in self._peers)))
+
+        if resource == "services":
+            # This node's services are assembled anew for each request, so there's nothing to re-use merged responses
+            # for; merging them is cheap anyway.
+            return self._merge(resource, local_node, local)
+
+        return self._merged.get(
+            local,
+            lambda: self._merge(resource, local_node, local),
+            (resource, local_node, self._generations[resource]),
+        )
+
+    def node_statuses(self) -> list[dict]:
+        """
+        Status of the last fetch of each resource from each peer: ok, stale (i.e., older than the cache TTL, either
+        because the peer is unavailable or because it is being re-fetched), or unavailable (never fetched successfully.)
+        """
+        statuses = []
+        for peer in self._peers:
+            resources = {}
+            for resource in FEDERATED_RESOURCES:
+                entry = self._cache.get((peer, resource))
+                age = entry.age() if entry is not None else None
+                resources[resource] = {
+                    "status": (
+                        "unavailable" if age is None else "ok" if age < self._config.peer_cache_ttl else "stale"
+                    ),
+                    "age": age,
+                    "error": self._errors.get((peer, resource)),
+                }
+            statuses.append({"node": peer, "resources": resources})
+        return statuses
+
+    async def refresh(self):
+        """
+        Re-fetches every resource from every peer (in the background, i.e., behind any requests made on behalf of
+        clients), replacing cached responses which are successfully re-fetched.
+        """
+        with get_tracer(self._config).trace("refresh peer registries"):
+            await asyncio.gather(
+                *(self._fetch_shared(p, r, Priority.BACKGROUND) for p in self._peers for r in FEDERATED_RESOURCES)
+            )
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                # postponed while the event loop is lagging (see LoopLagMonitor)
+                if not self._loop_lag.degraded:
+                    await self.refresh()
+            except Exception as e:  # background task; log and keep trying
+                self._logger.exception("encountered error refreshing peer registries", exc_info=e)
+            await asyncio.sleep(self._config.peer_refresh_interval)
+
+    async def start(self):
+        if self._peers and self._config.peer_refresh_interval > 0:
+            self._task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        tasks = [*self._background_fetches, *((self._task,) if self._task is not None else ())]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._in_flight.cancel_all()
+        self._task = None
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+
+
+@cache
+def get_peer_registry_manager(config: ConfigDependency, logger: LoggerDependency) -> PeerRegistryManager:
+    """
+    Gets a *singleton* instance of PeerRegistryManager
+    """
+    return PeerRegistryManager(config, logger)
+
+
+PeerRegistryManagerDependency = Annotated[PeerRegistryManager, Depends(get_peer_registry_manager)]
@@ -0,0 +1,223 @@
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import UTC, datetime
+from functools import cache
+from typing import Annotated, NamedTuple
+
+import aiohttp
+from fastapi import Depends, status
+from structlog.stdlib import BoundLogger
+
+from .bento_services_json import BentoServicesByKind, get_bento_services_by_compose_id, get_bento_services_by_kind
+from .config import Config, ConfigDependency
+from .constants import BENTO_SERVICE_KIND
+from .http_session import create_http_session
+from .logger import LoggerDependency, sample_upstream_success
+from .loop_lag import get_loop_lag_monitor
+from .scheduler import Priority
+from .services import ServiceManager, get_service_manager
+from .transport import get_upstream_target
+from .types import BentoService
+from .upstream import get_upstream_fetcher
+from .utils import nearest_rank
+
+__all__ = [
+    "ProbeResult",
+    "HealthProber",
+    "get_health_prober",
+    "HealthProberDependency",
+]
+
+
+# Each service's probe interval is varied by up to this fraction either way, so that probes which happen to line up
+# drift apart again rather than staying bunched together.
+PROBE_JITTER = 0.1
+
+
+class ProbeResult(NamedTuple):
+    at: float  # wall-clock time the probe was started (seconds since the epoch)
+    latency: float | None  # seconds taken to get a response, if one was received
+    status: int | None  # response status code, if one was received
+    error: str | None  # what went wrong, if the probe failed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HealthProber:
+    """
+    Probes the /service-info endpoint of each service in bento_services.json every health_probe_interval seconds, and
+    keeps the results of the last health_history_size probes of each service.
+
+    Each service is probed on its own schedule, starting at a random offset into the interval and with jittered
+    intervals after that, so that probes are spread out over time rather than hitting every service at once. Probes are
+    made in the background (i.e., behind any requests made on behalf of clients) without an authorization header, with
+    the same retries and contact timeout as other requests to services; so, a probe failing means a client request for
+    the service's info would probably have failed too.
+
+    A successful probe's response also refreshes the service manager's service info cache entry for the service, so
+    that (as long as health_probe_interval is shorter than cache_ttl) client requests are served from the cache rather
+    than fetching service info themselves.
+    """
+
+    def __init__(self, config: Config, logger: BoundLogger, service_manager: ServiceManager):
+        self._config: Config = config
+        self._logger: BoundLogger = logger
+        self._service_manager: ServiceManager = service_manager
+        self._fetcher = get_upstream_fetcher(config)
+        self._loop_lag = get_loop_lag_monitor(config)
+
+        # Like the peer registry manager, probes get their own long-lived session (one per event loop.)
+        self._http_session: aiohttp.ClientSession | None = None
+        self._http_session_loop: asyncio.AbstractEventLoop | None = None
+
+        #  - dict of service kind: (public URL, ring buffer of recent probe results)
+        self._history: dict[str, tuple[str, deque[ProbeResult]]] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._http_session is None or self._http_session.closed or self._http_session_loop is not loop:
+            self._http_session = create_http_session(self._config)
+            self._http_session_loop = loop
+        return self._http_session
+
+    def _record(self, kind: str, url: str, result: ProbeResult):
+        if (h := self._history.get(kind)) is None or h[0] != url:
+            h = self._history[kind] = (url, deque(maxlen=self._config.health_history_size))
+        h[1].append(result)
+
+    async def probe(self, kind: str, service: BentoService) -> ProbeResult:
+        """
+        Probes a service's /service-info endpoint once, recording (and returning) the result.
+        """
+
+        s_url: str = service["url"]
+        target = get_upstream_target(self._config, self._get_http_session(), s_url, service)
+        url = target.url("service-info")
+        log_ctx = {"service_kind": kind, "url": url}
+
+        at = time.time()
+        start = time.perf_counter()
+        latency: float | None = None
+        res_status: int | None = None
+        error: str | None = None
+
+        try:
+            # Probes always contact the service (rather than being answered with a recent failure), and a successful
+            # probe clears any recent failure remembered for anonymous requests to the service.
+            res = await self._fetcher.get(
+                target, url, None, ("health", kind), Priority.BACKGROUND, negative_cache=False
+            )
+            latency = time.perf_counter() - start
+            res_status = res.status
+            if res.status != status.HTTP_200_OK:
+                error = f"status {res.status}"
+                self._logger.warning("health probe non-200 status code", status=res.status, **log_ctx)
+            elif not self._service_manager.store_probe_response(service, res):
+                error = "invalid response"
+                self._logger.warning("health probe invalid service info response", **log_ctx)
+        except TimeoutError:
+            error = "timeout"
+            self._logger.warning("health probe timeout", **log_ctx)
+        # Unavailable services are what we're probing for, so these are logged without tracebacks.
+        except aiohttp.ClientConnectionError as e:
+            error = type(e).__name__
+            self._logger.warning("health probe connection error", error=str(e), **log_ctx)
+
+        result = ProbeResult(at, latency, res_status, error)
+        self._record(kind, s_url, result)
+
+        if result.ok and sample_upstream_success(self._config):
+            self._logger.debug("health probe complete", time_taken=latency, **log_ctx)
+
+        return result
+
+    def _next_interval(self) -> float:
+        return self._config.health_probe_interval * random.uniform(1 - PROBE_JITTER, 1 + PROBE_JITTER)
+
+    async def _probe_periodically(self, kind: str, service: BentoService):
+        # Start at a random point in the interval, so that services' probes are spread out from the get-go.
+        await asyncio.sleep(random.uniform(0, self._config.health_probe_interval))
+        while True:
+            try:
+                # postponed while the event loop is lagging (see LoopLagMonitor)
+                if not self._loop_lag.degraded:
+                    await self.probe(kind, service)
+            except Exception as e:  # background task; log and keep trying
+                self._logger.exception("encountered error probing service", service_kind=kind, exc_info=e)
+            await asyncio.sleep(self._next_interval())
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Summarizes the recent probe history of each service: the share of probes which succeeded (as a percentage),
+        the median and 95th percentile latency of successful probes (in milliseconds), and the last probe's result.
+        """
+
+        res: dict[str, dict] = {}
+
+        for kind, (url, history) in self._history.items():
+            if not history:
+                continue
+
+            latencies = sorted(r.latency for r in history if r.ok and r.latency is not None)
+            n_ok = sum(1 for r in history if r.ok)
+            last = history[-1]
+
+            res[kind] = {
+                "url": url,
+                "n_probes": len(history),
+                "uptime": round(100 * n_ok / len(history), 2),
+                "latency_ms": {
+                    "p50": round(nearest_rank(latencies, 0.5) * 1000, 2) if latencies else None,
+                    "p95": round(nearest_rank(latencies, 0.95) * 1000, 2) if latencies else None,
+                },
+                "last_probe": {
+                    "at": datetime.fromtimestamp(last.at, UTC).isoformat(),
+                    "ok": last.ok,
+                    "status": last.status,
+                    "latency_ms": round(last.latency * 1000, 2) if last.latency is not None else None,
+                    "error": last.error,
+                },
+            }
+
+        return res
+
+    async def start(self, bento_services_by_kind: BentoServicesByKind | None = None):
+        if self._config.health_probe_interval <= 0:
+            return
+
+        if bento_services_by_kind is None:
+            bento_services_by_kind = await get_bento_services_by_kind(
+                await get_bento_services_by_compose_id(self._config)
+            )
+
+        self._tasks.extend(
+            asyncio.create_task(self._probe_periodically(kind, service))
+            for kind, service in bento_services_by_kind.items()
+            # we are this service; no need to probe ourselves over the network.
+            if kind != BENTO_SERVICE_KIND
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+
+
+@cache
+def get_health_prober(config: ConfigDependency, logger: LoggerDependency) -> HealthProber:
+    """
+    Gets a *singleton* instance of HealthProber
+    """
+    return HealthProber(config, logger, get_service_manager(config, logger))
+
+
+HealthProberDependency = Annotated[HealthProber, Depends(get_health_prober)]
@@ -1,26 +1,60 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 import aiohttp
 from fastapi import Depends
 
-from .config import ConfigDependency
+from .config import Config, ConfigDependency
+from .tracing import trace_configs
 
 __all__ = [
+    "create_http_session",
+    "http_session_lease",
     "get_http_session",
     "HTTPSessionDependency",
 ]
 
 
-async def get_http_session(config: ConfigDependency):
+def create_http_session(config: Config) -> aiohttp.ClientSession:
     connector = aiohttp.TCPConnector(verify_ssl=config.bento_validate_ssl, force_close=True)
-    session = aiohttp.ClientSession(
+    return aiohttp.ClientSession(
         connector=connector,
         timeout=aiohttp.ClientTimeout(total=config.contact_timeout),
+        trace_configs=trace_configs(config),
     )
+
+
+# Shared upstream work (see inflight.py) may outlive the request whose session it's using; sessions which are leased to
+# such work when their request finishes are closed once the work is done, rather than right away.
+_leases: dict[aiohttp.ClientSession, int] = {}
+_close_when_released: set[aiohttp.ClientSession] = set()
+
+
+@asynccontextmanager
+async def http_session_lease(session: aiohttp.ClientSession) -> AsyncIterator[aiohttp.ClientSession]:
+    _leases[session] = _leases.get(session, 0) + 1
+    try:
+        yield session
+    finally:
+        if n := _leases[session] - 1:
+            _leases[session] = n
+        else:
+            del _leases[session]
+            if session in _close_when_released:
+                _close_when_released.discard(session)
+                await session.close()
+
+
+async def get_http_session(config: ConfigDependency):
+    session = create_http_session(config)
     try:
         yield session
     finally:
-        await session.close()
+        if session in _leases:
+            _close_when_released.add(session)
+        else:
+            await session.close()
 
 
 HTTPSessionDependency = Annotated[aiohttp.ClientSession, Depends(get_http_session)]
@@ -0,0 +1,184 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from contextvars import ContextVar
+from typing import Generic, TypeVar
+
+from fastapi import Request, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+__all__ = [
+    "ClientDisconnected",
+    "InFlight",
+    "mark_upstream_started",
+    "until_disconnected",
+    "DisconnectMiddleware",
+    "client_disconnected_handler",
+]
+
+
+T = TypeVar("T")
+
+# Set (per request) by DisconnectMiddleware to an event which is set once the client has disconnected.
+_disconnected: ContextVar[asyncio.Event | None] = ContextVar("disconnected", default=None)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class _SharedWork(Generic[T]):
+    __slots__ = ("n_waiters", "started", "task")
+
+    def __init__(self):
+        self.task: asyncio.Task[T] | None = None
+        self.n_waiters: int = 0
+        # whether a request has been sent upstream on behalf of this work (as opposed to it still waiting for a slot)
+        self.started: bool = False
+
+
+# Set within the task doing a piece of shared work, so that upstream requests made for it can mark it as started.
+_current_work: ContextVar[_SharedWork | None] = ContextVar("current_work", default=None)
+
+
+def mark_upstream_started():
+    """
+    Marks the shared work being done in the current context (if any) as having started an upstream request.
+    """
+    if (work := _current_work.get()) is not None:
+        work.started = True
+
+
+class InFlight(Generic[T]):
+    """
+    Runs (e.g., upstream fetch + cache) work shared by any number of concurrent waiters, keyed by what the work
+    produces (e.g., a cache key.) The work runs in its own task, shielded from the waiters: a waiter being cancelled
+    (e.g., because its client disconnected) doesn't cancel work which other waiters still need.
+
+    Once no waiters are left, the work is cancelled if it's still waiting for an upstream request slot; requests which
+    are already underway are left to finish, since their results will be cached (and the upstream work is already
+    being done anyway.)
+    """
+
+    def __init__(self):
+        self._work: dict[Hashable, _SharedWork[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._work)
+
+    async def _run(self, work: _SharedWork[T], fn: Callable[[], Awaitable[T]]) -> T:
+        _current_work.set(work)
+        return await fn()
+
+    def _start(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> _SharedWork[T]:
+        work = self._work[key] = _SharedWork()
+        work.task = asyncio.ensure_future(self._run(work, fn))
+
+        def _done(_task: asyncio.Task[T]):
+            if self._work.get(key) is work:
+                del self._work[key]
+
+        work.task.add_done_callback(_done)
+        return work
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        work = self._work.get(key)
+        # don't join work which was abandoned (and is being cancelled); start it over instead
+        if work is None or work.task is None or work.task.cancelling():
+            work = self._start(key, fn)
+
+        task = work.task
+        assert task is not None
+
+        work.n_waiters += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            work.n_waiters -= 1
+            if not work.n_waiters and not work.started and not task.done():
+                task.cancel()
+
+    async def cancel_all(self):
+        """
+        Cancels all work in progress, whether or not it has started an upstream request (e.g., on shutdown.)
+        """
+        tasks = [work.task for work in self._work.values() if work.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def until_disconnected(aw: Awaitable[T]) -> T:
+    """
+    Awaits something on behalf of the current request; if the client disconnects first, it is cancelled, and
+    ClientDisconnected is raised.
+    """
+
+    if (disconnected := _disconnected.get()) is None:
+        return await aw
+
+    work = asyncio.ensure_future(aw)
+
+    if not disconnected.is_set():
+        disconnect = asyncio.ensure_future(disconnected.wait())
+        try:
+            await asyncio.wait((work, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect.cancel()
+            if not work.done():
+                work.cancel()
+
+    if not work.done():
+        work.cancel()
+        # let the work's clean-up (e.g., InFlight waiter counts) happen before we move on
+        await asyncio.wait((work,))
+
+    if work.cancelled() and disconnected.is_set():
+        raise ClientDisconnected()
+    return work.result()
+
+
+class DisconnectMiddleware:
+    """
+    ASGI middleware which watches for the client disconnecting while its request is being handled, so that work done
+    on its behalf (see until_disconnected) can be abandoned. Messages from the server are read by a watcher task and
+    passed on to the app, so the app still gets the request body as usual.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        disconnected = asyncio.Event()
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+
+        async def _watch():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        async def _receive() -> Message:
+            # Once the client has disconnected (and the watcher has stopped reading), keep telling the app so, like the
+            # server would, rather than waiting forever for another message.
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        watcher = asyncio.create_task(_watch())
+        token = _disconnected.set(disconnected)
+        try:
+            await self.app(scope, _receive, send)
+        finally:
+            _disconnected.reset(token)
+            watcher.cancel()
+
+
+async def client_disconnected_handler(_request: Request, _exc: Exception) -> Response:
+    # The client is gone, so nobody will see this response; 499 (from nginx) is what shows up in access logs.
+    return Response(status_code=499)
@@ -0,0 +1,85 @@
+import base64
+import binascii
+from collections.abc import Callable, Sequence
+from typing import Any, NamedTuple, TypeVar
+
+from fastapi import HTTPException, Request, status
+
+__all__ = [
+    "Page",
+    "split_query_values",
+    "encode_cursor",
+    "decode_cursor",
+    "paginate",
+    "next_page_headers",
+]
+
+
+T = TypeVar("T")
+
+
+class Page(NamedTuple):
+    """
+    A (filtered, projected, and/or paginated) view of a list endpoint's results, along with the cursor for the next page
+    of results, if there is one.
+    """
+
+    items: Any
+    next_cursor: str | None = None
+
+
+def split_query_values(values: list[str] | None) -> tuple[str, ...] | None:
+    """
+    Normalizes a multi-value query parameter, which may be given either as repeated parameters or comma-separated values
+    (e.g., ?ids=a,b&ids=c), into a tuple of unique values (in order of first appearance.)
+    """
+    if not values:
+        return None
+    return tuple(dict.fromkeys(v for vs in values for v in vs.split(",") if v)) or None
+
+
+def encode_cursor(position: int, key: str) -> str:
+    return base64.urlsafe_b64encode(f"{position}:{key}".encode()).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, str]:
+    try:
+        position, key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8").split(":", 1)
+        if (position_int := int(position)) < 0:
+            raise ValueError("negative position")
+        return position_int, key
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+
+def paginate(items: Sequence[T], key: Callable[[T], str], cursor: str | None, limit: int | None) -> Page:
+    """
+    Gets a page of items following the item identified by a cursor (or from the start, if no cursor is given.) Cursors
+    hold the key and position of the last item of the previous page; if the item has since moved, it is looked up by its
+    key, and if it has since been removed, the page picks up from its old position.
+    """
+
+    start = 0
+
+    if cursor is not None:
+        position, last_key = decode_cursor(cursor)
+        if position < len(items) and key(items[position]) == last_key:
+            start = position + 1
+        else:
+            start = next((i + 1 for i, item in enumerate(items) if key(item) == last_key), position + 1)
+
+    if limit is None:
+        return Page(items[start:] if start else items)
+
+    page_items = items[start : start + limit]
+    end = start + len(page_items)
+    return Page(page_items, encode_cursor(end - 1, key(items[end - 1])) if end < len(items) else None)
+
+
+def next_page_headers(request: Request, page: Page) -> dict[str, str]:
+    """
+    Builds a Link header (RFC 8288) pointing to the next page of results, if there is one.
+    """
+    if page.next_cursor is None:
+        return {}
+    return {"Link": f'<{request.url.include_query_params(cursor=page.next_cursor)}>; rel="next"'}
@@ -1,4 +1,8 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
 from functools import lru_cache
 from typing import Annotated
 
@@ -6,24 +10,63 @@ import structlog.stdlib
 from bento_lib.logging.structured.configure import configure_structlog_from_bento_config, configure_structlog_uvicorn
 from fastapi import Depends
 
-from .config import ConfigDependency
+from .config import Config, ConfigDependency
 from .constants import BENTO_SERVICE_KIND
 
 __all__ = [
     "get_logger",
     "LoggerDependency",
+    "sample_upstream_success",
 ]
 
 
-logging.basicConfig(level=logging.NOTSET)
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default implementation formats the record message so that the record can be pickled; here, the queue
+        # never leaves the process, and the structlog ProcessorFormatter on the other end needs the original record.
+        return record
+
+
+def _move_root_handlers_to_queue():
+    """
+    Replaces the root logger's handlers (set up by structlog configuration) with a queue handler, so that formatting and
+    writing log messages happens in a background thread rather than blocking the event loop. Handlers are flushed at
+    exit.
+    """
+
+    root_logger = logging.getLogger()
+    handlers = [h for h in root_logger.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if not handlers:
+        return
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root_logger.handlers.clear()
+    root_logger.addHandler(_InProcessQueueHandler(log_queue))
+
+    listener.start()
+    atexit.register(listener.stop)
 
 
 @lru_cache
 def get_logger(config: ConfigDependency) -> structlog.stdlib.BoundLogger:
+    # Logging is configured the first time a logger is requested (i.e., by the app factory), rather than at import time.
+    logging.basicConfig(level=logging.NOTSET)
     configure_structlog_from_bento_config(config)
     configure_structlog_uvicorn()
+    _move_root_handlers_to_queue()
 
     return structlog.stdlib.get_logger(f"{BENTO_SERVICE_KIND}.logger")
 
 
 LoggerDependency = Annotated[structlog.stdlib.BoundLogger, Depends(get_logger)]
+
+
+def sample_upstream_success(config: Config) -> bool:
+    """
+    Whether a routine (successful) event for a single upstream request should be logged. These events are sampled, since
+    they are emitted for every service on every fan-out; summary events are logged for each fan-out instead. Errors
+    should always be logged.
+    """
+    return (rate := config.log_upstream_success_sample_rate) >= 1.0 or random.random() < rate
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import UTC, datetime
+from functools import cache
+from typing import Annotated, TypeVar
+
+from fastapi import Depends
+from structlog.stdlib import BoundLogger
+
+from .config import Config, ConfigDependency
+from .logger import get_logger
+from .utils import nearest_rank
+
+__all__ = [
+    "LoopLagMonitor",
+    "get_loop_lag_monitor",
+    "LoopLagMonitorDependency",
+]
+
+
+T = TypeVar("T")
+
+# Weight of each new lag sample in the moving average which decides when to leave degraded mode
+LAG_EWMA_ALPHA = 0.3
+# Number of recent lag samples kept for reporting
+LAG_WINDOW = 600
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag (how much later than scheduled a periodic wake-up actually runs) every
+    loop_lag_check_interval seconds. When CPU-bound work (validation, serialization, parsing) piles up, lag rises and
+    every request slows down, including health checks.
+
+    If the lag (either a single sample, e.g., from one long blocking call, or its moving average, e.g., from many short
+    ones) goes above loop_lag_degraded_threshold, the registry switches into degraded mode until the moving average
+    drops below loop_lag_recovered_threshold. In degraded mode:
+     - cached service info, data types, and workflows are served regardless of age, rather than being re-fetched;
+     - background work (health probes, peer registry refreshes, cache snapshots) is postponed;
+     - large upstream responses are parsed/validated in a worker thread, so the event loop keeps serving requests.
+    """
+
+    def __init__(self, config: Config, logger: BoundLogger):
+        self._config: Config = config
+        self._logger: BoundLogger = logger
+
+        self._samples: deque[float] = deque(maxlen=LAG_WINDOW)
+        self._lag: float = 0.0  # moving average, in seconds
+        self._degraded_since: float | None = None  # wall-clock time
+        self._n_degraded_periods: int = 0
+
+        self._task: asyncio.Task | None = None
+
+    @property
+    def lag(self) -> float:
+        return self._lag
+
+    @property
+    def degraded(self) -> bool:
+        return self._degraded_since is not None
+
+    def record(self, lag: float):
+        """
+        Records a lag sample (in seconds), switching into or out of degraded mode if needed.
+        """
+
+        self._samples.append(lag)
+        self._lag += LAG_EWMA_ALPHA * (lag - self._lag)
+
+        if not self.degraded and max(lag, self._lag) > self._config.loop_lag_degraded_threshold:
+            self._degraded_since = time.time()
+            self._n_degraded_periods += 1
+            self._logger.warning("event loop lagging; entering degraded mode", lag=self._lag)
+        elif self._degraded_since is not None and self._lag < self._config.loop_lag_recovered_threshold:
+            self._logger.info(
+                "event loop lag recovered; leaving degraded mode", degraded_for=time.time() - self._degraded_since
+            )
+            self._degraded_since = None
+
+    async def parse(self, n_bytes: int, fn: Callable[[], T]) -> T:
+        """
+        Runs a parsing/validation function for an upstream response of n_bytes bytes; in degraded mode, large responses
+        are parsed in a worker thread rather than blocking the event loop.
+        """
+        if self.degraded and n_bytes >= self._config.degraded_parse_min_bytes:
+            return await asyncio.to_thread(fn)
+        return fn()
+
+    def status(self) -> dict:
+        samples = sorted(self._samples)
+        return {
+            "lag_ms": round(self._lag * 1000, 2),
+            "recent": {
+                "n_samples": len(samples),
+                "p50_ms": round(nearest_rank(samples, 0.5) * 1000, 2) if samples else None,
+                "p95_ms": round(nearest_rank(samples, 0.95) * 1000, 2) if samples else None,
+                "max_ms": round(samples[-1] * 1000, 2) if samples else None,
+            },
+            "degraded": self.degraded,
+            "degraded_since": (
+                datetime.fromtimestamp(self._degraded_since, UTC).isoformat()
+                if self._degraded_since is not None
+                else None
+            ),
+            "n_degraded_periods": self._n_degraded_periods,
+        }
+
+    async def _measure_periodically(self):
+        loop = asyncio.get_running_loop()
+        interval = self._config.loop_lag_check_interval
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.record(max(loop.time() - expected, 0.0))
+
+    async def start(self):
+        if self._config.loop_lag_check_interval > 0:
+            self._task = asyncio.create_task(self._measure_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # without measurements, there's nothing to recover from degraded mode with
+        self._lag = 0.0
+        self._degraded_since = None
+
+
+@cache
+def get_loop_lag_monitor(config: ConfigDependency) -> LoopLagMonitor:
+    """
+    Gets a *singleton* instance of LoopLagMonitor, shared by everything which changes its behaviour in degraded mode.
+    """
+    return LoopLagMonitor(config, get_logger(config))
+
+
+LoopLagMonitorDependency = Annotated[LoopLagMonitor, Depends(get_loop_lag_monitor)]
@@ -1,11 +1,57 @@
-from pydantic import BaseModel, Field
+from functools import cached_property
+from typing import Annotated, Any
+
+from bento_lib.workflows.models import WorkflowDefinition
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    TypeAdapter,
+    ValidationError,
+    ValidationInfo,
+    ValidatorFunctionWrapHandler,
+    WrapValidator,
+    field_validator,
+    model_serializer,
+    model_validator,
+)
 
 __all__ = [
     "DataTypeWithServiceURL",
+    "WorkflowWithServiceURL",
+    "SkippedItems",
+    "data_types_adapter",
+    "workflows_by_purpose_adapter",
+    "DATA_TYPES_BATCH_MAX_SCOPES",
+    "DataTypesBatchRequest",
 ]
 
 
+SkippedItems = list[tuple[Any, ValidationError]]
+
+
+def _inject_service_base_url(v: str | None, info: ValidationInfo) -> str:
+    # Injected via validation context rather than coming from the service, so that we can validate service responses
+    # straight from JSON bytes without copying each item to add a key.
+    if info.context and (service_base_url := info.context.get("service_base_url")):
+        return service_base_url
+    if v is None:
+        raise ValueError("service_base_url must be provided, either directly or via validation context")
+    return v
+
+
+def _intern_schema(v: dict, info: ValidationInfo) -> dict:
+    # Schemas are usually identical across scopes and authorization headers (unlike counts), and can be large; if an
+    # interner is passed via validation context, one copy of each distinct schema is shared between cache entries.
+    if info.context and (interner := info.context.get("interner")) is not None:
+        return interner.intern(v)
+    return v
+
+
 class DataTypeWithServiceURL(BaseModel):
+    # Frozen, since instances (and their schemas) are shared between cache entries and responses.
+    model_config = ConfigDict(frozen=True)
+
     label: str | None = None
     queryable: bool
     item_schema: dict = Field(..., alias="schema")
@@ -14,4 +60,75 @@ class DataTypeWithServiceURL(BaseModel):
     count: int | None
     last_ingested: str | None = None
     # Injected rather than from service:
-    service_base_url: str
+    service_base_url: str = Field(None, validate_default=True)
+
+    _inject_service_base_url = field_validator("service_base_url", mode="before")(_inject_service_base_url)
+    _intern_schema = field_validator("item_schema", "metadata_schema")(_intern_schema)
+
+
+class WorkflowWithServiceURL(BaseModel):
+    # Frozen, since instances are shared between cache entries and responses.
+    model_config = ConfigDict(frozen=True)
+
+    # Injected rather than from service:
+    service_base_url: str = Field(None, validate_default=True)
+
+    # The workflow as received from the service. Workflows are validated against bento_lib's model, but only the received
+    # dictionary is kept, and served (plus service_base_url); otherwise, fields bento_lib doesn't know about would be
+    # dropped, and defaults it fills in (e.g., data_type, inputs[].required) added.
+    received: dict[str, Any]
+
+    _inject_service_base_url = field_validator("service_base_url", mode="before")(_inject_service_base_url)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _validate_received(cls, data: Any) -> Any:
+        if not isinstance(data, dict):
+            return data
+        received = {k: v for k, v in data.items() if k != "service_base_url"}
+        WorkflowDefinition.model_validate(received)
+        return {"service_base_url": data.get("service_base_url"), "received": received}
+
+    @cached_property
+    def definition(self) -> WorkflowDefinition:
+        # Validated (again) on first access, since the registry itself only needs service_base_url.
+        return WorkflowDefinition.model_validate(self.received)
+
+    @model_serializer
+    def _serialize_received(self) -> dict[str, Any]:
+        return {**self.received, "service_base_url": self.service_base_url}
+
+
+def _skip_invalid(v: Any, handler: ValidatorFunctionWrapHandler, info: ValidationInfo) -> Any:
+    # Validates a single item of a collection; if the item is invalid, it is recorded in the validation context's
+    # "skipped" list (if present) and replaced with None (to be filtered out afterward) rather than failing the whole
+    # collection, so that we don't have to re-validate the rest of the items one-by-one.
+    try:
+        return handler(v)
+    except ValidationError as e:
+        if info.context is not None and (skipped := info.context.get("skipped")) is not None:
+            skipped.append((v, e))
+        return None
+
+
+# Type adapters are relatively expensive to build, so build them once here, and re-use them for validating each payload
+# received from a service.
+
+data_types_adapter: TypeAdapter[list[DataTypeWithServiceURL | None]] = TypeAdapter(
+    list[Annotated[DataTypeWithServiceURL | None, WrapValidator(_skip_invalid)]]
+)
+
+workflows_by_purpose_adapter: TypeAdapter[dict[str, dict[str, WorkflowWithServiceURL | None]]] = TypeAdapter(
+    dict[str, dict[str, Annotated[WorkflowWithServiceURL | None, WrapValidator(_skip_invalid)]]]
+)
+
+
+# Maximum number of scopes which can be requested at once from the data types batch endpoint
+DATA_TYPES_BATCH_MAX_SCOPES = 500
+
+
+class DataTypesBatchRequest(BaseModel):
+    # Scopes, each either "" (the whole node), "<project>", or "<project>/<dataset>"
+    scopes: list[str] = Field(..., min_length=1, max_length=DATA_TYPES_BATCH_MAX_SCOPES)
+    # Data type fields to include (by serialized name), as in the fields parameter of /data-types
+    fields: list[str] | None = None
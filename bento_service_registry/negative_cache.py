@@ -0,0 +1,78 @@
+import time
+from enum import StrEnum
+from typing import Generic, TypeVar
+
+from .cache_entry import CacheEntry
+from .config import Config
+
+__all__ = [
+    "UpstreamErrorClass",
+    "NegativeCache",
+]
+
+
+T = TypeVar("T")
+
+# Expired entries are only pruned once there are more than this many, since there's nothing to prune most of the time.
+PRUNE_THRESHOLD = 1024
+
+
+class UpstreamErrorClass(StrEnum):
+    AUTH = "auth"  # 401/403 responses, or an "invalid jwt" error from the gateway
+    SERVER = "server"  # 5xx responses and connection errors
+    TIMEOUT = "timeout"
+
+
+class NegativeCache(Generic[T]):
+    """
+    Short-lived cache of failed upstream requests, keyed by (URL, hash of auth header, error class), so that clients
+    retrying requests which are doomed to fail (e.g., with an expired token) don't cause a request to each upstream
+    service every time. Since entries are per auth header, a client with a fresh token isn't affected by another's
+    failures. Each error class has its own TTL (0 to not cache that class of errors at all.)
+    """
+
+    def __init__(self, config: Config):
+        self._ttls: dict[UpstreamErrorClass, int] = {
+            UpstreamErrorClass.AUTH: config.negative_cache_ttl_auth,
+            UpstreamErrorClass.SERVER: config.negative_cache_ttl_server_error,
+            UpstreamErrorClass.TIMEOUT: config.negative_cache_ttl_timeout,
+        }
+        self._entries: dict[tuple[str, str, UpstreamErrorClass], CacheEntry[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str, authz_digest: str) -> tuple[UpstreamErrorClass, T] | None:
+        """
+        Gets the outcome of a recent failed request (if any, and not yet expired) to a URL with an auth header.
+        """
+
+        if not self._entries:
+            return None
+
+        now = time.monotonic()
+        for error_class, ttl in self._ttls.items():
+            if (entry := self._entries.get((url, authz_digest, error_class))) is not None:
+                if entry.age(now) < ttl:
+                    return error_class, entry.value
+                del self._entries[(url, authz_digest, error_class)]
+
+        return None
+
+    def put(self, url: str, authz_digest: str, error_class: UpstreamErrorClass, outcome: T):
+        if self._ttls[error_class] <= 0:
+            return
+
+        if len(self._entries) >= PRUNE_THRESHOLD:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v.age(now) < self._ttls[k[2]]}
+
+        self._entries[(url, authz_digest, error_class)] = CacheEntry(outcome)
+
+    def clear(self, url: str, authz_digest: str):
+        """
+        Forgets failed requests to a URL with an auth header, e.g., once a request has succeeded.
+        """
+        if self._entries:
+            for error_class in UpstreamErrorClass:
+                self._entries.pop((url, authz_digest, error_class), None)
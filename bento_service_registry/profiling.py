@@ -0,0 +1,197 @@
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from types import FrameType
+from typing import Any, Literal, NamedTuple
+
+from bento_lib.auth.exceptions import BentoAuthException
+from bento_lib.auth.middleware.fastapi import FastApiAuthMiddleware
+from bento_lib.responses.errors import http_error
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from .authz import require_admin
+
+__all__ = [
+    "ProfileFormat",
+    "ProfilerBusyError",
+    "Profile",
+    "SamplingProfiler",
+    "profile_response",
+    "build_profiling_middleware",
+]
+
+
+ProfileFormat = Literal["collapsed", "speedscope"]
+
+# Header which, in debug mode, makes the registry respond with a profile of the request instead of its usual response.
+PROFILE_HEADER = "X-Profile"
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+class _Frame(NamedTuple):
+    name: str
+    file: str
+    line: int
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.file}:{self.line})"
+
+
+# Profiling changes how long everything takes, so only one profile can be recorded at a time in a worker.
+_profiling_lock = threading.Lock()
+
+
+class Profile:
+    """
+    Stack samples recorded by SamplingProfiler, aggregated by stack (outermost frame first.)
+    """
+
+    def __init__(self, samples: Counter[tuple[_Frame, ...]], interval: float, duration: float):
+        self.samples: Counter[tuple[_Frame, ...]] = samples
+        self.interval: float = interval
+        self.duration: float = duration
+
+    @property
+    def n_samples(self) -> int:
+        return self.samples.total()
+
+    def to_collapsed(self) -> str:
+        """
+        Collapsed stacks ("frame;frame;frame count" lines), as taken by flamegraph.pl, speedscope, and similar tools.
+        """
+        return "".join(f"{';'.join(map(str, stack))} {n}\n" for stack, n in self.samples.most_common())
+
+    def to_speedscope(self, name: str = "bento_service_registry") -> dict:
+        """
+        A sampled profile in the speedscope file format (https://www.speedscope.app/file-format-schema.json.)
+        """
+        frame_indices: dict[_Frame, int] = {}
+        stacks: list[list[int]] = []
+        weights: list[float] = []
+
+        for stack, n in self.samples.most_common():
+            stacks.append([frame_indices.setdefault(f, len(frame_indices)) for f in stack])
+            weights.append(n * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "bento_service_registry",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [{"name": f.name, "file": f.file, "line": f.line} for f in frame_indices]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": stacks,
+                    "weights": weights,
+                }
+            ],
+        }
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the Python stack of one thread (by default, the calling thread; i.e., the event loop's) from a
+    background thread. Unlike cProfile, this doesn't hook every function call, so the overhead on the profiled thread
+    stays low enough to use in production, and it can profile a worker while it serves other requests as usual.
+    Since it samples a thread, profiles cover everything running on the event loop at the time, not just one request.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None):
+        self._interval: float = interval
+        self._thread_id: int = threading.get_ident() if thread_id is None else thread_id
+        self._samples: Counter[tuple[_Frame, ...]] = Counter()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._start: float = 0.0
+
+    def _sample(self):
+        frame: FrameType | None = sys._current_frames().get(self._thread_id)
+        stack: list[_Frame] = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(_Frame(code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        if stack:
+            self._samples[tuple(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def start(self):
+        if not _profiling_lock.acquire(blocking=False):
+            raise ProfilerBusyError("a profile is already being recorded")
+        self._start = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> Profile:
+        if self._sampler is None:
+            raise RuntimeError("profiler was not started")
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        _profiling_lock.release()
+        return Profile(self._samples, self._interval, time.perf_counter() - self._start)
+
+
+def profile_response(profile: Profile, format: ProfileFormat, headers: dict[str, str] | None = None) -> Response:
+    headers = {**(headers or {}), "X-Profile-Samples": str(profile.n_samples)}
+    if format == "speedscope":
+        return JSONResponse(profile.to_speedscope(), headers=headers)
+    return PlainTextResponse(profile.to_collapsed(), headers=headers)
+
+
+def build_profiling_middleware(
+    authz_middleware: FastApiAuthMiddleware,
+    interval: float = 0.001,
+) -> Callable[[Request, Callable[[Request], Awaitable[Response]]], Any]:
+    """
+    Builds a middleware which profiles requests sent with an X-Profile header (with a value of collapsed or speedscope),
+    responding with the profile instead of the usual response body. The usual response's status code is kept in the
+    X-Profiled-Status header. Only meant for debug mode. Like the admin profile endpoint, profiling a request is limited
+    to instance administrators, since the profile covers everything running on the event loop, not just the request.
+    """
+
+    async def _profiling_middleware(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        if (requested_format := request.headers.get(PROFILE_HEADER)) is None:
+            return await call_next(request)
+
+        # Checked in addition to the endpoint's own authorization (which the authz middleware still requires), so
+        # authorization is only marked as done here if the check fails and an error response is returned.
+        try:
+            await require_admin(request, authz_middleware)
+        except BentoAuthException as e:
+            authz_middleware.mark_authz_done(request)
+            return JSONResponse(http_error(e.status_code, e.message), status_code=e.status_code)
+
+        format: ProfileFormat = "speedscope" if requested_format == "speedscope" else "collapsed"
+
+        profiler = SamplingProfiler(interval)
+        try:
+            profiler.start()
+        except ProfilerBusyError:
+            return await call_next(request)
+
+        try:
+            response = await call_next(request)
+            # read through the whole body, so that serialization is included in the profile
+            async for _ in response.body_iterator:  # type: ignore
+                pass
+        finally:
+            profile = profiler.stop()
+
+        return profile_response(profile, format, {"X-Profiled-Status": str(response.status_code)})
+
+    return _profiling_middleware
@@ -1,15 +1,35 @@
-from fastapi import APIRouter, HTTPException, status
+import asyncio
+from typing import Annotated, Literal
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
 from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
 
-from .authz import authz_middleware
+from .authz import dep_admin_endpoint, dep_public_endpoint
 from .authz_header import OptionalAuthzHeaderDependency
-from .bento_services_json import BentoServicesByComposeIDDependency, BentoServicesByKindDependency
-from .data_types import DataTypesDependency, DataTypesTuple
+from .bento_services_json import (
+    BentoServicesByComposeIDDependency,
+    BentoServicesByKind,
+    BentoServicesByKindDependency,
+)
+from .compression import PrecompressedBodyCache, precompressed_json_response
+from .config import ConfigDependency
+from .constants import BENTO_SERVICE_KIND
+from .data_types import DataTypeManagerDependency, DataTypesDependency, DataTypesScope, DataTypesTuple
+from .federation import PeerRegistryManagerDependency
+from .health import HealthProberDependency
 from .http_session import HTTPSessionDependency
-from .models import DataTypeWithServiceURL
+from .listing import Page, next_page_headers, paginate, split_query_values
+from .loop_lag import LoopLagMonitorDependency
+from .models import DATA_TYPES_BATCH_MAX_SCOPES, DataTypesBatchRequest, DataTypeWithServiceURL
+from .profiling import ProfileFormat, ProfilerBusyError, SamplingProfiler, profile_response
 from .service_info import ServiceInfoDependency
 from .services import ServiceManagerDependency, ServicesDependency
-from .workflows import WorkflowsByPurpose, WorkflowsDependency
+from .tracing import TracerDependency, traces_to_otlp
+from .types import BENTO_SERVICE_INTERNAL_KEYS
+from .utils import IdentityCache, right_slash_normalize_url
+from .workflows import WorkflowManagerDependency, WorkflowsByPurpose, WorkflowsDependency
 
 __all__ = [
     "service_registry",
@@ -17,19 +37,84 @@ __all__ = [
 
 service_registry = APIRouter()
 
+# The merged data types/workflows responses are re-used by their managers for as long as the underlying cache entries
+# stay the same, so we can build each filtered/paginated view of them (a Page) once per set of query parameters, and
+# serialize & compress each page once, re-using the resulting bodies.
+_data_types_pages: IdentityCache[Page] = IdentityCache()
+_workflows_pages: IdentityCache[Page] = IdentityCache()
+_data_types_bodies = PrecompressedBodyCache()
+# serialized data types for each scope of batch responses, by identity of the scope's merged data types + fields. Sized
+# to hold a few maximum-size batches' worth of scopes, so that large (or concurrent) batches don't evict their own parts.
+_data_types_batch_parts: IdentityCache[bytes] = IdentityCache(4 * DATA_TYPES_BATCH_MAX_SCOPES)
+_workflows_bodies = PrecompressedBodyCache()
+_federated_bodies = PrecompressedBodyCache()
+
+_data_types_adapter = TypeAdapter(DataTypesTuple)
+_workflows_adapter = TypeAdapter(WorkflowsByPurpose)
+
+# data type fields which can be selected with ?fields=, by serialized name: model field name
+_DATA_TYPE_FIELDS: dict[str, str] = {(f.alias or name): name for name, f in DataTypeWithServiceURL.model_fields.items()}
+
+MultiValueQuery = Annotated[list[str] | None, Query()]
+
+
+def _dump_data_types(data_types: DataTypesTuple, fields: tuple[str, ...] | None = None) -> bytes:
+    # by_alias=True to match FastAPI's own response model serialization
+    include = {"__all__": {_DATA_TYPE_FIELDS[f] for f in fields}} if fields else None
+    return _data_types_adapter.dump_json(data_types, by_alias=True, include=include)
+
+
+def _data_type_cursor_key(dt: DataTypeWithServiceURL) -> str:
+    # data type IDs aren't necessarily unique across services
+    return f"{dt.id}@{dt.service_base_url}"
+
+
+def _dump_workflows(workflows: WorkflowsByPurpose) -> bytes:
+    return _workflows_adapter.dump_json(workflows, by_alias=True)
 
-@service_registry.get("/bento-services", dependencies=[authz_middleware.dep_public_endpoint()])
+
+@service_registry.get("/bento-services", dependencies=[dep_public_endpoint])
 async def bento_services(bento_services_by_compose_id: BentoServicesByComposeIDDependency):
     # unchanging public JSON served; cache for a day:
-    return JSONResponse(bento_services_by_compose_id, headers={"Cache-Control": "public, max-age=86400"})
+    #  - leave out internal networking details (internal URLs/Unix sockets), which aren't useful to the public.
+    return JSONResponse(
+        {
+            sk: {k: v for k, v in sv.items() if k not in BENTO_SERVICE_INTERNAL_KEYS}
+            for sk, sv in bento_services_by_compose_id.items()
+        },
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
 
 
-@service_registry.get("/services", dependencies=[authz_middleware.dep_public_endpoint()])
-async def list_services(services: ServicesDependency):
-    return services
+@service_registry.get("/services", dependencies=[dep_public_endpoint])
+async def list_services(
+    request: Request,
+    response: Response,
+    services: ServicesDependency,
+    kind: MultiValueQuery = None,
+    service_type: Annotated[list[str] | None, Query(alias="type")] = None,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    cursor: str | None = None,
+):
+    # There are only ever a handful of services, so filtering them on each request is cheap (unlike data types and
+    # workflows, which can be large, and whose views are cached below.)
+    kinds = split_query_values(kind)
+    types = split_query_values(service_type)
+
+    filtered = tuple(
+        s
+        for s in services
+        if (kinds is None or s.get("bento", {}).get("serviceKind") in kinds)
+        # type can be given either as just the artifact, or as group:artifact:version (as in /services/types)
+        and (types is None or s["type"]["artifact"] in types or ":".join(s["type"].values()) in types)
+    )
 
+    page = paginate(filtered, lambda s: s["id"], cursor, limit)
+    response.headers.update(next_page_headers(request, page))
+    return page.items
 
-@service_registry.get("/services/types", dependencies=[authz_middleware.dep_public_endpoint()])
+
+@service_registry.get("/services/types", dependencies=[dep_public_endpoint])
 async def list_service_types(services_tuple: ServicesDependency) -> list[dict]:
     types_by_key: dict[str, dict] = {}
     for st in (s["type"] for s in services_tuple):
@@ -39,7 +124,17 @@ async def list_service_types(services_tuple: ServicesDependency) -> list[dict]:
     return list(types_by_key.values())
 
 
-@service_registry.get("/services/{service_id}", dependencies=[authz_middleware.dep_public_endpoint()])
+# Must be registered before /services/{service_id}, which would otherwise match it.
+@service_registry.get("/services/health", dependencies=[dep_public_endpoint])
+async def services_health(health_prober: HealthProberDependency, config: ConfigDependency) -> dict:
+    return {
+        "probe_interval": config.health_probe_interval,
+        "history_size": config.health_history_size,
+        "services": health_prober.summary(),
+    }
+
+
+@service_registry.get("/services/{service_id}", dependencies=[dep_public_endpoint])
 async def get_service_by_id(
     authz_header: OptionalAuthzHeaderDependency,
     bento_services_by_kind: BentoServicesByKindDependency,
@@ -73,24 +168,233 @@ async def get_service_by_id(
     return service_data
 
 
-@service_registry.get("/data-types", dependencies=[authz_middleware.dep_public_endpoint()])
-async def list_data_types(data_types: DataTypesDependency) -> DataTypesTuple:
-    return data_types
+@service_registry.get("/data-types", dependencies=[dep_public_endpoint], response_model=DataTypesTuple)
+async def list_data_types(
+    request: Request,
+    data_types: DataTypesDependency,
+    ids: MultiValueQuery = None,
+    fields: MultiValueQuery = None,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    cursor: str | None = None,
+):
+    ids_ = split_query_values(ids)
+    fields_ = split_query_values(fields)
+
+    if fields_ and (unknown_fields := [f for f in fields_ if f not in _DATA_TYPE_FIELDS]):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown data type fields: {', '.join(unknown_fields)}")
+
+    def _build_page() -> Page:
+        dts = tuple(dt for dt in data_types if dt.id in ids_) if ids_ else data_types
+        return paginate(dts, _data_type_cursor_key, cursor, limit)
+
+    page = _data_types_pages.get(data_types, _build_page, variant=(ids_, fields_, cursor, limit))
+    return precompressed_json_response(
+        request,
+        _data_types_bodies,
+        page,
+        lambda p: _dump_data_types(p.items, fields_),
+        next_page_headers(request, page),
+    )
+
+
+def _parse_data_types_scope(scope: str) -> DataTypesScope:
+    # "" (the whole node), "<project>", or "<project>/<dataset>"
+    if not scope:
+        return None, None
+    parts = scope.split("/")
+    if len(parts) > 2 or not all(parts):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid scope: {scope}")
+    return parts[0], (parts[1] if len(parts) == 2 else None)
+
+
+@service_registry.post("/data-types/batch", dependencies=[dep_public_endpoint])
+async def list_data_types_batch(
+    authz_header: OptionalAuthzHeaderDependency,
+    bento_services_by_kind: BentoServicesByKindDependency,
+    config: ConfigDependency,
+    data_type_manager: DataTypeManagerDependency,
+    http_session: HTTPSessionDependency,
+    services_tuple: ServicesDependency,
+    body: DataTypesBatchRequest,
+):
+    # Data types for many scopes at once (e.g., counts for every project and dataset shown on a page), keyed by scope.
+    fields_ = split_query_values(body.fields)
+
+    if fields_ and (unknown_fields := [f for f in fields_ if f not in _DATA_TYPE_FIELDS]):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown data type fields: {', '.join(unknown_fields)}")
+
+    scopes = {s: _parse_data_types_scope(s) for s in body.scopes}
+
+    res = await data_type_manager.get_data_types_for_scopes(
+        authz_header,
+        http_session,
+        services_tuple,
+        bento_services_by_kind,
+        tuple(scopes.values()),
+        config.data_types_batch_concurrency_per_service,
+    )
+
+    # Assemble the response from per-scope serialized data types, which are re-used for as long as each scope's data
+    # types stay the same.
+    def _dump_scope(data_types: DataTypesTuple) -> bytes:
+        return _data_types_batch_parts.get(data_types, lambda: _dump_data_types(data_types, fields_), fields_)
+
+    parts = (orjson.dumps(s) + b":" + _dump_scope(res[scope]) for s, scope in scopes.items())
+    return Response(b"{" + b",".join(parts) + b"}", media_type="application/json")
 
 
-@service_registry.get("/data-types/{data_type_id}", dependencies=[authz_middleware.dep_public_endpoint()])
+@service_registry.get("/data-types/{data_type_id}", dependencies=[dep_public_endpoint])
 async def get_data_type(data_types: DataTypesDependency, data_type_id: str) -> DataTypeWithServiceURL:
     if (dt_res := {dt.id: dt for dt in data_types}.get(data_type_id)) is not None:
         return dt_res
     raise HTTPException(status.HTTP_404_NOT_FOUND, f"Data type with ID {data_type_id} was not found")
 
 
-@service_registry.get("/workflows", dependencies=[authz_middleware.dep_public_endpoint()])
-async def list_workflows_by_purpose(workflows: WorkflowsDependency) -> WorkflowsByPurpose:
-    return workflows
+@service_registry.get("/workflows", dependencies=[dep_public_endpoint], response_model=WorkflowsByPurpose)
+async def list_workflows_by_purpose(
+    request: Request,
+    bento_services_by_kind: BentoServicesByKindDependency,
+    workflows: WorkflowsDependency,
+    purpose: MultiValueQuery = None,
+    service: MultiValueQuery = None,
+):
+    purposes = split_query_values(purpose)
+    service_kinds = split_query_values(service)
+
+    def _build_page() -> Page:
+        if purposes is None and service_kinds is None:
+            return Page(workflows)
+
+        # workflows are filtered by the (public) base URL of the service kind(s) which provide them
+        service_urls: set[str] | None = None
+        if service_kinds is not None:
+            service_urls = {
+                right_slash_normalize_url(bs["url"])
+                for bs in (bento_services_by_kind.get(k) for k in service_kinds)
+                if bs is not None and "url" in bs
+            }
+
+        filtered: WorkflowsByPurpose = {}
+        for p, p_wfs in workflows.items():
+            if purposes is not None and p not in purposes:
+                continue
+            if service_urls is not None:
+                p_wfs = {k: wf for k, wf in p_wfs.items() if wf.service_base_url in service_urls}
+            if p_wfs:
+                filtered[p] = p_wfs
+        return Page(filtered)
+
+    page = _workflows_pages.get(workflows, _build_page, variant=(purposes, service_kinds))
+    return precompressed_json_response(request, _workflows_bodies, page, lambda p: _dump_workflows(p.items))
+
+
+@service_registry.get("/workflows/conflicts", dependencies=[dep_public_endpoint])
+async def list_workflow_conflicts(
+    authz_header: OptionalAuthzHeaderDependency,
+    workflow_manager: WorkflowManagerDependency,
+    _workflows: WorkflowsDependency,  # (re-)collects workflows, if needed
+) -> list[dict]:
+    return [
+        {
+            "purpose": c.purpose,
+            "id": c.workflow_id,
+            "service_base_urls": c.service_base_urls,
+            # later services' workflows take precedence; see merge_workflows(...)
+            "used": c.service_base_urls[-1],
+        }
+        for c in workflow_manager.get_conflicts(authz_header)
+    ]
+
+
+def _local_node(bento_services_by_kind: BentoServicesByKind) -> str:
+    # In federated views, nodes are identified by the (public) base URL of their service registry.
+    return bento_services_by_kind[BENTO_SERVICE_KIND]["url"]
+
+
+@service_registry.get("/federation/nodes", dependencies=[dep_public_endpoint])
+async def list_federation_nodes(
+    bento_services_by_kind: BentoServicesByKindDependency, peer_registry_manager: PeerRegistryManagerDependency
+):
+    return {
+        "node": right_slash_normalize_url(_local_node(bento_services_by_kind)),
+        "peers": peer_registry_manager.node_statuses(),
+    }
+
+
+@service_registry.get("/federation/services", dependencies=[dep_public_endpoint])
+async def list_federated_services(
+    bento_services_by_kind: BentoServicesByKindDependency,
+    peer_registry_manager: PeerRegistryManagerDependency,
+    services: ServicesDependency,
+):
+    return await peer_registry_manager.get_merged("services", _local_node(bento_services_by_kind), services)
+
+
+@service_registry.get("/federation/data-types", dependencies=[dep_public_endpoint])
+async def list_federated_data_types(
+    request: Request,
+    bento_services_by_kind: BentoServicesByKindDependency,
+    peer_registry_manager: PeerRegistryManagerDependency,
+    data_types: DataTypesDependency,
+):
+    merged = await peer_registry_manager.get_merged("data-types", _local_node(bento_services_by_kind), data_types)
+    return precompressed_json_response(request, _federated_bodies, merged, orjson.dumps)
+
 
+@service_registry.get("/federation/workflows", dependencies=[dep_public_endpoint])
+async def list_federated_workflows(
+    request: Request,
+    bento_services_by_kind: BentoServicesByKindDependency,
+    peer_registry_manager: PeerRegistryManagerDependency,
+    workflows: WorkflowsDependency,
+):
+    merged = await peer_registry_manager.get_merged("workflows", _local_node(bento_services_by_kind), workflows)
+    return precompressed_json_response(request, _federated_bodies, merged, orjson.dumps)
 
-@service_registry.get("/service-info", dependencies=[authz_middleware.dep_public_endpoint()])
+
+@service_registry.get("/service-info", dependencies=[dep_public_endpoint])
 async def get_service_info(service_info: ServiceInfoDependency):
     # Spec: https://github.com/ga4gh-discovery/ga4gh-service-info
     return service_info
+
+
+@service_registry.get("/admin/traces", dependencies=[dep_admin_endpoint])
+async def list_traces(
+    tracer: TracerDependency,
+    limit: Annotated[int, Query(ge=1)] = 20,
+    min_duration_ms: Annotated[float, Query(ge=0)] = 0,
+    format: Literal["waterfall", "otlp"] = "waterfall",
+):
+    # Recent traces of requests which contacted upstream services, most recent first - either as a list of traces with
+    # spans timed relative to the start of each trace (for rendering waterfalls), or in the OpenTelemetry JSON format.
+    traces = tracer.recent(limit, min_duration_ms)
+    if format == "otlp":
+        return traces_to_otlp(traces)
+    return [tr.to_waterfall() for tr in traces]
+
+
+@service_registry.get("/admin/loop-lag", dependencies=[dep_admin_endpoint])
+async def get_loop_lag(loop_lag_monitor: LoopLagMonitorDependency) -> dict:
+    return loop_lag_monitor.status()
+
+
+@service_registry.get("/admin/profile", dependencies=[dep_admin_endpoint])
+async def record_profile(
+    seconds: Annotated[float, Query(gt=0, le=60)] = 10,
+    interval_ms: Annotated[float, Query(ge=1, le=1000)] = 5,
+    format: ProfileFormat = "collapsed",
+):
+    # Samples this worker's event loop thread while it keeps serving requests as usual, then responds with the samples,
+    # either as collapsed stacks (for flamegraph.pl, speedscope, etc.) or as a speedscope profile.
+    profiler = SamplingProfiler(interval_ms / 1000)
+    try:
+        profiler.start()
+    except ProfilerBusyError as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, str(e))
+
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = profiler.stop()
+
+    return profile_response(profile, format)
@@ -0,0 +1,151 @@
+import asyncio
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Hashable
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from functools import cache
+
+from .config import Config
+from .tracing import span
+
+__all__ = [
+    "Priority",
+    "UpstreamScheduler",
+    "get_upstream_scheduler",
+]
+
+
+class Priority(IntEnum):
+    # Lower values go first
+    INTERACTIVE = 0  # requests made on behalf of a waiting client
+    BACKGROUND = 1  # background refresh / warm-up work
+
+
+class _Waiter:
+    __slots__ = ("future", "upstream")
+
+    def __init__(self, upstream: str, future: asyncio.Future[None]):
+        self.upstream = upstream
+        self.future = future
+
+
+class UpstreamScheduler:
+    """
+    Limits the number of concurrent requests made to upstream services, both globally and per service. Requests which
+    can't be made right away are queued, and are granted slots by priority; within a priority level, slots are handed
+    out round-robin between flows (e.g., scopes/authorization headers) so that one burst can't starve other requests.
+    """
+
+    def __init__(self, max_concurrency: int, max_concurrency_per_service: int):
+        self._max_concurrency: int = max_concurrency
+        self._max_concurrency_per_service: int = max_concurrency_per_service
+
+        self._n_active: int = 0
+        self._n_active_by_upstream: dict[str, int] = {}
+
+        # queues of waiters: priority -> flow -> waiters, where flows are kept in round-robin order
+        self._queues: dict[Priority, OrderedDict[Hashable, deque[_Waiter]]] = {p: OrderedDict() for p in Priority}
+        self._n_waiting: int = 0
+
+    @property
+    def n_active(self) -> int:
+        return self._n_active
+
+    @property
+    def n_waiting(self) -> int:
+        return self._n_waiting
+
+    def _has_capacity(self, upstream: str) -> bool:
+        return (
+            self._n_active < self._max_concurrency
+            and self._n_active_by_upstream.get(upstream, 0) < self._max_concurrency_per_service
+        )
+
+    def _take(self, upstream: str):
+        self._n_active += 1
+        self._n_active_by_upstream[upstream] = self._n_active_by_upstream.get(upstream, 0) + 1
+
+    def _release(self, upstream: str):
+        self._n_active -= 1
+        if (n := self._n_active_by_upstream[upstream] - 1) > 0:
+            self._n_active_by_upstream[upstream] = n
+        else:
+            del self._n_active_by_upstream[upstream]
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand out as many free slots as we can to queued waiters, by priority, then round-robin between flows.
+        while self._n_waiting and self._n_active < self._max_concurrency:
+            if not self._dispatch_one():
+                break  # all waiters are for upstreams which are at their limit
+
+    def _dispatch_one(self) -> bool:
+        for queue in self._queues.values():
+            for flow, waiters in queue.items():
+                for waiter in waiters:
+                    if not self._has_capacity(waiter.upstream):
+                        continue
+
+                    waiters.remove(waiter)
+                    self._n_waiting -= 1
+
+                    # move the flow to the back of the round-robin order (or drop it if it has no more waiters)
+                    queue.pop(flow)
+                    if waiters:
+                        queue[flow] = waiters
+
+                    self._take(waiter.upstream)
+                    waiter.future.set_result(None)
+                    return True
+        return False
+
+    def _remove_waiter(self, priority: Priority, flow: Hashable, waiter: _Waiter):
+        queue = self._queues[priority]
+        if (waiters := queue.get(flow)) is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._n_waiting -= 1
+            if not waiters:
+                del queue[flow]
+
+    @asynccontextmanager
+    async def slot(
+        self, upstream: str, flow: Hashable = None, priority: Priority = Priority.INTERACTIVE
+    ) -> AsyncIterator[None]:
+        """
+        Waits for (and holds, for the duration of the context) a slot for making a request to an upstream service.
+        :param upstream: Key identifying the upstream service being contacted (see UpstreamTarget.upstream_key).
+        :param flow: Key for fair queueing; waiting requests are served round-robin between flows.
+        :param priority: Priority of the request; queued requests with a lower priority value are served first.
+        """
+
+        if not self._n_waiting and self._has_capacity(upstream):
+            self._take(upstream)
+        else:
+            waiter = _Waiter(upstream, asyncio.get_running_loop().create_future())
+            self._queues[priority].setdefault(flow, deque()).append(waiter)
+            self._n_waiting += 1
+            self._dispatch()
+
+            try:
+                with span("upstream queue", upstream=upstream, priority=priority.name):
+                    await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # we were granted a slot, but got cancelled before we could use it - give it back.
+                    self._release(upstream)
+                else:
+                    self._remove_waiter(priority, flow, waiter)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(upstream)
+
+
+@cache
+def get_upstream_scheduler(config: Config) -> UpstreamScheduler:
+    """
+    Gets a *singleton* instance of UpstreamScheduler, shared by everything which contacts upstream services.
+    """
+    return UpstreamScheduler(config.upstream_max_concurrency, config.upstream_max_concurrency_per_service)
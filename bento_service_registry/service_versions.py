@@ -0,0 +1,43 @@
+from bento_lib.service_info.types import GA4GHServiceInfo
+
+__all__ = [
+    "ServiceVersion",
+    "service_version",
+    "ServiceVersionTracker",
+]
+
+
+# (version, git commit) - the git commit is only present for services running in local development mode, but allows us
+# to pick up changes to a service even if its version string hasn't been bumped.
+ServiceVersion = tuple[str | None, str | None]
+
+
+def service_version(service: GA4GHServiceInfo | dict) -> ServiceVersion:
+    return service.get("version"), service.get("bento", {}).get("gitCommit")
+
+
+class ServiceVersionTracker:
+    """
+    Keeps track of the last-seen version of each service (keyed by service URL), so that caches of data derived from a
+    service (workflows, data type schemas) can be invalidated for that service alone when it is upgraded/downgraded.
+    """
+
+    def __init__(self):
+        self._versions: dict[str, ServiceVersion] = {}
+
+    def update(self, service_url: str, service: GA4GHServiceInfo | dict) -> bool:
+        """
+        Records the current version of a service.
+        :return: Whether the service's version changed since the last time it was seen. A service seen for the first
+                 time is not considered changed, since there cannot be anything cached for it yet.
+        """
+        version = service_version(service)
+        old_version = self._versions.get(service_url)
+        self._versions[service_url] = version
+        return old_version is not None and old_version != version
+
+    def snapshot(self) -> dict[str, ServiceVersion]:
+        return dict(self._versions)
+
+    def restore(self, versions: dict[str, ServiceVersion]):
+        self._versions.update({k: (v[0], v[1]) for k, v in versions.items()})
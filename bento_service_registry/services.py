@@ -1,26 +1,33 @@
 from __future__ import annotations
 
 import asyncio
-from collections.abc import Awaitable
-from datetime import UTC, datetime
+import time
 from functools import lru_cache
 from json import JSONDecodeError
 from typing import Annotated
 from urllib.parse import urljoin
 
-from aiohttp import ClientConnectionError, ClientSession, ContentTypeError
+from aiohttp import ClientConnectionError, ClientSession
 from bento_lib.service_info.types import GA4GHServiceInfo
 from fastapi import Depends, status
 from structlog.stdlib import BoundLogger
 
 from .authz_header import OptionalAuthzHeaderDependency, OptionalHeaders
 from .bento_services_json import BentoServicesByKind, BentoServicesByKindDependency
+from .cache_entry import CacheEntry
 from .config import Config, ConfigDependency
 from .constants import BENTO_SERVICE_KIND
-from .http_session import HTTPSessionDependency
-from .logger import LoggerDependency
+from .http_session import HTTPSessionDependency, http_session_lease
+from .inflight import InFlight, until_disconnected
+from .logger import LoggerDependency, sample_upstream_success
+from .loop_lag import get_loop_lag_monitor
+from .scheduler import Priority
 from .service_info import ServiceInfoDependency
+from .tracing import mark_error, span
+from .transport import get_upstream_target
 from .types import BentoService
+from .upstream import UpstreamContentTypeError, UpstreamResponse, get_upstream_fetcher
+from .utils import authz_header_digest
 
 __all__ = [
     "get_service_manager",
@@ -30,18 +37,72 @@ __all__ = [
 ]
 
 
+def _service_info_url(s_url: str) -> str:
+    # cache key, and what's reported in logs - the public service info URL
+    return urljoin(f"{s_url}/", "service-info")
+
+
 class ServiceManager:
     def __init__(self, config: Config, logger: BoundLogger):
         self._config: Config = config
-        self._co: Awaitable[list[dict | None]] | None = None
         self._logger: BoundLogger = logger
-        self._cache: dict[str, tuple[datetime, GA4GHServiceInfo]] = {}
+        self._fetcher = get_upstream_fetcher(config)
+        self._loop_lag = get_loop_lag_monitor(config)
+        self._cache: dict[str, CacheEntry[GA4GHServiceInfo]] = {}
+        # cache entries restored from a snapshot, which are served regardless of age until they have been revalidated:
+        self._stale: set[str] = set()
+        # in-progress fetches by service info URL, shared by concurrent fan-outs (rather than each fetching separately)
+        self._in_flight: InFlight[dict | None] = InFlight()
+
+    def _entry_valid(self, now: float, key: str, entry: CacheEntry[GA4GHServiceInfo]) -> bool:
+        # in degraded mode, entries are served regardless of age (see LoopLagMonitor)
+        return entry.age(now) <= self._config.cache_ttl or key in self._stale or self._loop_lag.degraded
 
     def _clean_cache(self):
-        now = datetime.now(UTC)
-        for k, v in self._cache.items():
-            if (now - v[0]).total_seconds() >= self._config.cache_ttl:
-                del self._cache[k]
+        now = time.monotonic()
+        self._cache = {k: v for k, v in self._cache.items() if self._entry_valid(now, k, v)}
+
+    def snapshot(self) -> dict:
+        return {k: [v.fetched_iso(), v.value] for k, v in self._cache.items()}
+
+    def restore(self, snapshot: dict):
+        for k, (fetched, service_info) in snapshot.items():
+            self._cache[k] = CacheEntry.from_fetched_iso(service_info, fetched)
+            self._stale.add(k)
+
+    def clear_stale(self):
+        # Stop serving entries restored from a snapshot regardless of age, whether or not they were revalidated.
+        self._stale.clear()
+
+    async def revalidate(
+        self,
+        bento_services_by_kind: BentoServicesByKind,
+        http_session: ClientSession,
+        service_info: GA4GHServiceInfo,
+    ):
+        # Stop serving stale entries regardless of age, and re-fetch any which have expired.
+        self._stale.clear()
+        await self.get_services(None, bento_services_by_kind, http_session, service_info, Priority.BACKGROUND)
+
+    def _store(self, service_info_url: str, s_url: str, r: UpstreamResponse) -> dict:
+        # raises JSONDecodeError, UpstreamContentTypeError, or TypeError if the response isn't a service info object
+        service_resp = {**r.json(), "url": s_url}
+        self._cache[service_info_url] = CacheEntry(GA4GHServiceInfo(**service_resp))
+        self._stale.discard(service_info_url)
+        return service_resp
+
+    def store_probe_response(self, service_metadata: BentoService, r: UpstreamResponse) -> bool:
+        """
+        Caches the service info from a successful health probe of a service (see HealthProber), so that requests are
+        served from it rather than fetching the service info themselves once the previous entry expires. Probes are
+        made without an authorization header, like the service info cache is shared regardless of header. Returns
+        whether the response was a valid service info object.
+        """
+        try:
+            self._store(_service_info_url(service_metadata["url"]), service_metadata["url"], r)
+        except (JSONDecodeError, UpstreamContentTypeError, TypeError):
+            return False
+        return True
 
     async def get_service(
         self,
@@ -49,6 +110,7 @@ class ServiceManager:
         http_session: HTTPSessionDependency,
         service_info: ServiceInfoDependency,
         service_metadata: BentoService,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> GA4GHServiceInfo | None:
         kind = service_metadata["service_kind"]
         s_url: str = service_metadata["url"]
@@ -58,57 +120,95 @@ class ServiceManager:
         if kind == BENTO_SERVICE_KIND:
             return GA4GHServiceInfo(**service_info, url=s_url)
 
-        service_info_url: str = urljoin(f"{s_url}/", "service-info")
-        logger = self._logger.bind(service_kind=kind, service_info_url=service_info_url)
+        service_info_url = _service_info_url(s_url)
+        # Rather than binding a new logger for every service on every fan-out, pass context to the (rarer) log calls.
+        log_ctx = {"service_kind": kind, "service_info_url": service_info_url}
 
-        dt = datetime.now(UTC)
+        start = time.monotonic()
 
-        if service_info_url in self._cache:
-            entry_dt, entry = self._cache[service_info_url]
-            if (entry_age := (dt - entry_dt).total_seconds()) > self._config.cache_ttl:
+        if (entry := self._cache.get(service_info_url)) is not None:
+            if not self._entry_valid(start, service_info_url, entry):
                 del self._cache[service_info_url]
             else:
-                await logger.adebug("found service info in cache", cache_age=entry_age)
-                return entry
+                if sample_upstream_success(self._config):
+                    self._logger.debug("found service info in cache", cache_age=entry.age(start), **log_ctx)
+                return entry.value
 
-        await logger.ainfo("contacting service info", with_bearer_token=bool(authz_header))
+        return await self._in_flight.run(
+            service_info_url,
+            lambda: self._fetch_service_info(authz_header, http_session, service_metadata, priority, log_ctx),
+        )
+
+    async def _fetch_service_info(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: ClientSession,
+        service_metadata: BentoService,
+        priority: Priority,
+        log_ctx: dict[str, str],
+    ) -> dict | None:
+        kind = service_metadata["service_kind"]
+        s_url: str = service_metadata["url"]
+        service_info_url = log_ctx["service_info_url"]
+
+        start = time.monotonic()
+
+        if sample_upstream_success(self._config):
+            self._logger.debug("contacting service info", with_bearer_token=bool(authz_header), **log_ctx)
 
         service_resp: dict | None = None
 
-        try:
-            async with http_session.get(service_info_url, headers=authz_header) as r:
+        # We may contact the service via an internal URL or Unix socket, rather than via its public URL:
+        target = get_upstream_target(self._config, http_session, s_url, service_metadata)
+        flow = ("services", authz_header_digest(authz_header))
+
+        async with http_session_lease(http_session):
+            with span("fetch service info", service_kind=kind):
+                try:
+                    r = await self._fetcher.get(target, target.url("service-info"), authz_header, flow, priority)
+                except asyncio.TimeoutError:
+                    self._logger.error("service info fetch timeout", **log_ctx)
+                    mark_error("timeout")
+                    return None
+                except ClientConnectionError as e:
+                    self._logger.exception("service info fetch connection error", exc_info=e, **log_ctx)
+                    mark_error(type(e).__name__)
+                    return None
+
                 if r.status != status.HTTP_200_OK:
-                    r_text = await r.text()
-                    await logger.aerror("service info fetch non-200 status code", status=r.status, body=r_text)
+                    r_text = r.text()
+                    self._logger.error(
+                        "service info fetch non-200 status code", status=r.status, body=r_text, **log_ctx
+                    )
 
                     # If we have the special case where we got a JWT error from the proxy script, we can safely print
                     # out headers for debugging, since the JWT leaked isn't valid anyway.
                     if "invalid jwt" in r_text:
-                        await logger.aerror("service info fetch encountered auth error", authz_header=authz_header)
+                        self._logger.error(
+                            "service info fetch encountered auth error", authz_header=authz_header, **log_ctx
+                        )
 
+                    mark_error(f"status {r.status}")
                     return None
 
                 try:
-                    service_resp = {**(await r.json()), "url": s_url}
-                    res_dt = datetime.now(UTC)
-                    self._cache[service_info_url] = (res_dt, GA4GHServiceInfo(**service_resp))
-                    await logger.adebug("service info fetch complete", time_taken=(res_dt - dt).total_seconds())
-                except (JSONDecodeError, ContentTypeError, TypeError) as e:
+                    service_resp = self._store(service_info_url, s_url, r)
+                    if sample_upstream_success(self._config):
+                        self._logger.debug(
+                            "service info fetch complete", time_taken=time.monotonic() - start, **log_ctx
+                        )
+                except (JSONDecodeError, UpstreamContentTypeError, TypeError) as e:
                     # JSONDecodeError can happen if the JSON is invalid
-                    # ContentTypeError can happen if the Content-Type is not application/json
+                    # UpstreamContentTypeError can happen if the Content-Type is not application/json
                     # TypeError can happen if None is received
-                    await logger.aexception(
+                    self._logger.exception(
                         "service info fetch invalid response",
                         exc_info=e,
-                        body=await r.text(),
-                        time_taken=(datetime.now(UTC) - dt).total_seconds(),
+                        body=r.text(),
+                        time_taken=time.monotonic() - start,
+                        **log_ctx,
                     )
-
-        except asyncio.TimeoutError:
-            await logger.aerror("service info fetch timeout")
-
-        except ClientConnectionError as e:
-            await logger.aexception("service info fetch connection error", exc_info=e)
+                    mark_error("invalid response")
 
         return service_resp
 
@@ -118,19 +218,36 @@ class ServiceManager:
         bento_services_by_kind: BentoServicesByKind,
         http_session: ClientSession,
         service_info: GA4GHServiceInfo,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> tuple[dict, ...]:
-        if not self._co:
-            self._co = asyncio.gather(
-                *(
-                    self.get_service(authz_header, http_session, service_info, s)
-                    for s in bento_services_by_kind.values()
+        started = time.monotonic()
+
+        # Concurrent fan-outs share per-service fetches (see InFlight), so if the client goes away, its fan-out can be
+        # abandoned without affecting anyone else's.
+        with span("service info fan-out"):
+            service_list: list[dict | None] = await until_disconnected(
+                asyncio.gather(
+                    *(
+                        self.get_service(authz_header, http_session, service_info, s, priority)
+                        for s in bento_services_by_kind.values()
+                    )
                 )
             )
 
-        service_list: list[dict | None] = await self._co
-        self._co = None
+        services = tuple(s for s in service_list if s is not None)
+
+        # Log one summary line for the fan-out, in place of (sampled) per-service lines. This happens on every request
+        # which needs the service list (most of them), so it's at debug level like other cache hits; errors fetching
+        # individual services are logged at error level as they happen.
+        self._logger.debug(
+            "collected service info",
+            n_services=len(service_list),
+            n_unavailable=len(service_list) - len(services),
+            with_bearer_token=bool(authz_header),
+            time_taken=time.monotonic() - started,
+        )
 
-        return tuple(s for s in service_list if s is not None)
+        return services
 
 
 @lru_cache
@@ -0,0 +1,169 @@
+import asyncio
+import os
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import aiofiles
+import orjson
+from pydantic import BaseModel
+from structlog.stdlib import BoundLogger
+
+from .bento_services_json import get_bento_services_by_compose_id, get_bento_services_by_kind
+from .config import Config
+from .data_types import DataTypeManager
+from .http_session import create_http_session
+from .loop_lag import get_loop_lag_monitor
+from .service_info import get_service_info
+from .services import ServiceManager
+from .tracing import get_tracer
+from .workflows import WorkflowManager
+
+__all__ = [
+    "CacheSnapshotter",
+]
+
+
+# Bump this whenever the structure of manager snapshots changes; snapshots with a different format version are ignored.
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", by_alias=True)
+    raise TypeError
+
+
+class CacheSnapshotter:
+    """
+    Periodically writes the non-sensitive (i.e., not specific to an authorization header) contents of the service, data
+    type, and workflow caches to disk, and restores them on startup. Restored entries are marked stale: they are served
+    right away, but are revalidated in the background.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        logger: BoundLogger,
+        service_manager: ServiceManager,
+        data_type_manager: DataTypeManager,
+        workflow_manager: WorkflowManager,
+    ):
+        self._config: Config = config
+        self._logger: BoundLogger = logger
+        self._service_manager: ServiceManager = service_manager
+        self._data_type_manager: DataTypeManager = data_type_manager
+        self._workflow_manager: WorkflowManager = workflow_manager
+        self._loop_lag = get_loop_lag_monitor(config)
+
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def path(self) -> Path | None:
+        return self._config.cache_snapshot_path
+
+    def _collect(self) -> dict:
+        return {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "created": datetime.now(UTC).isoformat(),
+            "services": self._service_manager.snapshot(),
+            "data_types": self._data_type_manager.snapshot(),
+            "workflows": self._workflow_manager.snapshot(),
+        }
+
+    @staticmethod
+    def _write(path: Path, data: dict):
+        # Write to a temporary file first, then move it into place, so that the snapshot is replaced atomically and we
+        # never end up with a partially-written snapshot.
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(orjson.dumps(data, default=_orjson_default))
+        os.replace(tmp_path, path)
+
+    async def save(self):
+        if (path := self.path) is None:
+            return
+        # Collect references to cache contents on the event loop, then serialize + write them in a worker thread.
+        await asyncio.to_thread(self._write, path, self._collect())
+        self._logger.debug("wrote cache snapshot", path=str(path))
+
+    async def load(self) -> bool:
+        if (path := self.path) is None or not path.exists():
+            return False
+
+        try:
+            async with aiofiles.open(path, "rb") as fh:
+                data = await asyncio.to_thread(orjson.loads, await fh.read())
+
+            if data.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                self._logger.warning("ignoring cache snapshot with different format version", path=str(path))
+                return False
+
+            self._service_manager.restore(data["services"])
+            self._data_type_manager.restore(data["data_types"])
+            self._workflow_manager.restore(data["workflows"])
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            # A missing/corrupt snapshot shouldn't stop us from starting, since it's only an optimization.
+            #  - orjson.JSONDecodeError and pydantic.ValidationError are both subclasses of ValueError.
+            self._logger.exception("could not load cache snapshot", path=str(path), exc_info=e)
+            return False
+
+        self._logger.info("loaded cache snapshot", path=str(path), created=data.get("created"))
+        return True
+
+    async def revalidate(self):
+        config = self._config
+        bento_services_by_kind = await get_bento_services_by_kind(await get_bento_services_by_compose_id(config))
+        service_info = await get_service_info(config, self._logger)
+
+        http_session = create_http_session(config)
+        try:
+            with get_tracer(config).trace("revalidate cache snapshot"):
+                await self._service_manager.revalidate(bento_services_by_kind, http_session, service_info)
+                await asyncio.gather(
+                    self._data_type_manager.revalidate(bento_services_by_kind, http_session),
+                    self._workflow_manager.revalidate(bento_services_by_kind, http_session),
+                )
+        finally:
+            await http_session.close()
+
+        self._logger.info("revalidated cache entries from snapshot")
+
+    def _clear_stale(self):
+        self._service_manager.clear_stale()
+        self._data_type_manager.clear_stale()
+        self._workflow_manager.clear_stale()
+
+    async def _revalidate_task(self):
+        try:
+            await self.revalidate()
+        except Exception as e:  # background task; log and move on
+            self._logger.exception("encountered error revalidating cache entries from snapshot", exc_info=e)
+        finally:
+            # If revalidation failed (or was cancelled) before reaching every manager, restored entries would otherwise
+            # be served regardless of age forever; from here on, they expire like any other entry.
+            self._clear_stale()
+
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self._config.cache_snapshot_interval)
+            try:
+                # postponed while the event loop is lagging (see LoopLagMonitor)
+                if not self._loop_lag.degraded:
+                    await self.save()
+            except Exception as e:  # background task; log and keep trying
+                self._logger.exception("encountered error writing cache snapshot", exc_info=e)
+
+    async def start(self):
+        if self.path is None:
+            return
+        if await self.load():
+            self._tasks.append(asyncio.create_task(self._revalidate_task()))
+        self._tasks.append(asyncio.create_task(self._save_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.save()
@@ -0,0 +1,353 @@
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from types import SimpleNamespace
+from typing import Annotated, Any, Literal
+
+import aiohttp
+from fastapi import Depends, Request, Response
+
+from .config import Config, ConfigDependency
+from .constants import BENTO_SERVICE_KIND
+
+__all__ = [
+    "Span",
+    "Trace",
+    "Tracer",
+    "get_tracer",
+    "TracerDependency",
+    "traces_to_otlp",
+    "span",
+    "mark_error",
+    "trace_configs",
+    "build_tracing_middleware",
+]
+
+
+SpanKind = Literal["internal", "server", "client"]
+
+# OpenTelemetry span kind values (see opentelemetry-proto trace.proto)
+_OTLP_SPAN_KINDS: dict[SpanKind, int] = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    """
+    A timed operation within a trace. Times are kept as monotonic (perf_counter) nanoseconds, and converted to wall
+    clock times relative to the start of the trace when exported.
+    """
+
+    __slots__ = ("attributes", "end", "error", "kind", "name", "parent_id", "span_id", "start")
+
+    def __init__(self, name: str, parent_id: int | None, kind: SpanKind, attributes: dict[str, Any]):
+        self.span_id: int = random.getrandbits(64)
+        self.parent_id: int | None = parent_id
+        self.name: str = name
+        self.kind: SpanKind = kind
+        self.attributes: dict[str, Any] = attributes
+        self.error: str | None = None
+        self.start: int = time.perf_counter_ns()
+        self.end: int | None = None
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter_ns()
+
+
+class Trace:
+    """
+    A tree of spans, recorded for one incoming request (or one piece of background work.)
+    """
+
+    __slots__ = ("root", "spans", "start_unix_ns", "trace_id")
+
+    def __init__(self, root_name: str, attributes: dict[str, Any]):
+        self.trace_id: int = random.getrandbits(128)
+        self.start_unix_ns: int = time.time_ns()
+        self.root: Span = Span(root_name, None, "server", attributes)
+        self.spans: list[Span] = [self.root]
+
+    @property
+    def duration_ns(self) -> int:
+        return (self.root.end or time.perf_counter_ns()) - self.root.start
+
+    @property
+    def has_upstream_requests(self) -> bool:
+        return any(s.kind == "client" for s in self.spans)
+
+    def _unix_ns(self, perf_ns: int) -> int:
+        return self.start_unix_ns + (perf_ns - self.root.start)
+
+    def critical_path(self) -> list[Span]:
+        """
+        Follows the latest-finishing child from the root down; i.e., the chain of spans which the trace waited on.
+        """
+        children: dict[int, list[Span]] = {}
+        for s in self.spans:
+            if s.parent_id is not None:
+                children.setdefault(s.parent_id, []).append(s)
+
+        path = [self.root]
+        while cs := children.get(path[-1].span_id):
+            path.append(max(cs, key=lambda s: s.end or s.start))
+        return path
+
+    def to_waterfall(self) -> dict:
+        root_start = self.root.start
+        return {
+            "trace_id": f"{self.trace_id:032x}",
+            "name": self.root.name,
+            "start": self.start_unix_ns / 1e9,
+            "duration_ms": self.duration_ns / 1e6,
+            "critical_path": [f"{s.span_id:016x}" for s in self.critical_path()],
+            "spans": [
+                {
+                    "span_id": f"{s.span_id:016x}",
+                    "parent_id": f"{s.parent_id:016x}" if s.parent_id is not None else None,
+                    "name": s.name,
+                    "kind": s.kind,
+                    "offset_ms": (s.start - root_start) / 1e6,
+                    "duration_ms": ((s.end - s.start) / 1e6) if s.end is not None else None,
+                    "attributes": s.attributes,
+                    "error": s.error,
+                }
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+    def to_otlp_spans(self) -> list[dict]:
+        trace_id = f"{self.trace_id:032x}"
+        return [
+            {
+                "traceId": trace_id,
+                "spanId": f"{s.span_id:016x}",
+                **({"parentSpanId": f"{s.parent_id:016x}"} if s.parent_id is not None else {}),
+                "name": s.name,
+                "kind": _OTLP_SPAN_KINDS[s.kind],
+                "startTimeUnixNano": str(self._unix_ns(s.start)),
+                "endTimeUnixNano": str(self._unix_ns(s.end if s.end is not None else s.start)),
+                "attributes": [_otlp_attribute(k, v) for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 0},
+            }
+            for s in self.spans
+        ]
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        v: dict = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}  # 64-bit ints are encoded as strings in OTLP/JSON
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+# The trace being recorded in the current context (if any), and the span which new spans should be children of.
+_current: ContextVar[tuple[Trace, Span] | None] = ContextVar("bento_service_registry_trace", default=None)
+
+
+@contextmanager
+def span(name: str, kind: SpanKind = "internal", **attributes: Any) -> Iterator[Span | None]:
+    """
+    Records a child span of the current span, if a trace is being recorded in the current context. Otherwise, this does
+    nothing (and yields None), so it is cheap to use on code paths which may or may not be traced.
+    Contexts are copied into tasks when they're created (e.g., by asyncio.gather), so spans started in concurrent tasks
+    end up as siblings under whichever span was current when the tasks were created.
+    """
+
+    if (current := _current.get()) is None:
+        yield None
+        return
+
+    tr, parent = current
+    s = Span(name, parent.span_id, kind, attributes)
+    tr.spans.append(s)
+    token = _current.set((tr, s))
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.finish()
+        _current.reset(token)
+
+
+def mark_error(error: str):
+    """
+    Marks the current span (if a trace is being recorded) as having failed, for errors which are handled rather than
+    raised.
+    """
+    if (current := _current.get()) is not None:
+        current[1].error = error
+
+
+class Tracer:
+    """
+    Records traces into a bounded, in-memory ring buffer. Only traces which contacted at least one upstream service are
+    kept, so that requests served entirely from cache don't push out the ones which are useful for finding slow
+    upstream requests.
+    """
+
+    def __init__(self, max_traces: int):
+        self._traces: deque[Trace] = deque(maxlen=max_traces)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._traces.maxlen)
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Span | None]:
+        """
+        Starts recording a new trace in the current context, with a root span which lasts for the duration of the
+        context manager. If a trace is already being recorded, this instead records a child span of the current span.
+        """
+
+        if not self.enabled:
+            yield None
+            return
+
+        if _current.get() is not None:
+            with span(name, **attributes) as s:
+                yield s
+            return
+
+        tr = Trace(name, attributes)
+        token = _current.set((tr, tr.root))
+        try:
+            yield tr.root
+        except BaseException as e:
+            tr.root.error = type(e).__name__
+            raise
+        finally:
+            tr.root.finish()
+            _current.reset(token)
+            if tr.has_upstream_requests:
+                self._traces.append(tr)
+
+    def recent(self, limit: int | None = None, min_duration_ms: float = 0) -> list[Trace]:
+        """
+        Gets recorded traces, most recent first.
+        """
+        min_duration_ns = min_duration_ms * 1e6
+        res = [tr for tr in reversed(self._traces) if tr.duration_ns >= min_duration_ns]
+        return res[:limit] if limit is not None else res
+
+    def clear(self):
+        self._traces.clear()
+
+
+def traces_to_otlp(traces: list[Trace]) -> dict:
+    """
+    Exports traces in the OpenTelemetry protocol (OTLP) JSON encoding, e.g., for loading into tools which accept OTLP.
+    """
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", BENTO_SERVICE_KIND)]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __package__},
+                        "spans": [s for tr in traces for s in tr.to_otlp_spans()],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+@cache
+def get_tracer(config: ConfigDependency) -> Tracer:
+    """
+    Gets a *singleton* instance of Tracer.
+    """
+    return Tracer(config.trace_buffer_size)
+
+
+TracerDependency = Annotated[Tracer, Depends(get_tracer)]
+
+
+# aiohttp request tracing hooks ----------------------------------------------------------------------------------------
+#  These record spans for each upstream HTTP request (up to the response headers being received), with child spans for
+#  waiting on a connection from the pool, DNS resolution, and connecting.
+
+
+async def _on_request_start(_session, ctx: SimpleNamespace, params: aiohttp.TraceRequestStartParams):
+    if (current := _current.get()) is None:
+        return
+    tr, parent = current
+    s = Span("http request", parent.span_id, "client", {"http.method": params.method, "http.url": str(params.url)})
+    tr.spans.append(s)
+    ctx.request_span = s
+
+
+async def _on_request_end(_session, ctx: SimpleNamespace, params: aiohttp.TraceRequestEndParams):
+    if (s := getattr(ctx, "request_span", None)) is not None:
+        s.attributes["http.status_code"] = params.response.status
+        s.finish()
+
+
+async def _on_request_exception(_session, ctx: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams):
+    if (s := getattr(ctx, "request_span", None)) is not None:
+        s.error = type(params.exception).__name__
+        s.finish()
+
+
+def _sub_span_hooks(name: str, attr: str):
+    # aiohttp calls hooks in the context of the task making the request, but we can't keep a span "current" across
+    # hooks; instead, sub-spans are parented to the request span held in the per-request trace context.
+
+    async def _start(_session, ctx: SimpleNamespace, _params):
+        if (current := _current.get()) is None or (request_span := getattr(ctx, "request_span", None)) is None:
+            return
+        s = Span(name, request_span.span_id, "internal", {})
+        current[0].spans.append(s)
+        setattr(ctx, attr, s)
+
+    async def _end(_session, ctx: SimpleNamespace, _params):
+        if (s := getattr(ctx, attr, None)) is not None:
+            s.finish()
+
+    return _start, _end
+
+
+def _build_trace_config() -> aiohttp.TraceConfig:
+    tc = aiohttp.TraceConfig()
+    tc.on_request_start.append(_on_request_start)
+    tc.on_request_end.append(_on_request_end)
+    tc.on_request_exception.append(_on_request_exception)
+
+    for signal_start, signal_end, name, attr in (
+        (tc.on_connection_queued_start, tc.on_connection_queued_end, "connection queued", "queued_span"),
+        (tc.on_dns_resolvehost_start, tc.on_dns_resolvehost_end, "dns", "dns_span"),
+        (tc.on_connection_create_start, tc.on_connection_create_end, "connect", "connect_span"),
+    ):
+        start_hook, end_hook = _sub_span_hooks(name, attr)
+        signal_start.append(start_hook)
+        signal_end.append(end_hook)
+
+    return tc
+
+
+def trace_configs(config: Config) -> list[aiohttp.TraceConfig]:
+    """
+    aiohttp trace configs to pass to a new client session, so that its requests get recorded into traces.
+    """
+    return [_build_trace_config()] if config.trace_buffer_size else []
+
+
+def build_tracing_middleware(tracer: Tracer) -> Callable[[Request, Callable[[Request], Awaitable[Response]]], Any]:
+    async def _tracing_middleware(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        with tracer.trace(f"{request.method} {request.url.path}") as root:
+            response = await call_next(request)
+            if root is not None:
+                root.attributes["http.status_code"] = response.status_code
+            return response
+
+    return _tracing_middleware
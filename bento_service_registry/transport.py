@@ -0,0 +1,101 @@
+import asyncio
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+import aiohttp
+
+from .bento_services_json import BentoServicesByKind
+from .config import Config
+from .tracing import trace_configs
+from .types import BentoService
+from .utils import right_slash_normalize_url
+
+__all__ = [
+    "UpstreamTarget",
+    "bento_service_for",
+    "bento_services_by_url",
+    "get_upstream_target",
+    "close_unix_socket_sessions",
+]
+
+
+# Base URL used for requests over a Unix socket when no internal URL is specified; the host is not used for routing.
+UNIX_SOCKET_DEFAULT_BASE_URL = "http://localhost/"
+
+# Sessions for contacting services over Unix sockets are long-lived (unlike the per-request TCP session), since there's
+# no proxy in between to worry about and connections are cheap to keep around; one session per socket + event loop.
+_unix_socket_sessions: dict[tuple[str, asyncio.AbstractEventLoop], aiohttp.ClientSession] = {}
+
+
+class UpstreamTarget(NamedTuple):
+    """
+    How to contact a service from the registry: the session to make requests with, and the (right-slash-normalized)
+    base URL to make requests to. This may differ from the public URL of the service, which is what gets reported.
+    """
+
+    session: aiohttp.ClientSession
+    base_url: str
+    # identifies the upstream service for concurrency limiting. Services routed through the gateway all share one host,
+    # so the base URL (host + path prefix) or Unix socket path is used rather than just the host.
+    upstream_key: str
+
+    def url(self, path: str) -> str:
+        return urljoin(self.base_url, path)
+
+
+def bento_service_for(bento_services_by_kind: BentoServicesByKind, service: dict) -> BentoService | None:
+    """
+    Finds the bento_services.json entry for a service, given its service info.
+    """
+    return bento_services_by_kind.get(service.get("bento", {}).get("serviceKind", ""))
+
+
+def bento_services_by_url(bento_services_by_kind: BentoServicesByKind) -> dict[str, BentoService]:
+    """
+    Indexes bento_services.json entries by their (right-slash-normalized) public URL.
+    """
+    return {right_slash_normalize_url(bs["url"]): bs for bs in bento_services_by_kind.values() if "url" in bs}
+
+
+def _get_unix_socket_session(config: Config, path: str) -> aiohttp.ClientSession:
+    key = (path, asyncio.get_running_loop())
+    if (session := _unix_socket_sessions.get(key)) is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.UnixConnector(path=path),
+            timeout=aiohttp.ClientTimeout(total=config.contact_timeout),
+            trace_configs=trace_configs(config),
+        )
+        _unix_socket_sessions[key] = session
+    return session
+
+
+def get_upstream_target(
+    config: Config,
+    http_session: aiohttp.ClientSession,
+    service_url: str,
+    bento_service: BentoService | None,
+) -> UpstreamTarget:
+    """
+    Gets the session + base URL to use for contacting a service. If the service's bento_services.json entry specifies a
+    Unix socket or an internal URL, these are used (bypassing the gateway); otherwise, the public service URL is used.
+    """
+
+    if bento_service is not None:
+        if unix_socket := bento_service.get("unix_socket"):
+            return UpstreamTarget(
+                _get_unix_socket_session(config, unix_socket),
+                right_slash_normalize_url(bento_service.get("internal_url", UNIX_SOCKET_DEFAULT_BASE_URL)),
+                f"unix:{unix_socket}",
+            )
+        if internal_url := bento_service.get("internal_url"):
+            internal_url_norm = right_slash_normalize_url(internal_url)
+            return UpstreamTarget(http_session, internal_url_norm, internal_url_norm)
+
+    service_url_norm = right_slash_normalize_url(service_url)
+    return UpstreamTarget(http_session, service_url_norm, service_url_norm)
+
+
+async def close_unix_socket_sessions():
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _unix_socket_sessions if k[1] is loop]:
+        await _unix_socket_sessions.pop(key).close()
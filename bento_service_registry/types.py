@@ -9,6 +9,17 @@ class BentoService(TypedDict):
     service_kind: NotRequired[str]
     url: NotRequired[str]
     disabled: NotRequired[bool]
+    # optional internal transport settings, for co-located services which can be contacted without going through the
+    # gateway - the public url is still what gets reported:
+    #  - internal_url_template is formatted in the same way as url_template to produce internal_url
+    internal_url_template: NotRequired[str]
+    internal_url: NotRequired[str]
+    #  - if unix_socket is set, requests are made over the socket (to internal_url, if set)
+    unix_socket: NotRequired[str]
+
+
+# keys of bento_services.json entries which describe internal networking, and shouldn't be served publicly
+BENTO_SERVICE_INTERNAL_KEYS = frozenset({"internal_url_template", "internal_url", "unix_socket"})
 
 
 BentoServices = dict[str, BentoService]
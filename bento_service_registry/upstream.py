@@ -0,0 +1,285 @@
+import asyncio
+import random
+import time
+from collections import deque
+from collections.abc import Hashable
+from functools import cache
+from typing import Any, NamedTuple
+
+import aiohttp
+import orjson
+from fastapi import status
+
+from .authz_header import OptionalHeaders
+from .config import Config
+from .inflight import mark_upstream_started
+from .negative_cache import NegativeCache, UpstreamErrorClass
+from .scheduler import Priority, UpstreamScheduler, get_upstream_scheduler
+from .tracing import span
+from .transport import UpstreamTarget
+from .utils import authz_header_digest, nearest_rank
+
+__all__ = [
+    "UpstreamContentTypeError",
+    "UpstreamResponse",
+    "classify_failure",
+    "LatencyTracker",
+    "UpstreamFetcher",
+    "get_upstream_fetcher",
+]
+
+
+# Responses with these statuses are usually transient (e.g., the gateway couldn't reach a restarting service) and are
+# retried; requests which end in a connection error or timeout are also retried.
+RETRYABLE_STATUSES = frozenset(
+    {status.HTTP_502_BAD_GATEWAY, status.HTTP_503_SERVICE_UNAVAILABLE, status.HTTP_504_GATEWAY_TIMEOUT}
+)
+
+
+class UpstreamContentTypeError(ValueError):
+    pass
+
+
+class UpstreamResponse(NamedTuple):
+    """
+    A response from an upstream service, read in full (so that the connection could be released right away.)
+    """
+
+    status: int
+    content_type: str
+    body: bytes
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        # Like aiohttp's ClientResponse.json(), only accept JSON content types
+        if self.content_type != "application/json":
+            raise UpstreamContentTypeError(f"unexpected content type: {self.content_type}")
+        return orjson.loads(self.body)
+
+
+def classify_failure(res: UpstreamResponse) -> UpstreamErrorClass | None:
+    """
+    Which class of failure (if any) a final upstream response represents, for negative caching.
+    """
+    if res.status in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN) or (
+        # the gateway's JWT validation error (see ServiceManager)
+        400 <= res.status < 500 and b"invalid jwt" in res.body
+    ):
+        return UpstreamErrorClass.AUTH
+    if res.status >= 500:
+        return UpstreamErrorClass.SERVER
+    return None
+
+
+class LatencyTracker:
+    """
+    Keeps a window of recent response times for each upstream service, for estimating when a request is running slower
+    than usual.
+    """
+
+    def __init__(self, window: int = 100, min_samples: int = 20):
+        self._window: int = window
+        self._min_samples: int = min_samples
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, upstream: str, seconds: float):
+        if (samples := self._samples.get(upstream)) is None:
+            samples = self._samples[upstream] = deque(maxlen=self._window)
+        samples.append(seconds)
+
+    def p95(self, upstream: str) -> float | None:
+        """
+        95th percentile (nearest-rank) response time for an upstream service, or None if there isn't enough data yet.
+        """
+        if (samples := self._samples.get(upstream)) is None or len(samples) < self._min_samples:
+            return None
+        return nearest_rank(sorted(samples), 0.95)
+
+
+class UpstreamFetcher:
+    """
+    Makes GET requests to upstream services, each holding a slot from the upstream scheduler, with:
+     - retries (with jittered exponential backoff) for connection errors, timeouts, and gateway errors, as long as
+       there's enough time left before the request's deadline (the contact timeout) for a retry to plausibly succeed;
+     - optionally, hedging: if a request runs longer than the service's recent p95 response time, a second request is
+       made, and whichever successful response arrives first is used;
+     - negative caching: the outcome of a failed request (auth error, 5xx response, connection error, or timeout) is
+       remembered for a few seconds per URL and authorization header, and repeats of the request are answered with it
+       locally rather than contacting the service again. A different (e.g., refreshed) token isn't affected.
+    """
+
+    def __init__(self, config: Config, scheduler: UpstreamScheduler):
+        self._config: Config = config
+        self._scheduler: UpstreamScheduler = scheduler
+        self._latencies = LatencyTracker()
+        #  - cached failed responses, or None for timeouts/connection errors
+        self._negative_cache: NegativeCache[UpstreamResponse | None] = NegativeCache(config)
+
+    @property
+    def latencies(self) -> LatencyTracker:
+        return self._latencies
+
+    async def _attempt(
+        self,
+        target: UpstreamTarget,
+        url: str,
+        headers: OptionalHeaders,
+        flow: Hashable,
+        priority: Priority,
+        deadline: float,
+        hedge: bool = False,
+    ) -> UpstreamResponse:
+        loop = asyncio.get_running_loop()
+
+        async with self._scheduler.slot(target.upstream_key, flow, priority):
+            # time spent waiting for a slot counts against the deadline
+            if (remaining := deadline - loop.time()) <= 0:
+                raise TimeoutError()
+
+            # from here on, the request is worth finishing even if nobody is waiting for it anymore (see inflight.py)
+            mark_upstream_started()
+
+            with span("attempt", hedge=hedge):
+                start = time.perf_counter()
+                async with target.session.get(
+                    url, headers=headers, timeout=aiohttp.ClientTimeout(total=remaining)
+                ) as res:
+                    with span("read body"):
+                        body = await res.read()
+
+        if res.status not in RETRYABLE_STATUSES:
+            self._latencies.record(target.upstream_key, time.perf_counter() - start)
+
+        return UpstreamResponse(res.status, res.content_type, body)
+
+    async def _hedged_attempt(
+        self,
+        target: UpstreamTarget,
+        url: str,
+        headers: OptionalHeaders,
+        flow: Hashable,
+        priority: Priority,
+        deadline: float,
+    ) -> UpstreamResponse:
+        p95 = self._latencies.p95(target.upstream_key) if self._config.upstream_hedging else None
+
+        if p95 is None:
+            return await self._attempt(target, url, headers, flow, priority, deadline)
+
+        first = asyncio.ensure_future(self._attempt(target, url, headers, flow, priority, deadline))
+        tasks = [first]
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=p95)
+            if not done:
+                # slower than usual - race a second request against the first.
+                tasks.append(asyncio.ensure_future(self._attempt(target, url, headers, flow, priority, deadline, True)))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None and t.result().status not in RETRYABLE_STATUSES:
+                        return t.result()
+
+            # neither request succeeded; go with the outcome of the first one
+            return first.result()
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def _get_with_retries(
+        self,
+        target: UpstreamTarget,
+        url: str,
+        headers: OptionalHeaders,
+        flow: Hashable,
+        priority: Priority,
+    ) -> UpstreamResponse:
+        config = self._config
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.contact_timeout
+
+        n_retries = 0
+
+        while True:
+            error: TimeoutError | aiohttp.ClientConnectionError | None = None
+            try:
+                res = await self._hedged_attempt(target, url, headers, flow, priority, deadline)
+                if res.status not in RETRYABLE_STATUSES:
+                    return res
+            except (TimeoutError, aiohttp.ClientConnectionError) as e:
+                error = e
+
+            # Full jitter: a random delay of up to base * 2^n, so that retries from many concurrent requests to a
+            # service which just dropped connections don't arrive all at once.
+            delay = random.uniform(0, config.upstream_retry_backoff * 2**n_retries)
+            # Only retry if, after backing off, a typical response from the service could still arrive before the
+            # deadline; otherwise, give up now rather than holding up the whole request.
+            time_needed = delay + (self._latencies.p95(target.upstream_key) or 0)
+
+            if n_retries >= config.upstream_retries or loop.time() + time_needed >= deadline:
+                if error is not None:
+                    raise error
+                return res
+
+            n_retries += 1
+            with span("retry backoff", retry=n_retries, delay=delay):
+                await asyncio.sleep(delay)
+
+    async def get(
+        self,
+        target: UpstreamTarget,
+        url: str,
+        headers: OptionalHeaders,
+        flow: Hashable = None,
+        priority: Priority = Priority.INTERACTIVE,
+        negative_cache: bool = True,
+    ) -> UpstreamResponse:
+        """
+        Makes a GET request to an upstream service, with retries and (if enabled) hedging. Returns the final response,
+        which may have a non-200 status; raises TimeoutError or aiohttp.ClientConnectionError if the final
+        attempt failed with one. If negative_cache is True, a recent failure of the same request (with the same
+        authorization header) is returned/raised again without contacting the service; the outcome of the request is
+        recorded either way.
+        """
+
+        authz_digest = authz_header_digest(headers)
+
+        if negative_cache and (cached := self._negative_cache.get(url, authz_digest)) is not None:
+            error_class, cached_res = cached
+            with span("negative cache hit", error_class=error_class):
+                if cached_res is not None:
+                    return cached_res
+                if error_class == UpstreamErrorClass.TIMEOUT:
+                    raise TimeoutError()
+                raise aiohttp.ClientConnectionError(f"recent connection error for {url} (negatively cached)")
+
+        try:
+            res = await self._get_with_retries(target, url, headers, flow, priority)
+        except TimeoutError:
+            self._negative_cache.put(url, authz_digest, UpstreamErrorClass.TIMEOUT, None)
+            raise
+        except aiohttp.ClientConnectionError:
+            self._negative_cache.put(url, authz_digest, UpstreamErrorClass.SERVER, None)
+            raise
+
+        if (failure := classify_failure(res)) is not None:
+            self._negative_cache.put(url, authz_digest, failure, res)
+        else:
+            # e.g., a health probe got through to a service which was failing
+            self._negative_cache.clear(url, authz_digest)
+
+        return res
+
+
+@cache
+def get_upstream_fetcher(config: Config) -> UpstreamFetcher:
+    """
+    Gets a *singleton* instance of UpstreamFetcher, shared by everything which contacts upstream services (so that
+    response time statistics are shared too.)
+    """
+    return UpstreamFetcher(config, get_upstream_scheduler(config))
@@ -1,9 +1,17 @@
 from bento_service_registry.authz_header import HEADER_AUTHORIZATION, OptionalHeaders  # noqa: I001
+import math
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Sequence
 from hashlib import sha256
+from typing import Any, Generic, TypeVar
 
 __all__ = [
     "right_slash_normalize_url",
     "authz_header_digest",
+    "ANONYMOUS_AUTHZ_DIGEST",
+    "same_objects",
+    "nearest_rank",
+    "IdentityCache",
 ]
 
 
@@ -13,3 +21,50 @@ def right_slash_normalize_url(url: str) -> str:
 
 def authz_header_digest(headers: OptionalHeaders) -> str:
     return sha256((headers or {}).get(HEADER_AUTHORIZATION, "").encode("ascii"), usedforsecurity=True).hexdigest()
+
+
+# Digest of a missing authorization header; cache entries under this key contain only publicly-accessible information.
+ANONYMOUS_AUTHZ_DIGEST = authz_header_digest(None)
+
+
+def same_objects(a: tuple, b: tuple) -> bool:
+    """
+    Whether two tuples contain the exact same objects (by identity), in the same order.
+    """
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+
+def nearest_rank(sorted_values: Sequence[float], q: float) -> float:
+    """
+    The q-th quantile (0 < q <= 1) of some (non-empty, sorted) values, by the nearest-rank method.
+    """
+    return sorted_values[max(math.ceil(q * len(sorted_values)), 1) - 1]
+
+
+V = TypeVar("V")
+
+
+class IdentityCache(Generic[V]):
+    """
+    Bounded LRU cache of values derived from an object, keyed by the *identity* of the object (plus an optional variant
+    key, for values which also depend on something else, e.g., query parameters.) Managers return the same object for as
+    long as the underlying cache entries don't change, so values derived from it only need to be built once per change.
+    A reference to the object is kept alongside each value, so that its id() can't be re-used by another object while in
+    the cache.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self._max_entries: int = max_entries
+        self._values: OrderedDict[tuple[int, Hashable], tuple[Any, V]] = OrderedDict()
+
+    def get(self, obj: Any, build: Callable[[], V], variant: Hashable = None) -> V:
+        key = (id(obj), variant)
+        if (entry := self._values.get(key)) is not None and entry[0] is obj:
+            self._values.move_to_end(key)
+            return entry[1]
+
+        value = build()
+        self._values[key] = (obj, value)
+        if len(self._values) > self._max_entries:
+            self._values.popitem(last=False)
+        return value
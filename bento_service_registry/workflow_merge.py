@@ -0,0 +1,83 @@
+from typing import NamedTuple
+
+from .models import WorkflowWithServiceURL
+
+__all__ = [
+    "WorkflowsByPurpose",
+    "NO_WORKFLOWS",
+    "WorkflowConflict",
+    "MergedWorkflows",
+    "merge_workflows",
+]
+
+
+WorkflowsByPurpose = dict[str, dict[str, WorkflowWithServiceURL]]
+
+# Stand-in for a provider's workflows when there are none (e.g., because fetching them failed); always the same object,
+# so that a provider which keeps failing doesn't count as having changed.
+NO_WORKFLOWS: WorkflowsByPurpose = {}
+
+
+class WorkflowConflict(NamedTuple):
+    purpose: str
+    workflow_id: str
+    # base URLs of the services which provide a workflow with this purpose + ID, in service order; the last one's is used
+    service_base_urls: tuple[str, ...]
+
+
+class MergedWorkflows(NamedTuple):
+    # (base URL of each workflow-providing service, its workflows), which the merged view was built from
+    providers: tuple[str | None, ...]
+    parts: tuple[WorkflowsByPurpose, ...]
+    # the merged purpose -> ID -> workflow view, and workflow IDs provided by more than one service
+    by_purpose: WorkflowsByPurpose
+    conflicts: tuple[WorkflowConflict, ...]
+
+
+def _merge_purpose(
+    purpose: str, providers: tuple[str | None, ...], parts: tuple[WorkflowsByPurpose, ...]
+) -> tuple[dict[str, WorkflowWithServiceURL], list[WorkflowConflict]]:
+    merged: dict[str, WorkflowWithServiceURL] = {}
+    sources: dict[str, list[str]] = {}
+
+    for provider, part in zip(providers, parts):
+        for wf_id, wf in part.get(purpose, {}).items():
+            merged[wf_id] = wf  # like dict.update(...): later services' workflows take precedence
+            sources.setdefault(wf_id, []).append(provider or "")
+
+    conflicts = [WorkflowConflict(purpose, wf_id, tuple(s)) for wf_id, s in sources.items() if len(s) > 1]
+    return merged, conflicts
+
+
+def merge_workflows(
+    providers: tuple[str | None, ...],
+    parts: tuple[WorkflowsByPurpose, ...],
+    base: MergedWorkflows | None = None,
+) -> MergedWorkflows:
+    """
+    Merges workflows from several providers into one purpose -> ID -> workflow view. If a previous merge (base) of the
+    same providers is given, only purposes which the changed providers (i.e., those whose workflows aren't the same
+    object as in base) contribute to, before or after the change, are re-merged; the per-purpose dictionaries of other
+    purposes are shared with base rather than copied.
+    """
+
+    affected: set[str] = set()
+    if base is not None and base.providers == providers:
+        for old, new in zip(base.parts, parts):
+            if old is not new:
+                affected.update(old, new)
+    else:
+        base = None
+
+    by_purpose: WorkflowsByPurpose = {}
+    conflicts: list[WorkflowConflict] = []
+
+    for purpose in dict.fromkeys(p for part in parts for p in part):
+        if base is not None and purpose not in affected:
+            by_purpose[purpose] = base.by_purpose[purpose]
+            conflicts.extend(c for c in base.conflicts if c.purpose == purpose)
+        else:
+            by_purpose[purpose], purpose_conflicts = _merge_purpose(purpose, providers, parts)
+            conflicts.extend(purpose_conflicts)
+
+    return MergedWorkflows(providers, parts, by_purpose, tuple(conflicts))
@@ -1,105 +1,307 @@
 import asyncio
-from datetime import UTC, datetime
+import time
 from functools import cache
 from typing import Annotated
-from urllib.parse import urljoin
 
 import structlog.stdlib
 from aiohttp import ClientConnectionError, ClientSession
 from fastapi import Depends, status
+from pydantic import ValidationError
 
 from .authz_header import OptionalAuthzHeaderDependency, OptionalHeaders
+from .bento_services_json import BentoServicesByKind, BentoServicesByKindDependency
+from .cache_entry import CacheEntry
 from .config import Config, ConfigDependency
-from .http_session import HTTPSessionDependency
-from .logger import LoggerDependency
+from .http_session import HTTPSessionDependency, http_session_lease
+from .inflight import InFlight, until_disconnected
+from .logger import LoggerDependency, sample_upstream_success
+from .loop_lag import get_loop_lag_monitor
+from .models import SkippedItems, workflows_by_purpose_adapter
+from .scheduler import Priority
+from .service_versions import ServiceVersionTracker
 from .services import ServicesDependency
-from .utils import authz_header_digest, right_slash_normalize_url
+from .tracing import mark_error, span
+from .transport import bento_service_for, bento_services_by_url, get_upstream_target
+from .types import BentoService
+from .upstream import get_upstream_fetcher
+from .utils import ANONYMOUS_AUTHZ_DIGEST, authz_header_digest, right_slash_normalize_url, same_objects
+from .workflow_merge import NO_WORKFLOWS, MergedWorkflows, WorkflowConflict, WorkflowsByPurpose, merge_workflows
 
 __all__ = [
     "WorkflowsByPurpose",
+    "get_workflow_manager",
+    "WorkflowManagerDependency",
     "get_workflows",
     "WorkflowsDependency",
 ]
 
 
-WorkflowsByPurpose = dict[str, dict[str, dict]]
+WorkflowsCacheKey = tuple[str, str]
 
 
 class WorkflowManager:
     def __init__(self, config: Config, logger: structlog.stdlib.BoundLogger):
         self._config: Config = config
         self._logger = logger
+        self._fetcher = get_upstream_fetcher(config)
+        self._loop_lag = get_loop_lag_monitor(config)
 
         # cache
-        self._n_workflow_providers: int | None = None
-        self._workflows_by_purpose: dict[str, tuple[datetime, WorkflowsByPurpose]] = {}
+        #  - per-service versions; when a service's version changes, its cached workflows are thrown out.
+        self._service_versions = ServiceVersionTracker()
+        #  - dict of (service URL, hash of auth header): workflows from service (+ fetch time)
+        self._workflows_by_purpose: dict[WorkflowsCacheKey, CacheEntry[WorkflowsByPurpose]] = {}
+        #  - entries restored from a snapshot, which are served regardless of age until they have been revalidated
+        self._stale: set[WorkflowsCacheKey] = set()
+        #  - dict of hash of auth header: merged workflows (+ the per-service workflows they were merged from.) The merged
+        #    dictionary is re-used as long as it would be built from the same per-service dictionaries, so that it keeps
+        #    the same identity (and things like pre-compressed response bodies keyed on it stay valid.) When some
+        #    services' workflows change, only the purposes they provide are re-merged (see merge_workflows.)
+        self._merged: dict[str, MergedWorkflows] = {}
+        #  - merged workflows by the identities of the per-service workflows they were merged from, so that auth headers
+        #    which get the same workflows from every service (the usual case, see _dedupe) share one merged view.
+        self._merged_by_parts: dict[tuple[int, ...], MergedWorkflows] = {}
+        #  - the most recently fetched workflows for each service URL. Workflows usually don't depend on the
+        #    authorization header, so if the workflows fetched with a different header are equal, this is re-used
+        #    rather than keeping a copy per header.
+        self._latest: dict[str, WorkflowsByPurpose] = {}
+
+        # in-progress fetches by cache key, shared by concurrent requests for the same workflows
+        self._in_flight: InFlight[WorkflowsByPurpose | None] = InFlight()
+
+    def _entry_valid(self, now: float, key: WorkflowsCacheKey, entry: CacheEntry[WorkflowsByPurpose]) -> bool:
+        # in degraded mode, entries are served regardless of age (see LoopLagMonitor)
+        return entry.age(now) < self._config.workflow_cache_ttl or key in self._stale or self._loop_lag.degraded
 
     def _clean_cache(self):
-        now = datetime.now(UTC)
-        for k, v in self._workflows_by_purpose.items():
-            if (now - v[0]).total_seconds() >= self._config.workflow_cache_ttl:
-                del self._workflows_by_purpose[k]
+        now = time.monotonic()
+        self._workflows_by_purpose = {
+            k: v for k, v in self._workflows_by_purpose.items() if self._entry_valid(now, k, v)
+        }
+        live_digests = {k[1] for k in self._workflows_by_purpose}
+        self._merged = {k: v for k, v in self._merged.items() if k in live_digests}
+        live_views = {id(m) for m in self._merged.values()}
+        self._merged_by_parts = {k: v for k, v in self._merged_by_parts.items() if id(v) in live_views}
+        live_services = {k[0] for k in self._workflows_by_purpose}
+        self._latest = {k: v for k, v in self._latest.items() if k in live_services}
+
+    def _invalidate_service(self, service_url: str):
+        self._workflows_by_purpose = {k: v for k, v in self._workflows_by_purpose.items() if k[0] != service_url}
+        self._latest.pop(service_url, None)
+
+    def _dedupe(self, service_url: str, wfs: WorkflowsByPurpose) -> WorkflowsByPurpose:
+        if (latest := self._latest.get(service_url)) is not None and latest == wfs:
+            return latest
+        self._latest[service_url] = wfs
+        return wfs
+
+    def snapshot(self) -> dict:
+        # Only workflows fetched without an authorization header are included.
+        return {
+            "versions": self._service_versions.snapshot(),
+            "entries": [
+                [k[0], v.fetched_iso(), v.value]
+                for k, v in self._workflows_by_purpose.items()
+                if k[1] == ANONYMOUS_AUTHZ_DIGEST
+            ],
+        }
+
+    def restore(self, snapshot: dict):
+        self._service_versions.restore(snapshot["versions"])
+        for service_url, fetched, wfs in snapshot["entries"]:
+            cache_key = (service_url, ANONYMOUS_AUTHZ_DIGEST)
+            self._workflows_by_purpose[cache_key] = CacheEntry.from_fetched_iso(
+                self._dedupe(
+                    service_url,
+                    {
+                        purpose: {k: wf for k, wf in purpose_wfs.items() if wf is not None}
+                        for purpose, purpose_wfs in workflows_by_purpose_adapter.validate_python(wfs).items()
+                    },
+                ),
+                fetched,
+            )
+            self._stale.add(cache_key)
+
+    def clear_stale(self):
+        # Stop serving entries restored from a snapshot regardless of age, whether or not they were revalidated.
+        self._stale.clear()
+
+    async def revalidate(self, bento_services_by_kind: BentoServicesByKind, http_session: ClientSession):
+        # Stop serving stale entries regardless of age, and re-fetch any which have expired.
+        now = time.monotonic()
+        stale, self._stale = self._stale, set()
+        to_fetch = [
+            k
+            for k in stale
+            if (e := self._workflows_by_purpose.get(k)) is not None and not self._entry_valid(now, k, e)
+        ]
+
+        by_url = bento_services_by_url(bento_services_by_kind)
+        results = await asyncio.gather(
+            *(
+                self.get_workflows_from_service(None, http_session, {"url": k[0]}, by_url.get(k[0]), now)
+                for k in to_fetch
+            )
+        )
+
+        for k, wfs in zip(to_fetch, results):
+            if wfs is not None:
+                self._workflows_by_purpose[k] = CacheEntry(wfs)
 
     async def get_workflows_from_service(
         self,
         authz_header: OptionalHeaders,
         http_session: ClientSession,
         service: dict,
-        start_dt: datetime,
-    ) -> WorkflowsByPurpose:
+        bento_service: BentoService | None,
+        start: float,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> WorkflowsByPurpose | None:
         service_url: str | None = service.get("url")
 
         if service_url is None:
-            await self._logger.aerror("encountered service missing URL", service=service)
-            return {}
+            self._logger.error("encountered service missing URL", service=service)
+            return None
 
         service_url_norm: str = right_slash_normalize_url(service_url)
-        workflows_url: str = urljoin(service_url_norm, "workflows")
 
-        logger = self._logger.bind(workflows_url=workflows_url)
+        # We may contact the service via an internal URL or Unix socket, rather than via its public URL:
+        target = get_upstream_target(self._config, http_session, service_url, bento_service)
+        workflows_url: str = target.url("workflows")
+
+        # Rather than binding a new logger for every service on every fan-out, pass context to the (rarer) log calls.
+        log_ctx: dict = {"workflows_url": workflows_url}
+
+        flow = ("workflows", authz_header_digest(authz_header))
+
+        with span("fetch workflows", service_url=service_url_norm):
+            try:
+                res = await self._fetcher.get(target, workflows_url, authz_header, flow, priority)
+            except asyncio.TimeoutError:
+                self._logger.error("service workflow fetch timeout error", **log_ctx)
+                mark_error("timeout")
+                return None
+            except ClientConnectionError as e:
+                self._logger.exception("service workflow fetch connection error", exc_info=e, **log_ctx)
+                mark_error(type(e).__name__)
+                return None
+
+            log_ctx["time_taken"] = time.monotonic() - start
+
+            if res.status != status.HTTP_200_OK:
+                self._logger.error(
+                    "got non-200 response from workflow-providing service",
+                    status=res.status,
+                    body=res.text(),
+                    **log_ctx,
+                )
+                mark_error(f"status {res.status}")
+                return None
+
+            if sample_upstream_success(self._config):
+                self._logger.debug("fetching service workflows complete", **log_ctx)
+
+            # Validate all workflows in one go, straight from the response bytes. Malformed workflows are collected into
+            # skipped and left out, rather than failing the whole response.
+            skipped: SkippedItems = []
+
+            try:
+                with span("validate workflows", n_bytes=len(res.body)):
+                    data = await self._loop_lag.parse(
+                        len(res.body),
+                        lambda: workflows_by_purpose_adapter.validate_json(
+                            res.body, context={"service_base_url": service_url_norm, "skipped": skipped}
+                        ),
+                    )
+            except ValidationError as err:
+                self._logger.error("received malformatted workflows", exc_info=err, **log_ctx)
+                mark_error("invalid response")
+                return None
 
-        try:
-            async with http_session.get(workflows_url, headers=authz_header) as res:
-                data = await res.json()
-                time_taken = (datetime.now(UTC) - start_dt).total_seconds()
+        for wf, wf_err in skipped:
+            self._logger.error("skipping received malformatted workflow", workflow=wf, exc_info=wf_err, **log_ctx)
 
-                logger = logger.bind(time_taken=time_taken)
+        wfs: WorkflowsByPurpose = {
+            purpose: {k: wf for k, wf in purpose_wfs.items() if wf is not None} for purpose, purpose_wfs in data.items()
+        }
 
-                if res.status != status.HTTP_200_OK:
-                    await logger.aerror(
-                        "got non-200 response from workflow-providing service",
-                        status=res.status,
-                        body=data,
-                    )
-                    return {}
-        except asyncio.TimeoutError:
-            await logger.aerror("service workflow fetch timeout error")
-            return {}
-        except ClientConnectionError as e:
-            await logger.aexception("service workflow fetch connection error", exc_info=e)
-            return {}
+        return self._dedupe(service_url_norm, wfs)
+
+    async def _fetch_and_cache(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: ClientSession,
+        service: dict,
+        bento_service: BentoService | None,
+        start: float,
+        cache_key: WorkflowsCacheKey,
+    ) -> WorkflowsByPurpose | None:
+        # The fetch is shared (see InFlight), and may finish after the request which started it is gone, so it caches
+        # its own result (and holds on to the HTTP session) rather than leaving that to its caller.
+        async with http_session_lease(http_session):
+            wfs = await self.get_workflows_from_service(authz_header, http_session, service, bento_service, start)
+        if wfs is not None:  # error fetching workflows from service; don't cache
+            self._workflows_by_purpose[cache_key] = CacheEntry(wfs)
+        return wfs
 
-        await logger.adebug("fetching service workflows complete")
+    async def _get_uncached(
+        self,
+        authz_header: OptionalHeaders,
+        http_session: ClientSession,
+        service: dict,
+        bento_service: BentoService | None,
+        start: float,
+        cache_key: WorkflowsCacheKey | None,
+    ) -> WorkflowsByPurpose | None:
+        if cache_key is None:
+            return await self.get_workflows_from_service(authz_header, http_session, service, bento_service, start)
+        return await self._in_flight.run(
+            cache_key,
+            lambda: self._fetch_and_cache(authz_header, http_session, service, bento_service, start, cache_key),
+        )
 
-        wfs: dict[str, dict[str, dict]] = {}
+    def _merge(
+        self, authz_digest: str, providers: tuple[str | None, ...], parts: tuple[WorkflowsByPurpose, ...]
+    ) -> MergedWorkflows:
+        prev = self._merged.get(authz_digest)
+        if prev is not None and same_objects(prev.parts, parts):
+            return prev
+
+        parts_key = tuple(map(id, parts))
+        if (merged := self._merged_by_parts.get(parts_key)) is None or not same_objects(merged.parts, parts):
+            merged = self._merged_by_parts[parts_key] = merge_workflows(providers, parts, prev)
+
+            known_conflicts = set(prev.conflicts) if prev is not None else set()
+            for c in merged.conflicts:
+                if c not in known_conflicts:
+                    self._logger.warning(
+                        "workflow ID provided by more than one service; using the last one's",
+                        purpose=c.purpose,
+                        workflow_id=c.workflow_id,
+                        service_base_urls=c.service_base_urls,
+                    )
 
-        for purpose, purpose_wfs in data.items():
-            if purpose not in wfs:
-                wfs[purpose] = {}
-            # TODO: pydantic model + validation
-            wfs[purpose].update({k: {**wf, "service_base_url": service_url_norm} for k, wf in purpose_wfs.items()})
+        self._merged[authz_digest] = merged
+        return merged
 
-        return wfs
+    def get_conflicts(self, authz_header: OptionalHeaders) -> tuple[WorkflowConflict, ...]:
+        """
+        Workflow IDs (within a purpose) provided by more than one service, as of the last time workflows were collected
+        for an auth header.
+        """
+        merged = self._merged.get(authz_header_digest(authz_header))
+        return merged.conflicts if merged is not None else ()
 
     async def get_workflows(
         self,
         authz_header: OptionalHeaders,
         http_session: ClientSession,
         services_tuple: tuple[dict, ...],
-    ):
-        now = datetime.now(UTC)
+        bento_services_by_kind: BentoServicesByKind,
+    ) -> WorkflowsByPurpose:
+        now = time.monotonic()
 
-        await self._logger.adebug("collecting workflows from workflow-providing services")
+        self._logger.debug("collecting workflows from workflow-providing services")
 
         workflow_services = [
             s
@@ -107,64 +309,85 @@ class WorkflowManager:
             if (b := s.get("bento", {})).get("dataService", False) or b.get("workflowProvider", False)
         ]
         n_workflow_providers = len(workflow_services)
-        logger = self._logger.bind(n_workflow_providers=n_workflow_providers)
-
-        cache_key = authz_header_digest(authz_header)
-
-        if (
-            n_workflow_providers == self._n_workflow_providers
-            and (wfp := self._workflows_by_purpose.get(cache_key)) is not None
-            and (now - wfp[0]).total_seconds() < self._config.workflow_cache_ttl
-        ):
-            # If:
-            #  - the number of workflow-providing services hasn't changed
-            #  - our cache is populated
-            #  - our cache has not expired
-            # then use it!
-            await logger.adebug(
-                "returning workflows from cache",
-                time_taken=(datetime.now(UTC) - now).total_seconds(),
-                n_workflows_found=len(wfp[1]),
-            )
-            return wfp[1]
-
-        # Otherwise, (re-)populate the cache.
-
-        self._n_workflow_providers = n_workflow_providers
-
-        await logger.adebug("done collecting workflow-providing services")
-
-        if not workflow_services:
-            self._workflows_by_purpose[cache_key] = (now, {})
-            return {}
+        # Rather than binding a new logger on every call, pass context to the (rarer, or debug-level) log calls.
+        log_ctx = {"n_workflow_providers": n_workflow_providers}
+
+        self._logger.debug("done collecting workflow-providing services", **log_ctx)
+
+        authz_digest = authz_header_digest(authz_header)
+
+        # Workflows are cached per (service, auth header). We only re-fetch workflows from a service if:
+        #  - our cache for the service is not populated
+        #  - our cache for the service has expired
+        #  - the version of the service has changed (in which case, the cache for the service is invalidated)
+        cache_keys: list[WorkflowsCacheKey | None] = []
+        service_wfs: dict[int, WorkflowsByPurpose] = {}
+        to_fetch: list[int] = []
+
+        for i, s in enumerate(workflow_services):
+            if (s_url := s.get("url")) is None:
+                # no URL - can't cache; get_workflows_from_service(...) will log an error for us.
+                cache_keys.append(None)
+                to_fetch.append(i)
+                continue
+
+            s_url_norm = right_slash_normalize_url(s_url)
+
+            if self._service_versions.update(s_url_norm, s):
+                self._logger.info(
+                    "workflow provider version changed; invalidating its workflows", service_url=s_url_norm, **log_ctx
+                )
+                self._invalidate_service(s_url_norm)
+
+            cache_key = (s_url_norm, authz_digest)
+            cache_keys.append(cache_key)
+
+            if (wfp := self._workflows_by_purpose.get(cache_key)) is not None and self._entry_valid(
+                now, cache_key, wfp
+            ):
+                service_wfs[i] = wfp.value
+            else:
+                to_fetch.append(i)
+
+        if to_fetch:
+            with span("workflows fan-out", n_workflow_providers_fetched=len(to_fetch)):
+                fetched_wfs = await until_disconnected(
+                    asyncio.gather(
+                        *(
+                            self._get_uncached(
+                                authz_header,
+                                http_session,
+                                workflow_services[i],
+                                bento_service_for(bento_services_by_kind, workflow_services[i]),
+                                now,
+                                cache_keys[i],
+                            )
+                            for i in to_fetch
+                        )
+                    )
+                )
 
-        service_wfs = await asyncio.gather(
-            *(self.get_workflows_from_service(authz_header, http_session, s, now) for s in workflow_services)
-        )
+            for i, s_wfs in zip(to_fetch, fetched_wfs):
+                if s_wfs is not None:
+                    service_wfs[i] = s_wfs
 
-        workflows_from_services: WorkflowsByPurpose = {}
-        n_workflows_found: int = 0
+            # Clean up old cache entries
+            self._clean_cache()
 
-        for s_wfs in service_wfs:
-            for purpose, purpose_wfs in s_wfs.items():
-                if purpose not in workflows_from_services:
-                    workflows_from_services[purpose] = {}
-                workflows_from_services[purpose].update(purpose_wfs)
-                n_workflows_found += len(purpose_wfs)
+        providers = tuple(ck[0] if ck is not None else None for ck in cache_keys)
+        parts = tuple(service_wfs.get(i, NO_WORKFLOWS) for i in range(n_workflow_providers))
+        workflows_from_services = self._merge(authz_digest, providers, parts).by_purpose
 
-        new_now = datetime.now(UTC)
+        n_workflows_found: int = sum(len(purpose_wfs) for purpose_wfs in workflows_from_services.values())
 
-        await logger.adebug(
-            "done collecting workflows",
-            time_taken=(new_now - now).total_seconds(),
+        self._logger.debug(
+            "done collecting workflows" if to_fetch else "returning workflows from cache",
+            time_taken=time.monotonic() - now,
             n_workflows_found=n_workflows_found,
+            n_workflow_providers_fetched=len(to_fetch),
+            **log_ctx,
         )
 
-        self._workflows_by_purpose[cache_key] = (new_now, workflows_from_services)
-
-        # Clean up old cache entries
-        self._clean_cache()
-
         return workflows_from_services
 
 
@@ -181,11 +404,12 @@ WorkflowManagerDependency = Annotated[WorkflowManager, Depends(get_workflow_mana
 
 async def get_workflows(
     authz_header: OptionalAuthzHeaderDependency,
+    bento_services_by_kind: BentoServicesByKindDependency,
     http_session: HTTPSessionDependency,
     services_tuple: ServicesDependency,
     workflow_manager: WorkflowManagerDependency,
 ) -> WorkflowsByPurpose:
-    return await workflow_manager.get_workflows(authz_header, http_session, services_tuple)
+    return await workflow_manager.get_workflows(authz_header, http_session, services_tuple, bento_services_by_kind)
 
 
 WorkflowsDependency = Annotated[WorkflowsByPurpose, Depends(get_workflows)]
@@ -1,12 +1,16 @@
 import logging
 import os
+from collections.abc import AsyncIterator, Awaitable, Callable
 from pathlib import Path
 
 import pytest
 import pytest_asyncio
+from aiohttp import web
 from fastapi.testclient import TestClient
 
+from bento_service_registry.app import create_app
 from bento_service_registry.config import Config
+from bento_service_registry.service_info import get_service_info
 
 test_logger = logging.getLogger(__name__)
 
@@ -30,11 +34,67 @@ def test_get_config(debug_mode: bool):
     return get_config_inner
 
 
+def make_config(debug_mode: bool = False, **overrides) -> Config:
+    # Test configuration, with some values overridden
+    return test_get_config(debug_mode=debug_mode)().model_copy(update=overrides)
+
+
+class FakeUpstream:
+    """
+    A local aiohttp server standing in for an upstream service (or peer registry), listening on a random port on
+    localhost or on a Unix socket.
+    """
+
+    def __init__(self, runner: web.AppRunner, url: str):
+        self._runner: web.AppRunner = runner
+        self.url: str = url  # base URL (without a trailing slash)
+        self._stopped: bool = False
+
+    async def stop(self):
+        if not self._stopped:
+            self._stopped = True
+            await self._runner.cleanup()
+
+
+FakeUpstreamFactory = Callable[..., Awaitable[FakeUpstream]]
+
+
+@pytest_asyncio.fixture()
+async def fake_upstream() -> AsyncIterator[FakeUpstreamFactory]:
+    """
+    Starts fake upstream servers, given a dict of GET route path: handler; they are stopped after the test, if the test
+    hasn't already stopped them (e.g., to make the upstream unavailable.)
+    """
+
+    upstreams: list[FakeUpstream] = []
+
+    async def _start(routes: dict[str, Callable], unix_socket: str | None = None) -> FakeUpstream:
+        app = web.Application()
+        for path, handler in routes.items():
+            app.router.add_get(path, handler)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+
+        if unix_socket is None:
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            upstream = FakeUpstream(runner, f"http://127.0.0.1:{runner.addresses[0][1]}")
+        else:
+            await web.UnixSite(runner, unix_socket).start()
+            upstream = FakeUpstream(runner, "http://localhost")
+
+        upstreams.append(upstream)
+        return upstream
+
+    yield _start
+
+    for upstream in upstreams:
+        await upstream.stop()
+
+
 @pytest.fixture()
 def client():
     tgc = test_get_config(debug_mode=False)
-    from bento_service_registry.app import create_app
-
     app = create_app(tgc)
     yield TestClient(app)
 
@@ -42,15 +102,11 @@ def client():
 @pytest.fixture()
 def client_debug_mode():
     tgc = test_get_config(debug_mode=True)
-    from bento_service_registry.app import create_app
-
     app = create_app(tgc)
     yield TestClient(app)
 
 
 async def _service_info_fixt(config: Config):
-    from bento_service_registry.service_info import get_service_info
-
     return await get_service_info(config, test_logger)
 
 
@@ -1,8 +1,8 @@
-import pytest
+import os
+import subprocess
+import sys
 
-# Cannot import anything from bento_service_registry here; has to be within
-# individual tests. Otherwise, we cannot configure the environment variables
-# to our liking for each test.
+import pytest
 
 
 def test_service_info(client):
@@ -92,3 +92,9 @@ def test_workflows_by_purpose(client):
 
     assert r.status_code == 200
     assert len(d) == 0  # no workflow-providing services
+
+
+def test_import_without_config():
+    # Importing the app module shouldn't need any configuration; configuration is only read by the app factory.
+    env = {k: v for k, v in os.environ.items() if not k.startswith("BENTO_")}
+    subprocess.run([sys.executable, "-c", "import bento_service_registry.app"], env=env, check=True)
@@ -0,0 +1,138 @@
+import aiohttp
+import orjson
+import pytest
+import structlog.stdlib
+from aiohttp import web
+
+from bento_service_registry.cache_entry import CacheEntry, Interner
+from bento_service_registry.data_types import DataTypeManager
+from bento_service_registry.service_versions import ServiceVersionTracker
+from bento_service_registry.workflows import WorkflowManager
+
+from .conftest import make_config
+from .test_models import DATA_TYPE
+
+
+def _data_service(version: str, git_commit: str | None = None) -> dict:
+    return {
+        "id": "ca.c3g.bento:katsu",
+        "url": "http://katsu.local/",
+        "version": version,
+        "bento": {
+            "serviceKind": "metadata",
+            "dataService": True,
+            **({"gitCommit": git_commit} if git_commit else {}),
+        },
+    }
+
+
+def test_service_version_tracker():
+    t = ServiceVersionTracker()
+    assert not t.update("http://katsu.local/", _data_service("1.0.0"))  # first time seen: not a change
+    assert not t.update("http://katsu.local/", _data_service("1.0.0"))
+    assert t.update("http://katsu.local/", _data_service("1.0.1"))
+    assert t.update("http://katsu.local/", _data_service("1.0.1", git_commit="abc"))
+    assert not t.update("http://other.local/", _data_service("1.0.1"))
+
+
+@pytest.mark.asyncio
+async def test_workflow_cache_version_invalidation():
+    wm = WorkflowManager(make_config(), structlog.stdlib.get_logger())
+    n_calls = 0
+
+    async def _fake_get_workflows_from_service(_authz_header, _http_session, service, _bento_service, _start_dt):
+        nonlocal n_calls
+        n_calls += 1
+        return {"ingestion": {f"wf-{service['version']}": {"name": "test"}}}
+
+    wm.get_workflows_from_service = _fake_get_workflows_from_service
+
+    wfs = await wm.get_workflows(None, None, (_data_service("1.0.0"),), {})
+    assert list(wfs["ingestion"].keys()) == ["wf-1.0.0"]
+    await wm.get_workflows(None, None, (_data_service("1.0.0"),), {})
+    assert n_calls == 1  # cached
+
+    wfs = await wm.get_workflows(None, None, (_data_service("1.0.1"),), {})
+    assert list(wfs["ingestion"].keys()) == ["wf-1.0.1"]
+    assert n_calls == 2  # version changed; re-fetched
+
+
+@pytest.mark.asyncio
+async def test_data_type_cache_version_invalidation():
+    dtm = DataTypeManager(make_config(), structlog.stdlib.get_logger())
+    n_calls = 0
+
+    async def _fake_get_data_types_from_service(
+        _authz_header, _http_session, _service, _bento_service, _project, _dataset
+    ):
+        nonlocal n_calls
+        n_calls += 1
+        return (), True
+
+    dtm.get_data_types_from_service = _fake_get_data_types_from_service
+
+    await dtm.get_data_types(None, None, (_data_service("1.0.0"),), {}, None, None)
+    await dtm.get_data_types(None, None, (_data_service("1.0.0"),), {}, None, None)
+    assert n_calls == 1  # cached
+    await dtm.get_data_types(None, None, (_data_service("1.0.0"),), {}, "project-1", None)
+    assert n_calls == 2  # different scope
+    await dtm.get_data_types(None, None, (_data_service("2.0.0"),), {}, None, None)
+    assert n_calls == 3  # version changed; re-fetched
+
+
+def test_cache_entry():
+    e = CacheEntry("value", 100.0)
+    assert e.value == "value"
+    assert e.age(160.0) == 60.0
+    assert not hasattr(e, "__dict__")  # slotted
+
+    # round trip through a snapshot's wall clock fetch time
+    e = CacheEntry("value")
+    restored = CacheEntry.from_fetched_iso("value", e.fetched_iso())
+    assert abs(restored.fetched - e.fetched) < 0.01
+
+
+def test_interner():
+    i = Interner()
+    a = {"type": "object", "properties": {"a": {"type": "string"}, "b": {"type": "number"}}}
+    b = {"properties": {"b": {"type": "number"}, "a": {"type": "string"}}, "type": "object"}  # same, other key order
+    c = {"type": "object"}
+
+    assert i.intern(a) is a
+    assert i.intern(b) is a
+    assert i.intern(c) is c
+    assert len(i) == 2
+
+    i.retain([c])
+    assert len(i) == 1
+    assert i.intern(b) is b  # a was forgotten
+
+
+@pytest.mark.asyncio
+async def test_data_types_shared_across_tokens(fake_upstream):
+    count = 1
+
+    async def handler(_request):
+        return web.Response(body=orjson.dumps([{**DATA_TYPE, "count": count}]), content_type="application/json")
+
+    upstream = await fake_upstream({"/data-types": handler})
+    service = {"url": f"{upstream.url}/"}
+
+    dtm = DataTypeManager(make_config(), structlog.stdlib.get_logger())
+
+    async with aiohttp.ClientSession() as http_session:
+        dts_a, _ = await dtm.get_data_types_from_service(
+            {"Authorization": "Bearer a"}, http_session, service, None, None, None
+        )
+        dts_b, _ = await dtm.get_data_types_from_service(
+            {"Authorization": "Bearer b"}, http_session, service, None, None, None
+        )
+        assert dts_b is dts_a  # equal results for different tokens are stored once
+
+        count = 2
+        dts_c, _ = await dtm.get_data_types_from_service(
+            {"Authorization": "Bearer c"}, http_session, service, None, None, None
+        )
+        assert dts_c is not dts_a
+        assert dts_c[0].count == 2
+        assert dts_c[0].item_schema is dts_a[0].item_schema  # schemas are still shared
@@ -0,0 +1,77 @@
+import gzip
+
+import orjson
+
+from bento_service_registry.compression import (
+    MIN_COMPRESS_SIZE,
+    PrecompressedBody,
+    PrecompressedBodyCache,
+    negotiate_encoding,
+)
+
+from .test_models import DATA_TYPE
+
+
+def test_negotiate_encoding():
+    available = ("zstd", "br", "gzip")
+
+    assert negotiate_encoding(None, available) is None
+    assert negotiate_encoding("", available) is None
+    assert negotiate_encoding("gzip", ()) is None
+    assert negotiate_encoding("identity", available) is None
+    assert negotiate_encoding("gzip, deflate", available) == "gzip"
+    assert negotiate_encoding("gzip, br", available) == "br"  # server preference breaks ties
+    assert negotiate_encoding("br;q=0.5, gzip", available) == "gzip"
+    assert negotiate_encoding("gzip;q=0", available) is None
+    assert negotiate_encoding("*", available) == "zstd"
+    assert negotiate_encoding("*, zstd;q=0", available) == "br"
+    assert negotiate_encoding("GZIP;q=bad, gzip", ("gzip",)) == "gzip"
+
+
+def test_precompressed_body():
+    small = PrecompressedBody(b"[]")
+    assert small.identity == b"[]"
+    assert small.encoded == {}
+
+    identity = orjson.dumps([DATA_TYPE] * 50)
+    assert len(identity) >= MIN_COMPRESS_SIZE
+    body = PrecompressedBody(identity)
+    assert gzip.decompress(body.encoded["gzip"]) == identity
+
+
+def test_precompressed_body_cache_identity():
+    n_serialized = 0
+
+    def serialize(obj):
+        nonlocal n_serialized
+        n_serialized += 1
+        return orjson.dumps(obj)
+
+    cache = PrecompressedBodyCache(max_entries=2)
+    a, b, c = [DATA_TYPE], [DATA_TYPE], [DATA_TYPE]
+
+    assert cache.get_body(a, serialize) is cache.get_body(a, serialize)
+    assert n_serialized == 1
+
+    # an equal, but different, object gets its own body
+    cache.get_body(b, serialize)
+    assert n_serialized == 2
+
+    # least-recently used entry (b) is evicted
+    cache.get_body(a, serialize)
+    cache.get_body(c, serialize)
+    cache.get_body(a, serialize)
+    assert n_serialized == 3
+    cache.get_body(b, serialize)
+    assert n_serialized == 4
+
+
+def test_workflows_and_data_types_responses(client):
+    for path in ("/workflows", "/data-types"):
+        r = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert r.status_code == 200
+        assert "Accept-Encoding" in r.headers["Vary"]
+        assert r.headers["Content-Type"] == "application/json"
+        # too small to be worth compressing:
+        assert "Content-Encoding" not in r.headers
+        assert r.json() in ({}, [])
@@ -0,0 +1,114 @@
+import asyncio
+
+import aiohttp
+import orjson
+import pytest
+import structlog.stdlib
+from aiohttp import web
+from fastapi.testclient import TestClient
+
+from bento_service_registry import routes
+from bento_service_registry.app import create_app
+from bento_service_registry.data_types import DataTypeManager, DataTypesScope, get_data_type_manager
+from bento_service_registry.models import DATA_TYPES_BATCH_MAX_SCOPES, DataTypeWithServiceURL
+from bento_service_registry.services import get_services
+
+from .conftest import make_config
+from .test_models import DATA_TYPE
+
+
+@pytest.mark.asyncio
+async def test_data_types_for_scopes(fake_upstream):
+    requested: list[tuple[str | None, str | None]] = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+        project, dataset = request.query.get("project"), request.query.get("dataset")
+        requested.append((project, dataset))
+        count = len(project or "") + len(dataset or "")
+        return web.Response(body=orjson.dumps([{**DATA_TYPE, "count": count}]), content_type="application/json")
+
+    upstream = await fake_upstream({"/data-types": handler})
+    service = {"url": f"{upstream.url}/", "bento": {"dataService": True}}
+
+    dtm = DataTypeManager(make_config(), structlog.stdlib.get_logger())
+
+    async with aiohttp.ClientSession() as http_session:
+        single = await dtm.get_data_types(None, http_session, (service,), {}, "p1", None)
+        assert requested == [("p1", None)]
+
+        scopes = [(None, None), ("p1", None), ("p22", None), ("p1", "d1"), ("p1", None)]
+        res = await dtm.get_data_types_for_scopes(None, http_session, (service,), {}, scopes, 2)
+
+        assert list(res) == [(None, None), ("p1", None), ("p22", None), ("p1", "d1")]
+        assert [dts[0].count for dts in res.values()] == [0, 2, 3, 4]
+        assert res[("p1", None)] is single  # answered from the cache
+
+        assert len(requested) == 4  # the cached scope (and the duplicate) weren't requested again
+        assert max_in_flight <= 2
+
+
+def test_data_types_batch_endpoint(monkeypatch):
+    config = make_config()
+    app = create_app(lambda: config)
+    app.dependency_overrides[get_services] = lambda: ()  # no data services
+
+    with TestClient(app) as client:
+        monkeypatch.setattr(client.app.state.authz_middleware, "_enabled", False)
+
+        r = client.post("/data-types/batch", json={"scopes": ["", "p1", "p1/d1"], "fields": ["id", "count"]})
+        assert r.status_code == 200
+        assert r.json() == {"": [], "p1": [], "p1/d1": []}
+
+        r = client.post("/data-types/batch", json={"scopes": ["p1/d1/x"]})
+        assert r.status_code == 400
+
+        r = client.post("/data-types/batch", json={"scopes": ["p1"], "fields": ["nope"]})
+        assert r.status_code == 400
+
+        r = client.post("/data-types/batch", json={"scopes": ["p"] * (DATA_TYPES_BATCH_MAX_SCOPES + 1)})
+        assert r.status_code == 400
+
+
+def test_data_types_batch_parts_reused(monkeypatch):
+    dt = DataTypeWithServiceURL.model_validate({**DATA_TYPE, "service_base_url": "http://katsu.local/"})
+    # identity-stable data types per scope, like DataTypeManager's merged results
+    by_scope: dict[DataTypesScope, tuple] = {}
+
+    class _FakeDataTypeManager:
+        async def get_data_types_for_scopes(self, _authz_header, _http_session, _services, _by_kind, scopes, _limit):
+            return {s: by_scope.setdefault(s, (dt.model_copy(update={"count": len(by_scope)}),)) for s in scopes}
+
+    n_dumps = 0
+    dump_data_types = routes._dump_data_types
+
+    def _counting_dump(*args):
+        nonlocal n_dumps
+        n_dumps += 1
+        return dump_data_types(*args)
+
+    monkeypatch.setattr(routes, "_dump_data_types", _counting_dump)
+
+    app = create_app(lambda: make_config())
+    app.dependency_overrides[get_services] = lambda: ()
+    app.dependency_overrides[get_data_type_manager] = lambda: _FakeDataTypeManager()
+
+    scopes = [f"p{i}" for i in range(300)]  # more than IdentityCache's default size
+
+    with TestClient(app) as client:
+        monkeypatch.setattr(client.app.state.authz_middleware, "_enabled", False)
+
+        r1 = client.post("/data-types/batch", json={"scopes": scopes, "fields": ["id", "count"]})
+        assert r1.status_code == 200
+        assert n_dumps == 300
+
+        r2 = client.post("/data-types/batch", json={"scopes": scopes, "fields": ["id", "count"]})
+        assert r2.content == r1.content
+        assert n_dumps == 300  # every scope's serialized data types were re-used
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+import structlog.stdlib
+from aiohttp import web
+from fastapi.testclient import TestClient
+
+from bento_service_registry.app import create_app
+from bento_service_registry.federation import PeerRegistryManager
+from bento_service_registry.models import WorkflowWithServiceURL
+
+from .conftest import FakeUpstream, FakeUpstreamFactory, make_config
+from .test_models import DATA_TYPE, WORKFLOW
+
+LOCAL_NODE = "http://local.registry/"
+
+PEER_SERVICE = {"id": "peer-katsu", "type": {"group": "ca.c3g.bento", "artifact": "katsu", "version": "1.0.0"}}
+
+
+async def _start_peer(fake_upstream: FakeUpstreamFactory, delay: float = 0) -> tuple[FakeUpstream, dict[str, int]]:
+    # A stand-in for another node's service registry
+    n_calls: dict[str, int] = {}
+
+    def _handler(path: str, body):
+        async def handler(_request):
+            n_calls[path] = n_calls.get(path, 0) + 1
+            await asyncio.sleep(delay)
+            return web.json_response(body)
+
+        return handler
+
+    peer = await fake_upstream(
+        {
+            "/services": _handler("services", [PEER_SERVICE]),
+            "/data-types": _handler("data-types", [{**DATA_TYPE, "service_base_url": "http://peer/"}]),
+            "/workflows": _handler("workflows", {"ingestion": {"a": WORKFLOW}}),
+        }
+    )
+    return peer, n_calls
+
+
+def _manager(*peers: str, **kwargs):
+    config = make_config(peer_registries=peers, **kwargs)
+    return PeerRegistryManager(config, structlog.stdlib.get_logger())
+
+
+@pytest.mark.asyncio
+async def test_federated_merge(fake_upstream):
+    peer, n_calls = await _start_peer(fake_upstream, delay=0.05)
+    peer_url = peer.url
+    manager = _manager(peer_url)
+
+    try:
+        local_services = ({"id": "local-katsu"},)
+        s1, s2 = await asyncio.gather(
+            manager.get_merged("services", LOCAL_NODE, local_services),
+            manager.get_merged("services", LOCAL_NODE, local_services),
+        )
+        assert n_calls["services"] == 1  # concurrent fetches are coalesced
+        assert s1 == s2 == [{"id": "local-katsu", "node": LOCAL_NODE}, {**PEER_SERVICE, "node": f"{peer_url}/"}]
+
+        local_wf = WorkflowWithServiceURL.model_validate({**WORKFLOW, "service_base_url": LOCAL_NODE})
+        local_wfs = {"ingestion": {"a": local_wf}}
+        wfs = await manager.get_merged("workflows", LOCAL_NODE, local_wfs)
+        assert await manager.get_merged("workflows", LOCAL_NODE, local_wfs) is wfs  # re-used for the same parts
+        assert [(wf["id"], wf["node"]) for wf in wfs["ingestion"]] == [("a", LOCAL_NODE), ("a", f"{peer_url}/")]
+        assert wfs["ingestion"][0]["name"] == WORKFLOW["name"]
+
+        statuses = manager.node_statuses()
+        assert statuses[0]["node"] == f"{peer_url}/"
+        assert statuses[0]["resources"]["services"]["status"] == "ok"
+        assert statuses[0]["resources"]["data-types"]["status"] == "unavailable"
+
+        # once a peer's response is re-fetched, the merged response is rebuilt
+        await manager.refresh()
+        wfs_refreshed = await manager.get_merged("workflows", LOCAL_NODE, local_wfs)
+        assert wfs_refreshed is not wfs
+        assert wfs_refreshed == wfs
+    finally:
+        await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_federated_peer_down_or_stale(fake_upstream):
+    peer, _ = await _start_peer(fake_upstream)
+    peer_url = peer.url
+    manager = _manager(peer_url, "http://127.0.0.1:1", peer_cache_ttl=0, contact_timeout=1, upstream_retries=0)
+
+    try:
+        res = await manager.get_merged("services", LOCAL_NODE, ())
+        assert [s["node"] for s in res] == [f"{peer_url}/"]  # unavailable peer left out
+
+        down = manager.node_statuses()[1]
+        assert down["resources"]["services"]["status"] == "unavailable"
+        assert down["resources"]["services"]["error"] is not None
+
+        # expired entries are served right away (marked stale), and re-fetched in the background
+        await peer.stop()
+        res = await manager.get_merged("services", LOCAL_NODE, ())
+        assert [s["node"] for s in res] == [f"{peer_url}/"]
+        assert manager.node_statuses()[0]["resources"]["services"]["status"] == "stale"
+        await manager.refresh()
+        assert manager.node_statuses()[0]["resources"]["services"]["error"] is not None
+    finally:
+        await manager.stop()
+
+
+def test_federation_endpoints():
+    config = make_config(peer_registries=("http://127.0.0.1:1",))
+    with TestClient(create_app(lambda: config)) as client:
+        r = client.get("/federation/nodes")
+        assert r.status_code == 200
+        assert r.json()["node"] == "http://0.0.0.0:5000/api/service-registry/"
+        assert r.json()["peers"][0]["node"] == "http://127.0.0.1:1/"
+
+        r = client.get("/federation/services")
+        assert r.status_code == 200
+        assert {s["node"] for s in r.json()} == {"http://0.0.0.0:5000/api/service-registry/"}
+
+        r = client.get("/federation/workflows")
+        assert r.status_code == 200
+        assert r.json() == {}
@@ -0,0 +1,132 @@
+import asyncio
+
+import aiohttp
+import pytest
+import structlog.stdlib
+from aiohttp import web
+from fastapi.testclient import TestClient
+
+from bento_service_registry.app import create_app
+from bento_service_registry.health import PROBE_JITTER, HealthProber
+from bento_service_registry.services import ServiceManager
+
+from .conftest import make_config
+
+SERVICE_INFO = {
+    "id": "ca.c3g.bento:katsu",
+    "name": "Katsu",
+    "type": {"group": "ca.c3g.bento", "artifact": "metadata", "version": "1.0.0"},
+    "organization": {"name": "C3G", "url": "https://www.computationalgenomics.ca"},
+    "version": "1.0.0",
+}
+
+
+def _prober(service_manager: ServiceManager | None = None, **kwargs):
+    config = make_config(upstream_retries=0, **kwargs)
+    logger = structlog.stdlib.get_logger()
+    return HealthProber(config, logger, service_manager or ServiceManager(config, logger))
+
+
+@pytest.mark.asyncio
+async def test_probe_history(fake_upstream):
+    statuses = [200, 200, 500, 200]
+
+    async def handler(_request):
+        return web.json_response(SERVICE_INFO, status=statuses.pop(0))
+
+    upstream = await fake_upstream({"/service-info": handler})
+    service = {"service_kind": "katsu", "url": upstream.url}
+
+    prober = _prober(health_history_size=3)
+
+    try:
+        results = [await prober.probe("katsu", service) for _ in range(4)]
+        assert [r.ok for r in results] == [True, True, False, True]
+        assert results[2].error == "status 500"
+
+        down = await prober.probe("drs", {"service_kind": "drs", "url": "http://127.0.0.1:1"})
+        assert not down.ok and down.status is None and down.latency is None
+
+        summary = prober.summary()
+        katsu = summary["katsu"]
+        assert katsu["n_probes"] == 3  # only the last health_history_size probes are kept
+        assert katsu["uptime"] == 66.67
+        assert katsu["latency_ms"]["p50"] <= katsu["latency_ms"]["p95"]
+        assert katsu["last_probe"]["ok"] and katsu["last_probe"]["status"] == 200
+
+        assert summary["drs"]["uptime"] == 0
+        assert summary["drs"]["latency_ms"] == {"p50": None, "p95": None}
+    finally:
+        await prober.stop()
+
+
+@pytest.mark.asyncio
+async def test_probe_refreshes_service_info(fake_upstream):
+    calls = 0
+    body = SERVICE_INFO
+
+    async def handler(_request):
+        nonlocal calls
+        calls += 1
+        return web.json_response(body)
+
+    upstream = await fake_upstream({"/service-info": handler})
+    service = {"service_kind": "katsu", "url": upstream.url}
+
+    config = make_config(upstream_retries=0)
+    service_manager = ServiceManager(config, structlog.stdlib.get_logger())
+    prober = _prober(service_manager)
+
+    try:
+        assert (await prober.probe("katsu", service)).ok
+        assert calls == 1
+
+        # requests are served from the service info fetched by the probe, without contacting the service themselves
+        async with aiohttp.ClientSession() as http_session:
+            info = await service_manager.get_service(None, http_session, {}, service)
+        assert info == {**SERVICE_INFO, "url": upstream.url}
+        assert calls == 1
+
+        # a 200 response which isn't a service info object counts as a failed probe, and isn't cached
+        body = None
+        res = await prober.probe("katsu", service)
+        assert not res.ok and res.error == "invalid response"
+        assert service_manager._cache[f"{upstream.url}/service-info"].value == info
+    finally:
+        await prober.stop()
+
+
+@pytest.mark.asyncio
+async def test_probe_schedule(monkeypatch):
+    prober = _prober(health_probe_interval=10)
+
+    intervals = [prober._next_interval() for _ in range(100)]
+    assert all(10 * (1 - PROBE_JITTER) <= i <= 10 * (1 + PROBE_JITTER) for i in intervals)
+    assert len(set(intervals)) > 1
+
+    # each service is first probed at its own random point into the interval, rather than all at once
+    prober = _prober(health_probe_interval=1)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    probed: dict[str, float] = {}
+
+    async def _probe(_self, kind, _service):
+        probed.setdefault(kind, loop.time() - start)
+
+    monkeypatch.setattr(HealthProber, "probe", _probe)
+
+    await prober.start({k: {"service_kind": k, "url": f"http://{k}"} for k in ("a", "b", "c", "service-registry")})
+    try:
+        await asyncio.sleep(1.05)
+        assert set(probed) == {"a", "b", "c"}  # not the registry itself
+        assert len(set(probed.values())) == 3
+    finally:
+        await prober.stop()
+
+
+def test_services_health_endpoint():
+    config = make_config()
+    with TestClient(create_app(lambda: config)) as client:
+        r = client.get("/services/health")
+        assert r.status_code == 200
+        assert r.json() == {"probe_interval": 60, "history_size": 60, "services": {}}
@@ -0,0 +1,132 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from bento_service_registry.http_session import get_http_session, http_session_lease
+from bento_service_registry.inflight import (
+    ClientDisconnected,
+    DisconnectMiddleware,
+    InFlight,
+    _disconnected,
+    mark_upstream_started,
+    until_disconnected,
+)
+
+from .conftest import make_config
+
+
+@pytest.mark.asyncio
+async def test_in_flight_shared():
+    in_flight: InFlight[int] = InFlight()
+    n_calls = 0
+
+    async def _work():
+        nonlocal n_calls
+        n_calls += 1
+        await asyncio.sleep(0.05)
+        return n_calls
+
+    assert await asyncio.gather(in_flight.run("a", _work), in_flight.run("a", _work)) == [1, 1]
+    assert len(in_flight) == 0
+    assert await in_flight.run("a", _work) == 2  # finished work isn't re-used
+
+
+@pytest.mark.asyncio
+async def test_in_flight_waiter_cancelled():
+    in_flight: InFlight[str] = InFlight()
+    slot = asyncio.Event()
+    finished: list[str] = []
+
+    async def _work(key: str):
+        await slot.wait()  # i.e., waiting for an upstream request slot
+        mark_upstream_started()
+        await asyncio.sleep(0.05)
+        finished.append(key)
+        return key
+
+    # one waiter leaving doesn't cancel work another waiter still needs
+    w1 = asyncio.create_task(in_flight.run("a", lambda: _work("a")))
+    w2 = asyncio.create_task(in_flight.run("a", lambda: _work("a")))
+    await asyncio.sleep(0)
+    w1.cancel()
+    slot.set()
+    assert await w2 == "a"
+    assert w1.cancelled()
+
+    # once every waiter has left, work still waiting for a slot is cancelled...
+    slot.clear()
+    w3 = asyncio.create_task(in_flight.run("b", lambda: _work("b")))
+    await asyncio.sleep(0)
+    w3.cancel()
+    await asyncio.sleep(0)
+    slot.set()
+    await asyncio.sleep(0.1)
+    assert finished == ["a"]
+    assert len(in_flight) == 0
+
+    # ... but work which has started its upstream request is left to finish (and cache its results)
+    w4 = asyncio.create_task(in_flight.run("c", lambda: _work("c")))
+    await asyncio.sleep(0.01)
+    w4.cancel()
+    await asyncio.sleep(0.1)
+    assert finished == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_until_disconnected():
+    # outside a request (or before the client disconnects), it just awaits
+    assert await until_disconnected(asyncio.sleep(0, "ok")) == "ok"
+
+    disconnected = asyncio.Event()
+    _disconnected.set(disconnected)
+
+    assert await until_disconnected(asyncio.sleep(0, "ok")) == "ok"
+
+    work = asyncio.ensure_future(asyncio.sleep(10))
+    asyncio.get_running_loop().call_later(0.01, disconnected.set)
+    with pytest.raises(ClientDisconnected):
+        await until_disconnected(work)
+    assert work.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_disconnect_middleware():
+    seen: list[tuple[bool, dict]] = []
+
+    async def _app(_scope, receive, _send):
+        event = _disconnected.get()
+        assert event is not None
+        seen.append((event.is_set(), await receive()))
+        await asyncio.wait_for(event.wait(), 1)
+        seen.append((event.is_set(), await receive()))
+        # later calls (e.g., from another part of the app listening for disconnects) don't block
+        seen.append((event.is_set(), await asyncio.wait_for(receive(), 1)))
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+
+    async def _receive():
+        await asyncio.sleep(0.01)
+        return messages.pop(0)
+
+    async def _send(_message):
+        pass
+
+    await DisconnectMiddleware(_app)({"type": "http"}, _receive, _send)
+    assert seen == [
+        (False, {"type": "http.request", "body": b"", "more_body": False}),
+        (True, {"type": "http.disconnect"}),
+        (True, {"type": "http.disconnect"}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_http_session_lease():
+    gen = get_http_session(make_config())
+    session: aiohttp.ClientSession = await anext(gen)
+
+    async with http_session_lease(session):
+        # the request using the session finishes while shared work is still using it
+        await gen.aclose()
+        assert not session.closed
+    assert session.closed
@@ -0,0 +1,131 @@
+import pytest
+from fastapi import HTTPException
+
+from bento_service_registry.data_types import get_data_types
+from bento_service_registry.listing import encode_cursor, paginate, split_query_values
+from bento_service_registry.models import DataTypeWithServiceURL, WorkflowWithServiceURL
+from bento_service_registry.workflows import get_workflows
+
+from .test_models import DATA_TYPE, WORKFLOW
+
+
+def test_split_query_values():
+    assert split_query_values(None) is None
+    assert split_query_values([]) is None
+    assert split_query_values([","]) is None
+    assert split_query_values(["a,b", "c", "a"]) == ("a", "b", "c")
+
+
+def test_paginate():
+    items = tuple("abcde")
+
+    p1 = paginate(items, str, None, 2)
+    assert p1.items == ("a", "b")
+    p2 = paginate(items, str, p1.next_cursor, 2)
+    assert p2.items == ("c", "d")
+    p3 = paginate(items, str, p2.next_cursor, 2)
+    assert p3.items == ("e",)
+    assert p3.next_cursor is None
+
+    # no limit - everything (from the cursor onwards)
+    assert paginate(items, str, None, None).items is items
+    assert paginate(items, str, p1.next_cursor, None).items == ("c", "d", "e")
+
+    # items moved/removed since the cursor was issued
+    assert paginate(("x", *items), str, p1.next_cursor, 2).items == ("c", "d")
+    assert paginate(("a", "c", "d", "e"), str, p1.next_cursor, 2).items == ("d", "e")
+
+    for bad_cursor in ("!!!", encode_cursor(-1, "a")[:-1] + "@", encode_cursor(-1, "a")):
+        with pytest.raises(HTTPException):
+            paginate(items, str, bad_cursor, 2)
+
+
+def _data_types():
+    return tuple(
+        DataTypeWithServiceURL(**{**DATA_TYPE, "id": dt_id}, service_base_url="http://katsu.local/")
+        for dt_id in ("phenopacket", "experiment", "variant")
+    )
+
+
+def _workflows():
+    def _wf(name: str, service_base_url: str):
+        return WorkflowWithServiceURL(**{**WORKFLOW, "name": name}, service_base_url=service_base_url)
+
+    return {
+        "ingestion": {"a": _wf("a", "http://0.0.0.0:5000/api/service-registry/"), "b": _wf("b", "http://wes.local/")},
+        "export": {"c": _wf("c", "http://wes.local/")},
+    }
+
+
+@pytest.fixture()
+def listing_client(client):
+    data_types = _data_types()
+    workflows = _workflows()
+
+    client.app.dependency_overrides[get_data_types] = lambda: data_types
+    client.app.dependency_overrides[get_workflows] = lambda: workflows
+    yield client
+
+
+def test_data_types_filtering(listing_client):
+    r = listing_client.get("/data-types", params={"ids": "variant,phenopacket"})
+    assert r.status_code == 200
+    assert [dt["id"] for dt in r.json()] == ["phenopacket", "variant"]
+
+    r = listing_client.get("/data-types", params={"fields": ["id,count", "schema"]})
+    assert r.status_code == 200
+    assert r.json()[0] == {"id": "phenopacket", "count": 5, "schema": DATA_TYPE["schema"]}
+
+    r = listing_client.get("/data-types", params={"fields": "id,nope"})
+    assert r.status_code == 400
+
+
+def test_data_types_pagination(listing_client):
+    r = listing_client.get("/data-types", params={"fields": "id", "limit": 2})
+    assert r.status_code == 200
+    assert r.json() == [{"id": "phenopacket"}, {"id": "experiment"}]
+    assert r.links["next"]["url"].startswith("http://testserver/data-types?")
+
+    r = listing_client.get(r.links["next"]["url"])
+    assert r.status_code == 200
+    assert r.json() == [{"id": "variant"}]
+    assert "Link" not in r.headers
+
+    r = listing_client.get("/data-types", params={"cursor": "???"})
+    assert r.status_code == 400
+
+
+def test_workflows_filtering(listing_client):
+    r = listing_client.get("/workflows", params={"purpose": "export"})
+    assert r.status_code == 200
+    assert list(r.json().keys()) == ["export"]
+
+    # only the service registry is in the test bento_services.json
+    r = listing_client.get("/workflows", params={"service": "service-registry"})
+    assert r.status_code == 200
+    assert list(r.json().keys()) == ["ingestion"]
+    assert list(r.json()["ingestion"].keys()) == ["a"]
+
+    r = listing_client.get("/workflows", params={"service": "does-not-exist"})
+    assert r.status_code == 200
+    assert r.json() == {}
+
+    r = listing_client.get("/workflows")
+    assert r.status_code == 200
+    assert set(r.json().keys()) == {"ingestion", "export"}
+
+
+def test_services_filtering(client):
+    for params in (
+        {"kind": "service-registry"},
+        {"type": "service-registry"},
+        {"kind": "service-registry", "limit": 1},
+    ):
+        r = client.get("/services", params=params)
+        assert r.status_code == 200
+        assert len(r.json()) == 1
+        assert "Link" not in r.headers
+
+    r = client.get("/services", params={"kind": "katsu"})
+    assert r.status_code == 200
+    assert r.json() == []
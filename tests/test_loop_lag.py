@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import structlog.stdlib
+from fastapi.testclient import TestClient
+
+from bento_service_registry.app import create_app
+from bento_service_registry.cache_entry import CacheEntry
+from bento_service_registry.loop_lag import LoopLagMonitor, get_loop_lag_monitor
+from bento_service_registry.workflows import WorkflowManager
+
+from .conftest import make_config
+
+
+def test_degraded_mode_hysteresis():
+    monitor = LoopLagMonitor(make_config(), structlog.stdlib.get_logger())
+
+    for _ in range(10):
+        monitor.record(0.01)
+    assert not monitor.degraded
+
+    monitor.record(1.0)  # one long blocking call
+    assert monitor.degraded
+    assert monitor.status()["degraded_since"] is not None
+
+    monitor.record(0.06)
+    assert monitor.degraded  # moving average still above the recovery threshold
+
+    for _ in range(10):
+        monitor.record(0.0)
+    assert not monitor.degraded
+
+    status = monitor.status()
+    assert status["n_degraded_periods"] == 1
+    assert status["recent"]["max_ms"] == 1000
+    assert status["recent"]["n_samples"] == 22
+
+
+@pytest.mark.asyncio
+async def test_lag_measured():
+    monitor = LoopLagMonitor(make_config(loop_lag_check_interval=0.01), structlog.stdlib.get_logger())
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        time.sleep(0.5)  # noqa: ASYNC251 - block the event loop
+        await asyncio.sleep(0.02)
+        status = monitor.status()
+        assert status["n_degraded_periods"] == 1
+        assert status["recent"]["max_ms"] >= 400
+    finally:
+        await monitor.stop()
+
+
+@pytest.mark.asyncio
+async def test_parse_in_thread_when_degraded():
+    monitor = LoopLagMonitor(make_config(degraded_parse_min_bytes=100), structlog.stdlib.get_logger())
+
+    def _parse():
+        return threading.get_ident()
+
+    main_thread = threading.get_ident()
+    assert await monitor.parse(1000, _parse) == main_thread
+
+    monitor.record(10)
+    assert await monitor.parse(10, _parse) == main_thread  # small payloads are still parsed right away
+    assert await monitor.parse(1000, _parse) != main_thread
+
+
+@pytest.mark.asyncio
+async def test_degraded_serves_expired_cache():
+    # (a config of our own, so that we get our own monitor singleton)
+    config = make_config(loop_lag_degraded_threshold=0.3)
+    wm = WorkflowManager(config, structlog.stdlib.get_logger())
+    n_calls = 0
+
+    async def _fake_get_workflows_from_service(_authz_header, _http_session, _service, _bento_service, _start):
+        nonlocal n_calls
+        n_calls += 1
+        return {}
+
+    wm.get_workflows_from_service = _fake_get_workflows_from_service
+
+    service = {"url": "http://katsu.local/", "bento": {"serviceKind": "metadata", "workflowProvider": True}}
+    await wm.get_workflows(None, None, (service,), {})
+    assert n_calls == 1
+
+    # expire the entry
+    for k, v in wm._workflows_by_purpose.items():
+        wm._workflows_by_purpose[k] = CacheEntry(v.value, v.fetched - config.workflow_cache_ttl - 1)
+
+    monitor = get_loop_lag_monitor(config)
+    monitor.record(10)
+    try:
+        await wm.get_workflows(None, None, (service,), {})
+        assert n_calls == 1  # served from the cache, despite being expired
+    finally:
+        for _ in range(30):
+            monitor.record(0)
+
+    await wm.get_workflows(None, None, (service,), {})
+    assert n_calls == 2
+
+
+def test_loop_lag_endpoint(monkeypatch):
+    config = make_config(loop_lag_check_interval=0.01)
+    with TestClient(create_app(lambda: config)) as client:
+        monkeypatch.setattr(client.app.state.authz_middleware, "_enabled", False)
+        r = client.get("/admin/loop-lag")
+        assert r.status_code == 200
+        assert r.json()["degraded"] is False
@@ -0,0 +1,72 @@
+import orjson
+import pytest
+from pydantic import ValidationError
+
+from bento_service_registry.models import DataTypeWithServiceURL, data_types_adapter, workflows_by_purpose_adapter
+
+DATA_TYPE = {
+    "label": "Phenopackets",
+    "queryable": True,
+    "schema": {"type": "object"},
+    "metadata_schema": {"type": "object"},
+    "id": "phenopacket",
+    "count": 5,
+}
+
+WORKFLOW = {
+    "name": "Test Workflow",
+    "type": "ingestion",
+    "description": "A test workflow",
+    "file": "test.wdl",
+    "tags": ["b", "a"],
+    "inputs": [{"id": "project_dataset", "type": "project:dataset"}],
+}
+
+
+def test_data_types_adapter_skips_invalid():
+    skipped = []
+    res = data_types_adapter.validate_json(
+        orjson.dumps([DATA_TYPE, {"id": "bad"}, {**DATA_TYPE, "id": "experiment"}]),
+        context={"service_base_url": "http://katsu.local/", "skipped": skipped},
+    )
+
+    assert [dt.id if dt else None for dt in res] == ["phenopacket", None, "experiment"]
+    assert all(dt.service_base_url == "http://katsu.local/" for dt in res if dt)
+    assert len(skipped) == 1
+    assert skipped[0][0] == {"id": "bad"}
+
+
+def test_data_type_service_base_url_required():
+    assert DataTypeWithServiceURL.model_validate({**DATA_TYPE, "service_base_url": "u"}).service_base_url == "u"
+    with pytest.raises(ValidationError):
+        DataTypeWithServiceURL.model_validate(DATA_TYPE)
+
+
+def test_workflows_adapter_skips_invalid():
+    skipped = []
+    res = workflows_by_purpose_adapter.validate_json(
+        orjson.dumps({"ingestion": {"good": WORKFLOW, "bad": {**WORKFLOW, "inputs": None}}}),
+        context={"service_base_url": "http://drop-box.local/", "skipped": skipped},
+    )
+
+    assert res["ingestion"]["bad"] is None
+    assert res["ingestion"]["good"].service_base_url == "http://drop-box.local/"
+    assert res["ingestion"]["good"].definition.tags == frozenset({"a", "b"})
+    assert len(skipped) == 1
+
+
+def test_workflow_served_as_received():
+    wf = {**WORKFLOW, "future_field": {"x": 1}, "inputs": [{**WORKFLOW["inputs"][0], "future_input_field": True}]}
+    res = workflows_by_purpose_adapter.validate_json(
+        orjson.dumps({"ingestion": {"wf": wf}}), context={"service_base_url": "http://drop-box.local/"}
+    )
+
+    # unknown fields are kept, and no defaults (e.g., data_type, inputs[].required) are added
+    dumped = orjson.loads(workflows_by_purpose_adapter.dump_json(res))["ingestion"]["wf"]
+    assert dumped == {**wf, "service_base_url": "http://drop-box.local/"}
+
+    # only the received workflow is kept, and instances (shared between cache entries and responses) are immutable
+    wf_model = res["ingestion"]["wf"]
+    assert wf_model.received == wf
+    with pytest.raises(ValidationError):
+        wf_model.service_base_url = "http://other.local/"
@@ -0,0 +1,95 @@
+import aiohttp
+import pytest
+from aiohttp import web
+
+from bento_service_registry.cache_entry import CacheEntry
+from bento_service_registry.negative_cache import NegativeCache, UpstreamErrorClass
+from bento_service_registry.scheduler import UpstreamScheduler
+from bento_service_registry.transport import get_upstream_target
+from bento_service_registry.upstream import UpstreamFetcher
+
+from .conftest import make_config
+
+
+def test_negative_cache_ttls():
+    nc: NegativeCache[str] = NegativeCache(
+        make_config(negative_cache_ttl_auth=10, negative_cache_ttl_server_error=2, negative_cache_ttl_timeout=0)
+    )
+
+    nc.put("http://a/x", "t1", UpstreamErrorClass.AUTH, "401")
+    nc.put("http://a/x", "t1", UpstreamErrorClass.TIMEOUT, "timeout")  # not cached (TTL of 0)
+    assert len(nc) == 1
+    assert nc.get("http://a/x", "t1") == (UpstreamErrorClass.AUTH, "401")
+    assert nc.get("http://a/x", "t2") is None
+    assert nc.get("http://a/y", "t1") is None
+
+    # expire the entry
+    k = ("http://a/x", "t1", UpstreamErrorClass.AUTH)
+    nc._entries[k] = CacheEntry("401", nc._entries[k].fetched - 11)
+    assert nc.get("http://a/x", "t1") is None
+    assert len(nc) == 0
+
+    nc.put("http://a/x", "t1", UpstreamErrorClass.SERVER, "500")
+    nc.clear("http://a/x", "t1")
+    assert nc.get("http://a/x", "t1") is None
+
+
+@pytest.mark.asyncio
+async def test_failures_answered_locally(fake_upstream):
+    calls: list[str] = []
+
+    async def handler(request):
+        token = request.headers.get("Authorization", "")
+        calls.append(token)
+        if token == "Bearer expired":
+            return web.Response(status=401, text="invalid jwt")
+        if token == "Bearer broken":
+            return web.Response(status=500)
+        return web.json_response({"id": "test"})
+
+    upstream = await fake_upstream({"/service-info": handler})
+
+    config = make_config()
+    fetcher = UpstreamFetcher(config, UpstreamScheduler(8, 8))
+
+    async with aiohttp.ClientSession() as http_session:
+        target = get_upstream_target(config, http_session, upstream.url, None)
+        url = target.url("service-info")
+
+        async def _get(token: str, **kwargs):
+            return await fetcher.get(target, url, {"Authorization": f"Bearer {token}"}, **kwargs)
+
+        for _ in range(3):
+            assert (await _get("expired")).status == 401
+        assert calls == ["Bearer expired"]  # repeats were answered from the negative cache
+
+        # a fresh token goes straight through
+        assert (await _get("fresh")).status == 200
+        assert (await _get("fresh")).status == 200
+        assert calls.count("Bearer fresh") == 2
+
+        for _ in range(2):
+            assert (await _get("broken")).status == 500
+        assert calls.count("Bearer broken") == 1
+
+        # bypassing the negative cache (like health probes do) still contacts the service
+        assert (await _get("expired", negative_cache=False)).status == 401
+        assert calls.count("Bearer expired") == 2
+
+
+@pytest.mark.asyncio
+async def test_connection_errors_cached():
+    config = make_config(upstream_retries=0)
+    fetcher = UpstreamFetcher(config, UpstreamScheduler(8, 8))
+
+    async with aiohttp.ClientSession() as http_session:
+        # nothing listening on port 9 (discard)
+        target = get_upstream_target(config, http_session, "http://127.0.0.1:9", None)
+        url = target.url("service-info")
+
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await fetcher.get(target, url, None)
+        assert len(fetcher._negative_cache) == 1
+
+        with pytest.raises(aiohttp.ClientConnectionError, match="negatively cached"):
+            await fetcher.get(target, url, None)
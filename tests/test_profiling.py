@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from bento_service_registry.profiling import ProfilerBusyError, SamplingProfiler
+
+
+def _busy_loop(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler():
+    profiler = SamplingProfiler(0.001)
+    profiler.start()
+
+    # only one profile at a time
+    with pytest.raises(ProfilerBusyError):
+        SamplingProfiler().start()
+
+    _busy_loop(0.1)
+    profile = profiler.stop()
+
+    assert profile.n_samples > 0
+    collapsed = profile.to_collapsed()
+    assert "_busy_loop (" in collapsed
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines())
+
+    ss = profile.to_speedscope()
+    frames = ss["shared"]["frames"]
+    (p,) = ss["profiles"]
+    assert p["type"] == "sampled"
+    assert len(p["samples"]) == len(p["weights"])
+    assert any(frames[i]["name"] == "_busy_loop" for s in p["samples"] for i in s)
+
+    # can profile again once stopped
+    profiler = SamplingProfiler()
+    profiler.start()
+    profiler.stop()
+
+
+def test_sampling_profiler_other_thread():
+    t = threading.Thread(target=_busy_loop, args=(0.1,))
+    t.start()
+    profiler = SamplingProfiler(0.001, thread_id=t.ident)
+    profiler.start()
+    t.join()
+    profile = profiler.stop()
+
+    assert "_busy_loop (" in profile.to_collapsed()
+    assert "test_sampling_profiler_other_thread" not in profile.to_collapsed()
+
+
+def test_profile_endpoint(client, monkeypatch):
+    # admin-only; no token given
+    r = client.get("/admin/profile", params={"seconds": 0.05})
+    assert r.status_code == 401
+
+    monkeypatch.setattr(client.app.state.authz_middleware, "_enabled", False)
+
+    r = client.get("/admin/profile", params={"seconds": 0.05, "interval_ms": 1})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert int(r.headers["X-Profile-Samples"]) > 0
+
+    r = client.get("/admin/profile", params={"seconds": 0.05, "format": "speedscope"})
+    assert r.status_code == 200
+    assert r.json()["profiles"][0]["type"] == "sampled"
+
+    r = client.get("/admin/profile", params={"seconds": 120})
+    assert r.status_code == 400
+
+
+def test_profile_request_header(client, client_debug_mode, monkeypatch):
+    # only in debug mode
+    r = client.get("/service-info", headers={"X-Profile": "collapsed"})
+    assert r.status_code == 200
+    assert "X-Profiled-Status" not in r.headers
+    assert r.json()["id"]
+
+    # admin-only, even for public endpoints; no token given
+    r = client_debug_mode.get("/service-info", headers={"X-Profile": "speedscope"})
+    assert r.status_code == 401
+    assert "X-Profiled-Status" not in r.headers
+
+    monkeypatch.setattr(client_debug_mode.app.state.authz_middleware, "_enabled", False)
+
+    r = client_debug_mode.get("/service-info", headers={"X-Profile": "speedscope"})
+    assert r.status_code == 200
+    assert r.headers["X-Profiled-Status"] == "200"
+    assert r.json()["profiles"][0]["type"] == "sampled"
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from bento_service_registry.scheduler import Priority, UpstreamScheduler
+
+
+async def _hold(scheduler, order: list, name: str, upstream: str, flow=None, priority=None, release=None):
+    async with scheduler.slot(upstream, flow, priority if priority is not None else Priority.INTERACTIVE):
+        order.append(name)
+        if release is not None:
+            await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits():
+    scheduler = UpstreamScheduler(max_concurrency=3, max_concurrency_per_service=2)
+    release = asyncio.Event()
+    order: list[str] = []
+
+    tasks = [asyncio.create_task(_hold(scheduler, order, f"a{i}", "http://a/", release=release)) for i in range(3)] + [
+        asyncio.create_task(_hold(scheduler, order, f"b{i}", "http://b/", release=release)) for i in range(3)
+    ]
+    await asyncio.sleep(0)
+
+    # at most 2 per service, and 3 in total
+    assert scheduler.n_active == 3
+    assert scheduler.n_waiting == 3
+    assert sorted(order) == ["a0", "a1", "b0"]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert scheduler.n_active == 0
+    assert scheduler.n_waiting == 0
+    assert sorted(order) == ["a0", "a1", "a2", "b0", "b1", "b2"]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_priority_and_fairness():
+    scheduler = UpstreamScheduler(max_concurrency=1, max_concurrency_per_service=1)
+    release = asyncio.Event()
+    order: list[str] = []
+
+    blocker = asyncio.create_task(_hold(scheduler, order, "blocker", "http://a/", release=release))
+    await asyncio.sleep(0)
+
+    # queue up: a background request, then a burst from flow x, then one request from flow y
+    tasks = [asyncio.create_task(_hold(scheduler, order, "bg", "http://a/", "z", Priority.BACKGROUND))]
+    tasks += [asyncio.create_task(_hold(scheduler, order, f"x{i}", "http://a/", "x")) for i in range(3)]
+    tasks += [asyncio.create_task(_hold(scheduler, order, "y0", "http://a/", "y"))]
+    await asyncio.sleep(0)
+    assert scheduler.n_waiting == 5
+
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+
+    # interactive requests go first, alternating between flows; background work goes last
+    assert order == ["blocker", "x0", "y0", "x1", "x2", "bg"]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancel_waiting():
+    scheduler = UpstreamScheduler(max_concurrency=1, max_concurrency_per_service=1)
+    release = asyncio.Event()
+    order: list[str] = []
+
+    blocker = asyncio.create_task(_hold(scheduler, order, "blocker", "http://a/", release=release))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(_hold(scheduler, order, "cancelled", "http://a/"))
+    await asyncio.sleep(0)
+    assert scheduler.n_waiting == 1
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.n_waiting == 0
+
+    release.set()
+    await blocker
+    assert order == ["blocker"]
+    assert scheduler.n_active == 0
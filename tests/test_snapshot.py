@@ -0,0 +1,98 @@
+import time
+
+import pytest
+import structlog.stdlib
+
+from bento_service_registry.cache_entry import CacheEntry
+from bento_service_registry.data_types import DataTypeManager
+from bento_service_registry.models import DataTypeWithServiceURL, WorkflowWithServiceURL
+from bento_service_registry.services import ServiceManager
+from bento_service_registry.snapshot import CacheSnapshotter
+from bento_service_registry.utils import ANONYMOUS_AUTHZ_DIGEST, authz_header_digest
+from bento_service_registry.workflows import WorkflowManager
+
+from .conftest import make_config
+from .test_models import DATA_TYPE, WORKFLOW
+
+SERVICE_URL = "http://katsu.local/"
+SERVICE_INFO_URL = "http://katsu.local/service-info"
+
+
+def _build_snapshotter(tmp_path):
+    config = make_config(cache_snapshot_path=tmp_path / "cache.json")
+    logger = structlog.stdlib.get_logger()
+    return CacheSnapshotter(
+        config,
+        logger,
+        ServiceManager(config, logger),
+        DataTypeManager(config, logger),
+        WorkflowManager(config, logger),
+    )
+
+
+@pytest.mark.asyncio
+async def test_cache_snapshot_round_trip(tmp_path):
+    s1 = _build_snapshotter(tmp_path)
+
+    # populate caches with old entries, which would otherwise be considered expired
+    old = time.monotonic() - 86400
+    dt = DataTypeWithServiceURL.model_validate({**DATA_TYPE, "service_base_url": SERVICE_URL})
+    wf = WorkflowWithServiceURL.model_validate({**WORKFLOW, "service_base_url": SERVICE_URL})
+    token_digest = authz_header_digest({"Authorization": "Bearer secret"})
+
+    s1._service_manager._cache[SERVICE_INFO_URL] = CacheEntry({"id": "katsu", "url": SERVICE_URL}, old)
+    s1._data_type_manager._data_types[(SERVICE_URL, None, None, ANONYMOUS_AUTHZ_DIGEST)] = CacheEntry((dt,), old)
+    s1._data_type_manager._data_types[(SERVICE_URL, None, None, token_digest)] = CacheEntry((dt,), old)
+    s1._workflow_manager._workflows_by_purpose[(SERVICE_URL, ANONYMOUS_AUTHZ_DIGEST)] = CacheEntry(
+        {"ingestion": {"a": wf}}, old
+    )
+    s1._workflow_manager._workflows_by_purpose[(SERVICE_URL, token_digest)] = CacheEntry({"ingestion": {"a": wf}}, old)
+
+    await s1.save()
+    assert (tmp_path / "cache.json").exists()
+    assert not (tmp_path / "cache.json.tmp").exists()
+
+    s2 = _build_snapshotter(tmp_path)
+    assert await s2.load()
+
+    # only anonymous (non-per-token) entries are persisted
+    assert list(s2._data_type_manager._data_types.keys()) == [(SERVICE_URL, None, None, ANONYMOUS_AUTHZ_DIGEST)]
+    assert list(s2._workflow_manager._workflows_by_purpose.keys()) == [(SERVICE_URL, ANONYMOUS_AUTHZ_DIGEST)]
+    assert s2._data_type_manager._data_types[(SERVICE_URL, None, None, ANONYMOUS_AUTHZ_DIGEST)].value == (dt,)
+    assert (
+        s2._workflow_manager._workflows_by_purpose[(SERVICE_URL, ANONYMOUS_AUTHZ_DIGEST)].value["ingestion"]["a"] == wf
+    )
+
+    # restored entries are stale, but are served without contacting the service despite their age
+    data_service = {"url": SERVICE_URL, "version": "1.0.0", "bento": {"dataService": True}}
+    assert await s2._data_type_manager.get_data_types(None, None, (data_service,), {}, None, None) == (dt,)
+    assert (await s2._workflow_manager.get_workflows(None, None, (data_service,), {}))["ingestion"]["a"] == wf
+
+
+@pytest.mark.asyncio
+async def test_cache_snapshot_missing_or_corrupt(tmp_path):
+    s = _build_snapshotter(tmp_path)
+    assert not await s.load()
+
+    (tmp_path / "cache.json").write_bytes(b"{not json")
+    assert not await s.load()
+
+
+@pytest.mark.asyncio
+async def test_cache_snapshot_revalidation_failure(tmp_path):
+    s1 = _build_snapshotter(tmp_path)
+    s1._service_manager._cache[SERVICE_INFO_URL] = CacheEntry({"id": "katsu", "url": SERVICE_URL})
+    await s1.save()
+
+    s2 = _build_snapshotter(tmp_path)
+    assert await s2.load()
+    assert s2._service_manager._stale
+
+    async def _fail():
+        raise OSError("could not read bento_services.json")
+
+    s2.revalidate = _fail
+    await s2._revalidate_task()
+
+    # restored entries are no longer served regardless of age, even though they couldn't be revalidated
+    assert not s2._service_manager._stale
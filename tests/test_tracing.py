@@ -0,0 +1,143 @@
+import asyncio
+
+import orjson
+import pytest
+import structlog.stdlib
+from aiohttp import web
+
+from bento_service_registry.data_types import DataTypeManager
+from bento_service_registry.http_session import create_http_session
+from bento_service_registry.tracing import Tracer, mark_error, span, traces_to_otlp
+
+from .conftest import make_config
+from .test_models import DATA_TYPE
+
+
+@pytest.mark.asyncio
+async def test_tracer_records_spans_across_tasks():
+    tracer = Tracer(2)
+
+    async def leg(i: int):
+        with span("leg", kind="client", i=i):
+            await asyncio.sleep(0.01 * i)
+
+    with tracer.trace("GET /services"), span("fan-out"):
+        await asyncio.gather(*(leg(i) for i in range(3)))
+
+    (tr,) = tracer.recent()
+    by_name: dict = {}
+    for s in tr.spans:
+        by_name.setdefault(s.name, []).append(s)
+
+    fan_out = by_name["fan-out"][0]
+    assert fan_out.parent_id == tr.root.span_id
+    assert len(by_name["leg"]) == 3
+    assert all(s.parent_id == fan_out.span_id for s in by_name["leg"])
+
+    # the slowest leg is on the critical path
+    assert [s.name for s in tr.critical_path()] == ["GET /services", "fan-out", "leg"]
+    assert tr.critical_path()[-1].attributes["i"] == 2
+
+    wf = tr.to_waterfall()
+    assert wf["name"] == "GET /services"
+    assert len(wf["spans"]) == 5
+    assert wf["spans"][0]["offset_ms"] == 0
+    assert wf["critical_path"][0] == wf["spans"][0]["span_id"]
+
+
+def test_tracer_ring_buffer():
+    tracer = Tracer(2)
+
+    # no upstream requests made - not kept
+    with tracer.trace("GET /service-info"):
+        pass
+    assert tracer.recent() == []
+
+    for i in range(3):
+        with tracer.trace(f"GET /{i}"), span("leg", kind="client"):
+            pass
+
+    assert [tr.root.name for tr in tracer.recent()] == ["GET /2", "GET /1"]
+    assert len(tracer.recent(limit=1)) == 1
+    assert tracer.recent(min_duration_ms=60000) == []
+
+    # disabled
+    tracer = Tracer(0)
+    with tracer.trace("GET /0") as root, span("leg", kind="client") as leg:
+        assert root is None
+        assert leg is None
+    assert tracer.recent() == []
+
+
+def test_tracer_errors_and_otlp():
+    tracer = Tracer(1)
+
+    with tracer.trace("GET /workflows"):
+        with span("leg", kind="client", service_url="http://katsu.local"):
+            mark_error("timeout")
+        with pytest.raises(ValueError), span("validate"):
+            raise ValueError()
+
+    (tr,) = tracer.recent()
+    otlp = traces_to_otlp([tr])
+    spans = otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    assert len(spans) == 3
+    assert all(len(s["traceId"]) == 32 and len(s["spanId"]) == 16 for s in spans)
+    assert "parentSpanId" not in spans[0]
+    assert spans[1]["kind"] == 3
+    assert spans[1]["status"] == {"code": 2, "message": "timeout"}
+    assert spans[1]["attributes"] == [{"key": "service_url", "value": {"stringValue": "http://katsu.local"}}]
+    assert spans[2]["status"] == {"code": 2, "message": "ValueError"}
+    assert int(spans[0]["endTimeUnixNano"]) >= int(spans[0]["startTimeUnixNano"])
+
+
+@pytest.mark.asyncio
+async def test_data_types_fetch_traced(fake_upstream):
+    async def data_types_handler(_request: web.Request):
+        return web.Response(body=orjson.dumps([DATA_TYPE]), content_type="application/json")
+
+    upstream = await fake_upstream({"/data-types": data_types_handler})
+
+    config = make_config()
+    dtm = DataTypeManager(config, structlog.stdlib.get_logger())
+    service = {"url": upstream.url, "bento": {"serviceKind": "metadata", "dataService": True}}
+    tracer = Tracer(1)
+
+    http_session = create_http_session(config)
+    try:
+        with tracer.trace("GET /data-types"):
+            await dtm.get_data_types(None, http_session, (service,), {}, None, None)
+    finally:
+        await http_session.close()
+
+    (tr,) = tracer.recent()
+    by_name = {s.name: s for s in tr.spans}
+
+    assert by_name["data types fan-out"].parent_id == tr.root.span_id
+    assert by_name["fetch data types"].parent_id == by_name["data types fan-out"].span_id
+    assert by_name["attempt"].parent_id == by_name["fetch data types"].span_id
+    assert by_name["http request"].parent_id == by_name["attempt"].span_id
+    assert by_name["http request"].attributes["http.status_code"] == 200
+    assert by_name["connect"].parent_id == by_name["http request"].span_id
+    assert by_name["validate data types"].parent_id == by_name["fetch data types"].span_id
+    assert all(s.end is not None for s in tr.spans)
+
+
+def test_traces_endpoint(client, monkeypatch):
+    # admin-only; no token given
+    r = client.get("/admin/traces")
+    assert r.status_code == 401
+
+    monkeypatch.setattr(client.app.state.authz_middleware, "_enabled", False)
+
+    r = client.get("/admin/traces")
+    assert r.status_code == 200
+    assert r.json() == []
+
+    r = client.get("/admin/traces", params={"format": "otlp"})
+    assert r.status_code == 200
+    assert r.json()["resourceSpans"][0]["scopeSpans"][0]["spans"] == []
+
+    r = client.get("/admin/traces", params={"format": "zipkin"})
+    assert r.status_code == 400
@@ -0,0 +1,76 @@
+import aiohttp
+import orjson
+import pytest
+import structlog.stdlib
+from aiohttp import web
+
+from bento_service_registry.data_types import DataTypeManager
+from bento_service_registry.transport import close_unix_socket_sessions, get_upstream_target
+
+from .conftest import make_config
+from .test_models import DATA_TYPE
+
+PUBLIC_URL = "https://bento.local/api/metadata"
+
+
+def test_bento_services_internal_keys_not_served(client):
+    r = client.get("/bento-services")
+    assert r.status_code == 200
+    for sv in r.json().values():
+        assert "internal_url" not in sv
+        assert "unix_socket" not in sv
+
+
+@pytest.mark.asyncio
+async def test_upstream_target_selection():
+    config = make_config()
+    base = {"service_kind": "metadata", "url_template": "", "repository": "", "url": PUBLIC_URL}
+
+    async with aiohttp.ClientSession() as http_session:
+        t = get_upstream_target(config, http_session, PUBLIC_URL, None)
+        assert t.session is http_session
+        assert t.url("data-types") == f"{PUBLIC_URL}/data-types"
+
+        t = get_upstream_target(config, http_session, PUBLIC_URL, {**base, "internal_url": "http://katsu:8000"})
+        assert t.session is http_session
+        assert t.url("data-types") == "http://katsu:8000/data-types"
+
+        t = get_upstream_target(config, http_session, PUBLIC_URL, {**base, "unix_socket": "/tmp/katsu.sock"})
+        assert t.session is not http_session
+        assert isinstance(t.session.connector, aiohttp.UnixConnector)
+        assert t.url("data-types") == "http://localhost/data-types"
+
+        await close_unix_socket_sessions()
+        assert t.session.closed
+
+
+@pytest.mark.asyncio
+async def test_data_types_over_unix_socket(tmp_path, fake_upstream):
+    socket_path = str(tmp_path / "katsu.sock")
+
+    async def data_types_handler(_request: web.Request):
+        return web.Response(body=orjson.dumps([DATA_TYPE]), content_type="application/json")
+
+    await fake_upstream({"/data-types": data_types_handler}, unix_socket=socket_path)
+
+    dtm = DataTypeManager(make_config(), structlog.stdlib.get_logger())
+    service = {"url": PUBLIC_URL, "version": "1.0.0", "bento": {"serviceKind": "metadata", "dataService": True}}
+    bento_services_by_kind = {
+        "metadata": {
+            "service_kind": "metadata",
+            "url_template": PUBLIC_URL,
+            "repository": "",
+            "url": PUBLIC_URL,
+            "unix_socket": socket_path,
+        }
+    }
+
+    try:
+        async with aiohttp.ClientSession() as http_session:
+            dts = await dtm.get_data_types(None, http_session, (service,), bento_services_by_kind, None, None)
+    finally:
+        await close_unix_socket_sessions()
+
+    assert len(dts) == 1
+    assert dts[0].id == DATA_TYPE["id"]
+    assert dts[0].service_base_url == f"{PUBLIC_URL}/"  # the public URL is still what gets reported
@@ -0,0 +1,123 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from bento_service_registry.scheduler import UpstreamScheduler
+from bento_service_registry.transport import get_upstream_target
+from bento_service_registry.upstream import LatencyTracker, UpstreamFetcher
+
+from .conftest import make_config
+
+
+async def _get(config, base_url: str, latencies: list[float] | None = None):
+    fetcher = UpstreamFetcher(config, UpstreamScheduler(8, 8))
+    async with aiohttp.ClientSession() as http_session:
+        target = get_upstream_target(config, http_session, base_url, None)
+        for t in latencies or []:
+            fetcher.latencies.record(target.upstream_key, t)
+        return await fetcher.get(target, target.url("service-info"), None)
+
+
+def test_latency_tracker():
+    lt = LatencyTracker(window=100, min_samples=20)
+    for i in range(19):
+        lt.record("a", i)
+    assert lt.p95("a") is None
+    assert lt.p95("b") is None
+
+    lt.record("a", 19)
+    assert lt.p95("a") == 18
+
+    for i in range(100):
+        lt.record("a", 100 + i)  # older samples fall out of the window
+    assert lt.p95("a") == 194
+
+
+@pytest.mark.asyncio
+async def test_retry_on_gateway_error(fake_upstream):
+    n_calls = 0
+
+    async def handler(_request):
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls == 1:
+            return web.Response(status=503)
+        return web.json_response({"id": "test"})
+
+    upstream = await fake_upstream({"/service-info": handler})
+    res = await _get(make_config(upstream_retry_backoff=0.01), upstream.url)
+
+    assert n_calls == 2
+    assert res.status == 200
+    assert res.json() == {"id": "test"}
+
+
+@pytest.mark.asyncio
+async def test_retries_exhausted(fake_upstream):
+    n_calls = 0
+
+    async def handler(_request):
+        nonlocal n_calls
+        n_calls += 1
+        return web.Response(status=502, text="bad gateway")
+
+    upstream = await fake_upstream({"/service-info": handler})
+    res = await _get(make_config(upstream_retries=2, upstream_retry_backoff=0.01), upstream.url)
+
+    assert n_calls == 3
+    assert res.status == 502
+    assert res.text() == "bad gateway"
+
+
+@pytest.mark.asyncio
+async def test_no_retry_past_deadline(fake_upstream):
+    n_calls = 0
+
+    async def handler(_request):
+        nonlocal n_calls
+        n_calls += 1
+        return web.Response(status=503)
+
+    upstream = await fake_upstream({"/service-info": handler})
+    # the service usually takes longer to respond than the time left before the deadline
+    res = await _get(make_config(contact_timeout=1), upstream.url, latencies=[2.0] * 20)
+
+    assert n_calls == 1
+    assert res.status == 503
+
+
+@pytest.mark.asyncio
+async def test_connection_error_raised(fake_upstream):
+    async def handler(_request):
+        return web.Response()
+
+    upstream = await fake_upstream({"/service-info": handler})
+    await upstream.stop()  # nothing listening anymore
+
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await _get(make_config(upstream_retry_backoff=0.01), upstream.url)
+
+
+@pytest.mark.asyncio
+async def test_hedged_request(fake_upstream):
+    n_calls = 0
+
+    async def handler(_request):
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls == 1:
+            await asyncio.sleep(1)
+            return web.json_response({"id": "slow"})
+        return web.json_response({"id": "fast"})
+
+    upstream = await fake_upstream({"/service-info": handler})
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    res = await _get(make_config(upstream_hedging=True), upstream.url, latencies=[0.05] * 20)
+    time_taken = loop.time() - start
+
+    assert n_calls == 2
+    assert res.json() == {"id": "fast"}
+    assert time_taken < 0.8
@@ -0,0 +1,60 @@
+import pytest
+import structlog.stdlib
+
+from bento_service_registry.workflow_merge import WorkflowConflict, merge_workflows
+from bento_service_registry.workflows import WorkflowManager
+
+from .conftest import make_config
+
+KATSU = "http://katsu.local/"
+DRS = "http://drs.local/"
+
+
+def test_merge_workflows():
+    katsu = {"ingestion": {"a": "katsu-a", "b": "katsu-b"}, "analysis": {"x": "katsu-x"}}
+    drs = {"ingestion": {"b": "drs-b"}, "export": {"e": "drs-e"}}
+
+    m1 = merge_workflows((KATSU, DRS), (katsu, drs))
+    assert m1.by_purpose == {
+        "ingestion": {"a": "katsu-a", "b": "drs-b"},  # later services' workflows take precedence
+        "analysis": {"x": "katsu-x"},
+        "export": {"e": "drs-e"},
+    }
+    assert m1.conflicts == (WorkflowConflict("ingestion", "b", (KATSU, DRS)),)
+
+    # only the purposes which a changed provider contributes to (before or after the change) are re-merged
+    drs2 = {"ingestion": {"c": "drs-c"}}
+    m2 = merge_workflows((KATSU, DRS), (katsu, drs2), m1)
+    assert m2.by_purpose == {"ingestion": {"a": "katsu-a", "b": "katsu-b", "c": "drs-c"}, "analysis": {"x": "katsu-x"}}
+    assert m2.by_purpose["analysis"] is m1.by_purpose["analysis"]
+    assert m2.by_purpose["ingestion"] is not m1.by_purpose["ingestion"]
+    assert m2.conflicts == ()
+
+    # same result as a full merge
+    assert m2 == merge_workflows((KATSU, DRS), (katsu, drs2))
+
+    # a base with different providers isn't used
+    m3 = merge_workflows((KATSU,), (katsu,), m2)
+    assert m3.by_purpose["analysis"] == katsu["analysis"]
+    assert m3.by_purpose["analysis"] is not m2.by_purpose["analysis"]
+
+
+@pytest.mark.asyncio
+async def test_workflow_manager_merge():
+    wm = WorkflowManager(make_config(), structlog.stdlib.get_logger())
+
+    async def _fake_get_workflows_from_service(_authz_header, _http_session, service, _bento_service, _start):
+        return wm._dedupe(service["url"], {"ingestion": {"wf": {"name": service["url"]}}})
+
+    wm.get_workflows_from_service = _fake_get_workflows_from_service
+
+    services = tuple({"url": u, "bento": {"serviceKind": u, "workflowProvider": True}} for u in (KATSU, DRS))
+
+    wfs_a = await wm.get_workflows({"Authorization": "Bearer a"}, None, services, {})
+    wfs_b = await wm.get_workflows({"Authorization": "Bearer b"}, None, services, {})
+    assert wfs_b is wfs_a  # same workflows from each service; the merged view is shared between tokens
+    assert wfs_a["ingestion"]["wf"] == {"name": DRS}
+
+    (conflict,) = wm.get_conflicts({"Authorization": "Bearer b"})
+    assert (conflict.purpose, conflict.workflow_id, conflict.service_base_urls) == ("ingestion", "wf", (KATSU, DRS))
+    assert wm.get_conflicts({"Authorization": "Bearer c"}) == ()  # nothing collected yet